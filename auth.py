@@ -0,0 +1,12 @@
+import hmac
+from typing import Optional
+from fastapi import Header, HTTPException
+from config import settings
+
+ADMIN_TOKEN = settings.admin_token
+
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    # Admin endpoints stay closed unless a token is configured
+    if not ADMIN_TOKEN or not hmac.compare_digest(x_admin_token or "", ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Forbidden")
@@ -0,0 +1,73 @@
+"""
+End-to-end /book latency against the local fake reservation site.
+
+    python -m benchmarks.booking_latency --latency 0.05 --bookings 20
+"""
+import argparse
+import os
+import statistics
+import time
+from datetime import date, timedelta
+from benchmarks.fake_site import FakeReservationSite
+
+
+def measure(site, bookings):
+    """Cold, warm-session and prefetched book_slot timings against a running fake site."""
+    # Imported late so the app picks up RESV_BASE_URL pointing at the fake site
+    from routes.book import BookingRequest, book_slot, prefetch_timetable, booking_date
+    from resv_session import sessions
+
+    day = date.today() + timedelta(days=1)
+    request = BookingRequest(login_id="bench", login_pw="bench", month=day.month, day=day.day,
+                             start_time="00:00", end_time="23:59", room="A", id=1, day_of_week="")
+
+    def run(prefetch=False):
+        totals = []
+        steps = {}
+        for _ in range(bookings):
+            if prefetch:
+                prefetch_timetable(request.login_id, request.login_pw, booking_date(request.month, request.day))
+            started = time.perf_counter()
+            result = book_slot(request)
+            site.booked.clear()  # keep the slot open for the next run
+            totals.append((time.perf_counter() - started) * 1000)
+            for name, ms in result["timings_ms"].items():
+                steps.setdefault(name, []).append(ms)
+        return {
+            "median_ms": round(statistics.median(totals), 1),
+            "steps_median_ms": {name: round(statistics.median(values), 1) for name, values in steps.items()},
+        }
+
+    sessions.invalidate(request.login_id)
+    started = time.perf_counter()
+    book_slot(request)
+    site.booked.clear()
+    cold_ms = round((time.perf_counter() - started) * 1000, 1)
+    return {
+        "bookings": bookings,
+        "cold_ms": cold_ms,
+        "warm": run(),
+        "prefetched": run(prefetch=True),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds per fake-site request")
+    parser.add_argument("--bookings", type=int, default=20)
+    args = parser.parse_args()
+
+    site = FakeReservationSite(latency=args.latency).start()
+    os.environ["RESV_BASE_URL"] = site.base_url
+    results = measure(site, args.bookings)
+    print(f"{'cold (login)':22s} {results['cold_ms']:8.1f} ms")
+    for label, key in (("warm session", "warm"), ("warm + prefetched", "prefetched")):
+        run = results[key]
+        print(f"{label:22s} median {run['median_ms']:8.1f} ms   "
+              + "  ".join(f"{name} {ms:.1f}" for name, ms in run["steps_median_ms"].items()))
+    print(f"fake site requests: {dict(site.requests)}")
+    site.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""
+Per-recipient rendering (make_email_body_html for every subscriber) against
+rendering the slot table once and filling in only the unsubscribe link.
+
+    python -m benchmarks.email_render --slots 10 100 1000 --subscribers 10000
+"""
+import argparse
+import time
+from datetime import date, time as dtime, timedelta
+from routes.send_emails import compile_email_body, make_email_body_html
+
+
+def make_slots(count):
+    start = date.today()
+    return [{
+        "date": start + timedelta(days=i // 8),
+        "starttime": dtime(9 + i % 8, 0),
+        "endtime": dtime(10 + i % 8, 0),
+        "room": str(1 + i % 4),
+        "remain": i % 3,
+    } for i in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--slots", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--subscribers", type=int, default=10000)
+    args = parser.parse_args()
+
+    urls = [f"https://jp-training.vercel.app/unsubscribe?email=user{i}@example.com"
+            for i in range(args.subscribers)]
+
+    for count in args.slots:
+        slots = make_slots(count)
+
+        started = time.perf_counter()
+        for url in urls:
+            make_email_body_html(slots, unsubscribe_url=url)
+        per_recipient = time.perf_counter() - started
+
+        started = time.perf_counter()
+        template = compile_email_body(slots)
+        for url in urls:
+            template.render(unsubscribe_url=url)
+        compiled = time.perf_counter() - started
+
+        print(f"{count:5d} slots x {len(urls)} subscribers: "
+              f"per-recipient {per_recipient:8.3f}s  compiled {compiled:8.3f}s  "
+              f"({per_recipient / compiled:6.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Everything the app talks to, stood up locally for a benchmark run: a
+throwaway Postgres (pgserver), the fake reservation site and an SMTP sink.
+The app reads its settings at import time, so enter the environment before
+importing any app module.
+"""
+import os
+import tempfile
+from contextlib import contextmanager
+from urllib.parse import parse_qs, urlsplit
+from benchmarks.fake_site import FakeReservationSite
+from benchmarks.smtp_sink import SMTPSink
+
+
+@contextmanager
+def local_postgres(pgdata=None):
+    """
+    Yield connection settings for a Postgres started in `pgdata`, or in a
+    temporary directory that is deleted afterwards.
+    """
+    import pgserver  # only needed for benchmarks
+
+    with tempfile.TemporaryDirectory(prefix="jp-bench-") as tmp:
+        server = pgserver.get_server(pgdata or tmp, cleanup_mode="stop" if pgdata else "delete")
+        try:
+            # Unix socket directory, e.g. postgresql://postgres:@/postgres?host=/tmp/...
+            host = parse_qs(urlsplit(server.get_uri()).query)["host"][0]
+            yield {"NEON_DB_HOST": host, "NEON_DB_DATABASE": "postgres",
+                   "NEON_DB_USER": "postgres", "NEON_DB_PASSWORD": ""}
+        finally:
+            server.cleanup()
+
+
+@contextmanager
+def bench_environment(site_latency=0.05, smtp_latency=0.0, days_with_data=70, pgdata=None, db_dsn=None):
+    """
+    Start the stand-ins and point the app's environment variables at them.
+    Pass `db_dsn` to use an existing database instead of a throwaway one.
+    Yields (site, sink).
+    """
+    site = FakeReservationSite(latency=site_latency, days_with_data=days_with_data).start()
+    sink = SMTPSink(latency=smtp_latency).start()
+    os.environ.update({
+        "RESV_BASE_URL": site.base_url,
+        "JP_ID": "bench",
+        "JP_PASSWORD": "bench",
+        "EMAIL_HOST": sink.host,
+        "EMAIL_PORT": str(sink.port),
+        "EMAIL_USER": "bench",
+        "EMAIL_PASS": "bench",
+        "EMAIL_STARTTLS": "0",
+        "EMAIL_MAX_RATE": "0",
+        # Scenarios drive this work themselves
+        "OUTBOX_WORKER": "0",
+        "BOOKING_WATCHER": "0",
+        "SYNC_SCHEDULER": "0",
+    })
+    try:
+        # Set before this, since running the migrations loads the settings
+        with database_environment(pgdata, db_dsn):
+            yield site, sink
+    finally:
+        sink.stop()
+        site.stop()
+
+
+@contextmanager
+def database_environment(pgdata=None, db_dsn=None):
+    """Point the app at a migrated database: `db_dsn` if given, else a throwaway local one."""
+    with (_existing_db(db_dsn) if db_dsn else local_postgres(pgdata)) as db_env:
+        os.environ.update(db_env)
+        from migrate import run_migrations
+
+        run_migrations()
+        yield
+
+
+@contextmanager
+def _existing_db(dsn):
+    # Every connection setting comes from the DSN, so nothing falls through to .env
+    from psycopg2.extensions import parse_dsn
+
+    params = parse_dsn(dsn)
+    missing = {"host", "dbname", "user"} - set(params)
+    if missing:
+        raise ValueError(f"DSN is missing {', '.join(sorted(missing))}")
+    yield {"NEON_DB_HOST": params["host"], "NEON_DB_PORT": params.get("port", "5432"),
+           "NEON_DB_DATABASE": params["dbname"], "NEON_DB_USER": params["user"],
+           "NEON_DB_PASSWORD": params.get("password", "")}
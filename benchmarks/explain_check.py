@@ -0,0 +1,219 @@
+"""
+EXPLAIN ANALYZE regression check for the hot schedules and emails queries,
+run against a throwaway Postgres seeded with a year of synthetic slots.
+Exits non-zero when a query stops using its index, reads schedules
+partitions of past months, or gets too slow.
+
+    python -m benchmarks.explain_check
+    python -m benchmarks.explain_check --days 365 --subscribers 20000 --json plans.json
+"""
+import argparse
+import json
+import sys
+from datetime import date, timedelta
+from typing import NamedTuple, Optional, Tuple
+from benchmarks.environment import database_environment
+
+ROOMS = ["A", "B", "C", "D", "E", "F"]
+TIMES = [("09:00", "09:50"), ("10:00", "10:50"), ("11:00", "11:50"), ("13:00", "13:50"),
+         ("14:00", "14:50"), ("15:00", "15:50"), ("16:00", "16:50"), ("17:00", "17:50")]
+# Days the reservation site publishes ahead; everything before today is history
+FUTURE_DAYS = 70
+CHECKED_TABLES = {"schedules", "emails"}
+
+
+class Check(NamedTuple):
+    name: str
+    sql: str
+    params: tuple
+    index: Optional[str]  # the plan must use it
+    current_only: bool = False  # may only read schedules partitions from this month on
+    max_ms: Optional[float] = None  # defaults to --max-ms
+    avoids: Tuple[str, ...] = ()  # tables the plan must not read at all
+
+
+def seed(cursor, days, subscribers):
+    from partitions import ensure_partitions
+
+    today = date.today()
+    ensure_partitions(cursor, today - timedelta(days=days - FUTURE_DAYS), today + timedelta(days=FUTURE_DAYS))
+    cursor.execute(
+        """
+        INSERT INTO schedules (date, starttime, endtime, room, remain)
+        SELECT d::date, t.starttime, t.endtime, r.room,
+               CASE WHEN d < CURRENT_DATE THEN (random() < 0.05)::int ELSE floor(random() * 4)::int END
+        FROM generate_series(CURRENT_DATE - %s, CURRENT_DATE + %s, INTERVAL '1 day') AS d,
+             unnest(%s::time[], %s::time[]) AS t(starttime, endtime),
+             unnest(%s::text[]) AS r(room)
+        ON CONFLICT DO NOTHING
+        """,
+        (days - FUTURE_DAYS, FUTURE_DAYS - 1, [start for start, _ in TIMES], [end for _, end in TIMES], ROOMS),
+    )
+    # Occupancy history as the 10-minute syncs would have logged it: each slot is seen from 70 days
+    # ahead, with one observation per step its remain takes down to 0 (the seeded slots open first,
+    # so the first-open and first-full rollup is a plain min per slot)
+    cursor.execute("INSERT INTO occupancy_slots (date, starttime, endtime, room) "
+                   "SELECT date, starttime, endtime, room FROM schedules ON CONFLICT DO NOTHING")
+    cursor.execute(
+        """
+        INSERT INTO slot_occupancy (slot_id, observed_at, remain)
+        SELECT s.id, date_bin('10 minutes', s.visible_at + step * s.span / s.capacity, TIMESTAMP '2000-01-01'),
+               s.capacity - step
+        FROM (
+            SELECT id, date - %s AS visible_at, 1 + floor(random() * 4)::int AS capacity,
+                   random() * make_interval(days => %s) AS span
+            FROM occupancy_slots
+        ) AS s, generate_series(0, s.capacity) AS step
+        WHERE s.visible_at + step * s.span / s.capacity <= now()
+        ON CONFLICT DO NOTHING
+        """,
+        (FUTURE_DAYS, FUTURE_DAYS),
+    )
+    cursor.execute(
+        """
+        UPDATE occupancy_slots s SET opened_at = o.opened_at, filled_at = o.filled_at
+        FROM (
+            SELECT slot_id, min(observed_at) FILTER (WHERE remain > 0) AS opened_at,
+                   min(observed_at) FILTER (WHERE remain <= 0) AS filled_at
+            FROM slot_occupancy GROUP BY slot_id
+        ) AS o
+        WHERE s.id = o.slot_id
+        """
+    )
+    cursor.execute(
+        """
+        INSERT INTO emails (email)
+        SELECT 'Subscriber' || i || '@Example.com' FROM generate_series(1, %s) AS i
+        ON CONFLICT DO NOTHING
+        """,
+        (subscribers,),
+    )
+
+
+def checks():
+    """The statements the app runs, with what their plans must look like."""
+    from routes.send_emails import OPEN_SLOTS_QUERY
+    from routes.unsubscribe import UNSUBSCRIBE_QUERY
+    from occupancy import FILL_TIMES_QUERY
+    from schedules import PREVIOUS_SLOTS_QUERY
+
+    soon = date.today() + timedelta(days=10)
+    return [
+        Check("open_slots", OPEN_SLOTS_QUERY, (), "schedules_open_slots", current_only=True),
+        Check("previous_slots", PREVIOUS_SLOTS_QUERY, ([soon, soon + timedelta(days=1)],), "schedules_natural_key",
+              current_only=True),
+        Check("unsubscribe", UNSUBSCRIBE_QUERY, ("subscriber77@example.com",), "emails_email_lower"),
+        # Aggregates a year of slots (read whole, so no index is expected) and its time grows with --days;
+        # what must hold is that it reads the per-slot rollup and never the observation log itself
+        Check("fill_times", FILL_TIMES_QUERY, (date.today() - timedelta(days=365), date.today(), None, None),
+              None, max_ms=250, avoids=("slot_occupancy",)),
+    ]
+
+
+def plan_nodes(node):
+    yield node
+    for child in node.get("Plans", []):
+        yield from plan_nodes(child)
+
+
+def partition_layout(cursor):
+    """(partition -> month it starts, partition index -> the schedules index it belongs to)."""
+    from partitions import list_partitions
+
+    months = {name: first for name, first, _ in list_partitions(cursor)}
+    cursor.execute(
+        """
+        SELECT parent.relname AS parent, tree.relid::regclass::text AS child
+        FROM pg_class parent, pg_partition_tree(parent.oid) AS tree
+        WHERE parent.relkind = 'I' AND parent.relname LIKE 'schedules\\_%'
+        """
+    )
+    indexes = {row["child"]: row["parent"] for row in cursor.fetchall()}
+    return months, indexes
+
+
+def explain(cursor, sql, params, layout):
+    months, indexes = layout
+    cursor.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + sql, params)
+    plan = cursor.fetchone()["QUERY PLAN"][0]
+    nodes = list(plan_nodes(plan["Plan"]))
+    return {
+        "execution_ms": plan["Execution Time"],
+        "nodes": [node["Node Type"] for node in nodes],
+        "indexes": sorted({indexes.get(node["Index Name"], node["Index Name"]) for node in nodes if "Index Name" in node}),
+        "seq_scans": sorted({"schedules" if node["Relation Name"] in months else node["Relation Name"]
+                             for node in nodes if node["Node Type"] == "Seq Scan"}),
+        "relations": sorted({node["Relation Name"] for node in nodes if "Relation Name" in node}),
+        "partitions": sorted({node["Relation Name"] for node in nodes if node.get("Relation Name") in months}),
+        "oldest_month": min((months[node["Relation Name"]] for node in nodes if node.get("Relation Name") in months),
+                            default=None),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--days", type=int, default=365, help="days of synthetic slots, ending 70 days ahead")
+    parser.add_argument("--subscribers", type=int, default=20000)
+    parser.add_argument("--max-ms", type=float, default=50, help="slowest acceptable execution time per query, unless the check sets its own")
+    parser.add_argument("--pgdata", help="keep the throwaway database in this directory")
+    parser.add_argument("--json", help="write the plans to this file")
+    args = parser.parse_args()
+
+    with database_environment(args.pgdata):
+        from db import get_connection
+
+        conn = get_connection()
+        try:
+            with conn.cursor() as cursor:
+                seed(cursor, args.days, args.subscribers)
+                cursor.execute("SELECT count(*) AS n FROM schedules")
+                rows = cursor.fetchone()["n"]
+            conn.commit()
+            # Sets the visibility map too, as autovacuum would have by now, so index-only scans are possible
+            conn.autocommit = True
+            with conn.cursor() as cursor:
+                cursor.execute("VACUUM ANALYZE schedules, emails, occupancy_slots, slot_occupancy")
+            conn.autocommit = False
+            print(f"seeded {rows} slots and {args.subscribers} subscribers")
+            with conn.cursor() as cursor:
+                layout = partition_layout(cursor)
+            conn.commit()
+            current_month = date.today().replace(day=1)
+
+            results = {}
+            failures = []
+            for check in checks():
+                name, index = check.name, check.index
+                with conn.cursor() as cursor:
+                    result = explain(cursor, check.sql, check.params, layout)
+                conn.rollback()  # EXPLAIN ANALYZE really runs the DELETE
+                results[name] = result
+                problems = []
+                if index is not None and index not in result["indexes"]:
+                    problems.append(f"does not use {index}")
+                if CHECKED_TABLES & set(result["seq_scans"]):
+                    problems.append(f"seq scan on {', '.join(sorted(CHECKED_TABLES & set(result['seq_scans'])))}")
+                if set(check.avoids) & set(result["relations"]):
+                    problems.append(f"reads {', '.join(sorted(set(check.avoids) & set(result['relations'])))}")
+                if check.current_only and result["oldest_month"] and result["oldest_month"] < current_month:
+                    problems.append(f"reads partitions from {result['oldest_month']:%Y-%m}")
+                max_ms = check.max_ms if check.max_ms is not None else args.max_ms
+                if result["execution_ms"] > max_ms:
+                    problems.append(f"took {result['execution_ms']:.1f} ms")
+                failures += [f"{name}: {problem}" for problem in problems]
+                print(f"{name:16s} {result['execution_ms']:8.2f} ms  {' > '.join(result['nodes']):40s} "
+                      f"{', '.join(result['indexes'])}  partitions {len(result['partitions'])}  "
+                      f"{'FAIL' if problems else 'ok'}")
+        finally:
+            conn.close()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2, default=str)
+    for failure in failures:
+        print(f"FAIL {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""
+Local stand-in for jptraining.resv.jp. Serves the login flow, day timetables
+from benchmarks/fixtures/timetable and the booking forms, with configurable
+latency per request. Point the app at it with RESV_BASE_URL.
+
+    python -m benchmarks.fake_site --port 8765 --latency 0.05
+"""
+import argparse
+import glob
+import os
+import re
+import threading
+import time
+from collections import Counter
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "timetable")
+SESSION_COOKIE = "resv_sid"
+LOGIN_PAGE = "<html><body><form><label>Login ID</label><input name='loginid'></form></body></html>"
+
+DETAIL_PAGE = """<html><body><div class="header">{filler}</div>
+<form action="res_form.php" method="post">
+  <input type="hidden" name="reserve_id" value="{reserve_id}">
+  <input type="submit" name="back" value="Back">
+  <input type="submit" name="submit" value="Proceed to the next">
+</form></body></html>"""
+
+FORM_RESULT_PAGE = """<html><body><div class="header">{filler}</div>
+<form action="res_confirm.php?reserve_id={reserve_id}" method="get"></form></body></html>"""
+
+CONFIRM_PAGE = """<html><body><div class="header">{filler}</div>
+<form action="res_complete.php" method="post">
+  <input type="hidden" name="reserve_id" value="{reserve_id}">
+  <input type="hidden" name="token" value="t{reserve_id}">
+  <input type="submit" name="submit1" value="complete">
+</form></body></html>"""
+
+COMPLETE_PAGE = "<html><body><h1>予約完了 / Reservation Complete</h1></body></html>"
+
+# Bulk that real pages carry around the parts the scraper reads
+FILLER = "<p>" + "lorem ipsum " * 400 + "</p>"
+
+
+class FakeReservationSite:
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, days_with_data=14, pages=None):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.days_with_data = days_with_data
+        self.pages = pages or self.load_pages()
+        self.requests = Counter()
+        self.bookings = 0
+        # reserve_id -> seats taken, subtracted from every page that lists that id
+        self.booked = Counter()
+        self._server = None
+        self._thread = None
+
+    @staticmethod
+    def load_pages():
+        return [open(path, encoding="utf-8").read()
+                for path in sorted(glob.glob(os.path.join(FIXTURES, "day_*.html")))
+                if "empty" not in path]
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}"
+
+    def timetable(self, day):
+        offset = (day - date.today()).days
+        if offset < 0 or offset >= self.days_with_data:
+            return "<div class='no-data'>No lessons available</div>"
+        html = self.pages[offset % len(self.pages)]
+        for reserve_id, taken in self.booked.items():
+            html = re.sub(rf"(reserve_id={reserve_id}&.*?残り)(\d+)",
+                          lambda m: f"{m.group(1)}{max(int(m.group(2)) - taken, 0)}", html, count=1, flags=re.S)
+        return html
+
+    def _handler(self):
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, body, status=200, headers=None):
+                data = body.encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "text/html; charset=UTF-8")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _logged_in(self):
+                return f"{SESSION_COOKIE}=ok" in (self.headers.get("Cookie") or "")
+
+            def _route(self, method):
+                if site.latency:
+                    time.sleep(site.latency)
+                url = urlparse(self.path)
+                path = url.path.rsplit("/", 1)[-1]
+                query = {k: v[0] for k, v in parse_qs(url.query).items()}
+                site.requests[path] += 1
+
+                body = b""
+                if method == "POST":
+                    body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                form = {k: v[0] for k, v in parse_qs(body.decode("utf-8")).items()}
+
+                if path == "usr_login.php":
+                    if form.get("loginpw") == "bad":
+                        return self._reply(LOGIN_PAGE)
+                    return self._reply("<html>ok</html>", headers={"Set-Cookie": f"{SESSION_COOKIE}=ok; Path=/"})
+                if not self._logged_in():
+                    return self._reply(LOGIN_PAGE)
+
+                if path == "get_timetable_pc.php":
+                    day = date(int(query["cur_year"]), int(query["cur_month"]), int(query["cur_day"]))
+                    return self._reply(site.timetable(day))
+                if path == "res_detail.php":
+                    return self._reply(DETAIL_PAGE.format(reserve_id=query.get("reserve_id", ""), filler=FILLER))
+                if path == "res_form.php":
+                    return self._reply(FORM_RESULT_PAGE.format(reserve_id=form.get("reserve_id", ""), filler=FILLER))
+                if path == "res_confirm.php":
+                    return self._reply(CONFIRM_PAGE.format(reserve_id=query.get("reserve_id", ""), filler=FILLER))
+                if path == "res_complete.php":
+                    site.bookings += 1
+                    site.booked[form.get("reserve_id", "")] += 1
+                    return self._reply(COMPLETE_PAGE)
+                return self._reply(f"<html><body>{path}{FILLER}</body></html>")
+
+            def do_GET(self):
+                self._route("GET")
+
+            def do_POST(self):
+                self._route("POST")
+
+        return Handler
+
+    def start(self):
+        self._server = ThreadingHTTPServer((self.host, self.port), self._handler())
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--days-with-data", type=int, default=14)
+    args = parser.parse_args()
+    site = FakeReservationSite(port=args.port, latency=args.latency, days_with_data=args.days_with_data).start()
+    print(f"Fake reservation site on {site.base_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        site.stop()
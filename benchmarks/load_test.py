@@ -0,0 +1,96 @@
+"""
+Mixed-load test for a single uvicorn worker: keep `--slow-concurrency`
+requests to a slow endpoint (default /book) in flight while measuring
+latency of a fast endpoint (default /subscribe).
+
+    uvicorn main:app --workers 1 &
+    python -m benchmarks.load_test --base-url http://127.0.0.1:8000 --slow-concurrency 50
+"""
+import argparse
+import itertools
+import json
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+
+BOOK_PAYLOAD = {
+    "login_id": "bench", "login_pw": "bench", "month": 1, "day": 1,
+    "start_time": "10:00", "end_time": "11:00", "room": "A", "id": 1, "day_of_week": "Mon",
+}
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--slow-path", default="/book")
+    parser.add_argument("--fast-path", default="/subscribe")
+    parser.add_argument("--slow-concurrency", type=int, default=50)
+    parser.add_argument("--fast-concurrency", type=int, default=10)
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    stop = threading.Event()
+    counter = itertools.count()
+    slow_done = []
+    fast_latencies = []
+    fast_errors = []
+
+    def slow_loop():
+        session = requests.Session()
+        while not stop.is_set():
+            try:
+                session.post(args.base_url + args.slow_path, json=BOOK_PAYLOAD, timeout=120)
+                slow_done.append(1)
+            except requests.RequestException:
+                pass
+
+    def fast_loop():
+        session = requests.Session()
+        while not stop.is_set():
+            payload = {"email": f"load{next(counter)}-{time.time_ns()}@example.com"}
+            started = time.perf_counter()
+            try:
+                r = session.post(args.base_url + args.fast_path, json=payload, timeout=120)
+                if r.status_code >= 500:
+                    fast_errors.append(r.status_code)
+                else:
+                    fast_latencies.append(time.perf_counter() - started)
+            except requests.RequestException as e:
+                fast_errors.append(str(e))
+
+    with ThreadPoolExecutor(max_workers=args.slow_concurrency + args.fast_concurrency) as pool:
+        for _ in range(args.slow_concurrency):
+            pool.submit(slow_loop)
+        time.sleep(1)  # let the slow requests occupy the server first
+        for _ in range(args.fast_concurrency):
+            pool.submit(fast_loop)
+        time.sleep(args.duration)
+        stop.set()
+
+    results = {
+        "slow_concurrency": args.slow_concurrency,
+        "slow_completed": len(slow_done),
+        "fast_completed": len(fast_latencies),
+        "fast_errors": len(fast_errors),
+        "fast_rps": len(fast_latencies) / args.duration,
+        "fast_p50_ms": (statistics.median(fast_latencies) * 1000) if fast_latencies else None,
+        "fast_p95_ms": (percentile(fast_latencies, 95) * 1000) if fast_latencies else None,
+    }
+    print(json.dumps(results, indent=2))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
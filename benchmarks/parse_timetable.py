@@ -0,0 +1,40 @@
+"""
+Parse time per timetable page for each installed parser backend.
+
+    python -m benchmarks.parse_timetable --repeat 200
+"""
+import argparse
+import glob
+import os
+import time
+from timetable_parser import available_backends, iter_slots
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "timetable")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--container", default="time-line", choices=["time-line", "lesson"])
+    args = parser.parse_args()
+
+    pages = {os.path.basename(path): open(path, encoding="utf-8").read()
+             for path in sorted(glob.glob(os.path.join(FIXTURES, "*.html")))}
+    backends = available_backends()
+
+    print(f"{'page':22s}" + "".join(f"{name:>14s}" for name in backends) + "   (ms/page)")
+    for name, html in pages.items():
+        timings = []
+        expected = list(iter_slots(html, args.container, "bs4"))
+        for backend in backends:
+            assert list(iter_slots(html, args.container, backend)) == expected, (name, backend)
+            started = time.perf_counter()
+            for _ in range(args.repeat):
+                for _ in iter_slots(html, args.container, backend):
+                    pass
+            timings.append((time.perf_counter() - started) * 1000 / args.repeat)
+        print(f"{name:22s}" + "".join(f"{ms:14.3f}" for ms in timings) + f"   {len(expected)} slots")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+"""
+Reproducible benchmark run against local stand-ins for every external
+service (see benchmarks/environment.py). Results are written as JSON so
+runs can be compared. Needs `pip install -r benchmarks/requirements.txt`.
+
+    python -m benchmarks.run
+    python -m benchmarks.run --scenarios sync,book --site-latency 0.05
+    python -m benchmarks.run --subscribers 100,10000,100000 --drain-limit 10000
+"""
+import argparse
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import requests
+from benchmarks.environment import bench_environment
+from benchmarks.load_test import percentile
+
+SCENARIOS = ("sync", "fanout", "book", "subscribe")
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+
+def elapsed_ms(started):
+    return round((time.perf_counter() - started) * 1000, 1)
+
+
+def sql(statement, params=None, fetch=False):
+    from db import connection
+
+    with connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(statement, params)
+            rows = cursor.fetchall() if fetch else None
+        conn.commit()
+    return rows
+
+
+def run_sync(site, args):
+    """A cold full sync of every day the site publishes, then a warm one where nothing changed."""
+    from routes.timetable import sync_timetable
+    from sync_scheduler import SYNC_MAX_DAYS
+
+    results = {"days": SYNC_MAX_DAYS}
+    for label, force in (("cold", True), ("warm", False)):
+        requests_before = sum(site.requests.values())
+        started = time.perf_counter()
+        result = sync_timetable(force=force, max_days=SYNC_MAX_DAYS)
+        results[label] = {
+            "total_ms": elapsed_ms(started),
+            "stages_ms": result["timings_ms"],
+            "inserted": result["inserted"],
+            "updated": result["updated"],
+            "skipped_days": result["skipped_days"],
+            "site_requests": sum(site.requests.values()) - requests_before,
+        }
+    return results
+
+
+def run_fanout(sink, args):
+    """Queue the slots email for N subscribers, then drain the outbox to the SMTP sink."""
+    from outbox import process_batch
+    from routes.send_emails import send_subscription_email
+    from routes.timetable import sync_timetable
+
+    # Subscribers are only mailed about slots that opened
+    if not sql("SELECT 1 FROM slot_changes LIMIT 1", fetch=True):
+        sync_timetable(force=True)
+
+    results = []
+    for count in args.subscribers:
+        sql("TRUNCATE emails, email_outbox RESTART IDENTITY")
+        sql("""
+            INSERT INTO emails (email)
+            SELECT 'bench' || i || '@example.com' FROM generate_series(1, %s) AS i
+        """, (count,))
+
+        started = time.perf_counter()
+        send_subscription_email()
+        queued = sql("SELECT count(*) AS n, avg(length(body))::int AS body_bytes FROM email_outbox", fetch=True)[0]
+        entry = {"subscribers": count, "enqueue_ms": elapsed_ms(started),
+                 "queued": queued["n"], "body_bytes": queued["body_bytes"]}
+
+        if count <= args.drain_limit:
+            messages_before = sink.messages
+            started = time.perf_counter()
+            while process_batch():
+                pass
+            entry["drain_ms"] = elapsed_ms(started)
+            entry["delivered"] = sink.messages - messages_before
+            entry["delivered_per_second"] = round(entry["delivered"] / (entry["drain_ms"] / 1000), 1)
+        results.append(entry)
+    sql("TRUNCATE emails, email_outbox RESTART IDENTITY")
+    return results
+
+
+def run_book(site, args):
+    from benchmarks.booking_latency import measure
+
+    return measure(site, args.bookings)
+
+
+def run_subscribe(args):
+    """/subscribe throughput through a real uvicorn server with the full middleware stack."""
+    import uvicorn
+
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config("main:app", host="127.0.0.1", port=port,
+                                           log_level="warning", access_log=False))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+
+    url = f"http://127.0.0.1:{port}/subscribe"
+    latencies = []
+    errors = []
+    local = threading.local()
+
+    def post(i):
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        started = time.perf_counter()
+        try:
+            r = local.session.post(url, json={"email": f"sub{i}-{time.time_ns()}@example.com"}, timeout=60)
+            if r.status_code >= 400:
+                errors.append(r.status_code)
+                return
+        except requests.RequestException as e:
+            errors.append(str(e))
+            return
+        latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.subscribe_concurrency) as pool:
+        list(pool.map(post, range(args.subscribe_requests)))
+    duration = time.perf_counter() - started
+
+    server.should_exit = True
+    thread.join()
+    sql("TRUNCATE emails, email_outbox RESTART IDENTITY")
+    return {
+        "requests": args.subscribe_requests,
+        "concurrency": args.subscribe_concurrency,
+        "errors": len(errors),
+        "rps": round(len(latencies) / duration, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 1) if latencies else None,
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1) if latencies else None,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma-separated subset of " + ", ".join(SCENARIOS))
+    parser.add_argument("--site-latency", type=float, default=0.05, help="seconds per fake-site request")
+    parser.add_argument("--smtp-latency", type=float, default=0.0, help="seconds per DATA reply")
+    parser.add_argument("--subscribers", default="100,10000,100000")
+    parser.add_argument("--drain-limit", type=int, default=10000, help="largest fan-out also sent through SMTP")
+    parser.add_argument("--bookings", type=int, default=20)
+    parser.add_argument("--subscribe-requests", type=int, default=2000)
+    parser.add_argument("--subscribe-concurrency", type=int, default=20)
+    parser.add_argument("--db-dsn", help="use this database (a full libpq DSN) instead of a throwaway one; "
+                                         "its emails and outbox are truncated, so --yes-destroy is required too")
+    parser.add_argument("--yes-destroy", action="store_true", help="allow truncating the --db-dsn database")
+    parser.add_argument("--pgdata", help="keep the throwaway database in this directory")
+    parser.add_argument("--output", help=f"results file (default: {RESULTS_DIR}/<timestamp>.json)")
+    args = parser.parse_args()
+    args.subscribers = [int(n) for n in args.subscribers.split(",") if n]
+    scenarios = [name for name in args.scenarios.split(",") if name]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    if args.db_dsn and not args.yes_destroy:
+        parser.error("--db-dsn wipes the emails and outbox tables of that database; pass --yes-destroy to confirm")
+
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    report = {
+        "started_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        # The DSN may carry a password; only whether one was used is recorded
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "db_dsn")},
+        "existing_db": bool(args.db_dsn),
+        "scenarios": {},
+    }
+
+    with bench_environment(args.site_latency, args.smtp_latency, pgdata=args.pgdata, db_dsn=args.db_dsn) as (site, sink):
+        from logging_setup import configure_logging
+        from fetcher import SYNC_MAX_RPS, SYNC_WORKERS
+
+        configure_logging()
+        report["config"].update(SYNC_WORKERS=SYNC_WORKERS, SYNC_MAX_RPS=SYNC_MAX_RPS)
+        runners = {
+            "sync": lambda: run_sync(site, args),
+            "fanout": lambda: run_fanout(sink, args),
+            "book": lambda: run_book(site, args),
+            "subscribe": lambda: run_subscribe(args),
+        }
+        # subscribe runs the app's own lifespan, which closes the pool; keep it last
+        for name in sorted(scenarios, key=SCENARIOS.index):
+            print(f"running {name}...", flush=True)
+            started = time.perf_counter()
+            report["scenarios"][name] = runners[name]()
+            print(f"  done in {time.perf_counter() - started:.1f}s", flush=True)
+
+        # Let go of connections before the stand-ins shut down underneath them
+        from db import close_pool
+        from email_utils import close_mailer
+        from resv_session import sessions
+
+        close_mailer()
+        close_pool()
+        sessions.close()
+
+    output = args.output or os.path.join(RESULTS_DIR, datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2, default=str)
+    print(json.dumps(report["scenarios"], indent=2, default=str))
+    print(f"results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""
+Compare one SMTP session per recipient against the pooled SMTPMailer.
+
+    python -m benchmarks.smtp_fanout --recipients 500 --latency 0.005
+"""
+import argparse
+import smtplib
+import time
+from benchmarks.smtp_sink import SMTPSink
+from email_utils import SMTPMailer, build_message
+
+
+def send_per_message(sink, recipients):
+    # What send_email used to do for every subscriber
+    for to_email in recipients:
+        message = build_message(to_email, "Benchmark", "<p>hello</p>")
+        with smtplib.SMTP(sink.host, sink.port) as server:
+            server.login("bench", "bench")
+            server.sendmail("bench", [to_email], message)
+
+
+def send_pooled(sink, recipients, pool_size):
+    with SMTPMailer(sink.host, sink.port, "bench", "bench", pool_size=pool_size,
+                    max_rate=0, starttls=False) as mailer:
+        mailer.send_many((to_email, "Benchmark", "<p>hello</p>") for to_email in recipients)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--recipients", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds per DATA reply")
+    parser.add_argument("--pool-size", type=int, default=3)
+    args = parser.parse_args()
+
+    recipients = [f"user{i}@example.com" for i in range(args.recipients)]
+    for name, run in (("per-message", lambda s: send_per_message(s, recipients)),
+                      ("pooled", lambda s: send_pooled(s, recipients, args.pool_size))):
+        sink = SMTPSink(latency=args.latency).start()
+        started = time.perf_counter()
+        run(sink)
+        elapsed = time.perf_counter() - started
+        print(f"{name:12s} {elapsed:8.3f}s  {sink.messages} messages, {sink.connections} connections")
+        sink.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+import functools
+from anyio import CapacityLimiter, to_thread
+from config import settings
+
+# Worker threads per kind of blocking work. Each kind has its own budget, so slow
+# bookings or a long sync can't use up the threads short DB requests need.
+LIMITS = {
+    "db": settings.db_threads,
+    "booking": settings.booking_threads,
+    "sync": settings.sync_threads,
+    "health": settings.health_threads,
+}
+
+_limiters = {}
+
+
+def limiter(kind):
+    # Created lazily: limiters bind to the running event loop
+    if kind not in _limiters:
+        _limiters[kind] = CapacityLimiter(LIMITS[kind])
+    return _limiters[kind]
+
+
+async def run_blocking(kind, func, *args, **kwargs):
+    """Run a blocking call off the event loop on the thread budget for `kind`."""
+    return await to_thread.run_sync(functools.partial(func, *args, **kwargs), limiter=limiter(kind))
+
+
+def limiter_stats():
+    return {
+        kind: {"limit": LIMITS[kind], "busy": _limiters[kind].borrowed_tokens if kind in _limiters else 0,
+               "waiting": _limiters[kind].statistics().tasks_waiting if kind in _limiters else 0}
+        for kind in LIMITS
+    }
@@ -0,0 +1,145 @@
+import os
+from dotenv import load_dotenv
+
+
+def _flag(value):
+    # Features are on unless set to 0
+    return value != "0"
+
+
+class Settings:
+    """Every setting the app reads from the environment (and .env), parsed once at startup."""
+
+    def __init__(self, env):
+        get = env.get
+
+        # Database (Neon)
+        self.db_host = get("NEON_DB_HOST")
+        self.db_port = get("NEON_DB_PORT", 5432)
+        self.db_name = get("NEON_DB_DATABASE")
+        self.db_user = get("NEON_DB_USER")
+        self.db_password = get("NEON_DB_PASSWORD")
+        self.db_pool_min = int(get("DB_POOL_MIN", "1"))
+        self.db_pool_max = int(get("DB_POOL_MAX", "10"))
+        self.db_pool_timeout = float(get("DB_POOL_TIMEOUT", "10"))
+        # Connections idle for longer than this are pinged before being handed out
+        # (Neon suspends idle computes and drops their connections)
+        self.db_healthcheck_idle = float(get("DB_HEALTHCHECK_IDLE", "30"))
+
+        # Worker threads per kind of blocking work (see concurrency.py)
+        self.db_threads = int(get("DB_THREADS", "16"))
+        self.booking_threads = int(get("BOOKING_THREADS", "8"))
+        self.sync_threads = int(get("SYNC_THREADS", "1"))
+        self.health_threads = int(get("HEALTH_THREADS", "2"))
+
+        # Reservation site
+        self.resv_base_url = get("RESV_BASE_URL", "https://jptraining.resv.jp").rstrip("/")
+        # The site expires idle logins on its own; stay well below that
+        self.resv_session_ttl = float(get("RESV_SESSION_TTL", "900"))
+        # Logged-in accounts kept; past this the least recently used are dropped
+        self.resv_session_cache_size = int(get("RESV_SESSION_CACHE_SIZE", "256"))
+        # Account used for syncing and for polling watched days
+        self.jp_id = get("JP_ID")
+        self.jp_password = get("JP_PASSWORD")
+        # auto | selectolax | lxml | bs4
+        self.timetable_parser = get("TIMETABLE_PARSER", "auto")
+
+        # Timetable sync
+        self.sync_workers = int(get("SYNC_WORKERS", "6"))
+        self.sync_max_rps = float(get("SYNC_MAX_RPS", "5"))
+        # Set to 0 to leave syncing to external triggers of /timetable/sync
+        self.sync_scheduler = _flag(get("SYNC_SCHEDULER", "1"))
+        # Near days (today onwards) change fastest and are refreshed most often
+        self.sync_near_days = int(get("SYNC_NEAR_DAYS", "4"))
+        self.sync_near_interval = float(get("SYNC_NEAR_INTERVAL", "300"))
+        self.sync_far_interval = float(get("SYNC_FAR_INTERVAL", "3600"))
+        self.sync_tick = float(get("SYNC_TICK", "30"))
+        # A replica that dies mid-sync holds the lease at most this long
+        self.sync_lease_seconds = int(get("SYNC_LEASE_SECONDS", "600"))
+
+        # Schedules retention: monthly partitions that ended more than this many days ago
+        # are summarised into schedule_day_summary and dropped (see partitions.py)
+        self.schedules_retention_days = int(get("SCHEDULES_RETENTION_DAYS", "90"))
+        self.schedules_maintenance_interval = float(get("SCHEDULES_MAINTENANCE_INTERVAL", "86400"))
+
+        # Booking
+        self.booking_timeout = float(get("BOOKING_TIMEOUT", "15"))
+        self.booking_batch_max = int(get("BOOKING_BATCH_MAX", "12"))
+        # Upper bound on bookings in flight per batch; they all share one login
+        self.booking_batch_parallel = int(get("BOOKING_BATCH_PARALLEL", "3"))
+        # Prefetched timetables are only trusted for a short while; slots fill up fast
+        self.booking_prefetch_ttl = float(get("BOOKING_PREFETCH_TTL", "30"))
+        # Prefetches queued or running at once; more are refused with 429
+        self.booking_prefetch_max_pending = int(get("BOOKING_PREFETCH_MAX_PENDING", "16"))
+
+        # Booking watcher: each watched day is polled at watch_interval_min while its
+        # page keeps changing, backing off towards watch_interval_max while it stays the same
+        self.watch_interval_min = float(get("WATCH_INTERVAL_MIN", "3"))
+        self.watch_interval_max = float(get("WATCH_INTERVAL_MAX", "30"))
+        self.watch_backoff = float(get("WATCH_BACKOFF", "1.5"))
+        self.watch_max_attempts = int(get("WATCH_MAX_ATTEMPTS", "3"))
+        self.watch_fetch_workers = int(get("WATCH_FETCH_WORKERS", "4"))
+        self.watch_booking_workers = int(get("WATCH_BOOKING_WORKERS", "4"))
+        self.watch_max_rps = float(get("WATCH_MAX_RPS", "5"))
+        # Open watches whose owning process hasn't checked in for this long are closed by the others
+        self.watch_stale_seconds = float(get("WATCH_STALE_SECONDS", "120"))
+        # Set to 0 to run the API without the watcher thread
+        self.booking_watcher = _flag(get("BOOKING_WATCHER", "1"))
+
+        # Email
+        self.email_host = get("EMAIL_HOST")
+        self.email_port = int(get("EMAIL_PORT", "587"))
+        self.email_user = get("EMAIL_USER")
+        self.email_pass = get("EMAIL_PASS")
+        self.email_starttls = _flag(get("EMAIL_STARTTLS", "1"))
+        # Parallel SMTP sessions used for fan-out sends
+        self.email_pool_size = int(get("EMAIL_POOL_SIZE", "3"))
+        # Messages per second allowed towards one SMTP server (0 disables the cap)
+        self.email_max_rate = float(get("EMAIL_MAX_RATE", "5"))
+        # Many providers cap messages per session; reconnect before hitting that
+        self.email_max_per_connection = int(get("EMAIL_MAX_PER_CONNECTION", "90"))
+        # Idle sessions older than this are dropped instead of reused
+        self.email_idle_timeout = float(get("EMAIL_IDLE_TIMEOUT", "60"))
+        self.subscriber_batch_size = int(get("SUBSCRIBER_BATCH_SIZE", "500"))
+
+        # Outbox
+        self.outbox_batch_size = int(get("OUTBOX_BATCH_SIZE", "50"))
+        self.outbox_poll_interval = float(get("OUTBOX_POLL_INTERVAL", "5"))
+        self.outbox_max_attempts = int(get("OUTBOX_MAX_ATTEMPTS", "5"))
+        self.outbox_backoff_base = float(get("OUTBOX_BACKOFF_BASE", "30"))
+        self.outbox_backoff_max = float(get("OUTBOX_BACKOFF_MAX", "3600"))
+        # How long a claimed batch stays reserved before another worker may retake it
+        self.outbox_lease_seconds = int(get("OUTBOX_LEASE_SECONDS", "300"))
+        # Set to 0 when the worker runs as its own process (python outbox.py)
+        self.outbox_worker = _flag(get("OUTBOX_WORKER", "1"))
+
+        # Caches and streaming
+        self.slots_cache_ttl = float(get("SLOTS_CACHE_TTL", "300"))
+        self.slots_cache_size = int(get("SLOTS_CACHE_SIZE", "512"))
+        # Events a client may fall behind by before it is told to resync and dropped
+        self.sse_queue_size = int(get("SSE_QUEUE_SIZE", "256"))
+        self.sse_heartbeat = float(get("SSE_HEARTBEAT", "15"))
+        # Most missed events replayed to a client reconnecting with Last-Event-ID
+        self.sse_replay_limit = int(get("SSE_REPLAY_LIMIT", "500"))
+
+        # Health checks: results are reused for health_cache_ttl so frequent probes
+        # don't hammer the dependencies
+        self.health_cache_ttl = float(get("HEALTH_CACHE_TTL", "15"))
+        self.health_timeout = float(get("HEALTH_TIMEOUT", "2"))
+        # Checks that must pass for /health/ready to return 200; the rest only report "degraded"
+        self.health_required = set(get("HEALTH_REQUIRED", "database").split(","))
+
+        # Admin endpoints stay closed unless a token is configured
+        self.admin_token = get("ADMIN_TOKEN")
+
+        # Logging: text | json
+        self.log_level = get("LOG_LEVEL", "INFO").upper()
+        self.log_format = get("LOG_FORMAT", "text")
+
+
+def load_settings():
+    load_dotenv()  # a .env file fills in anything the environment doesn't set
+    return Settings(os.environ)
+
+
+settings = load_settings()
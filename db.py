@@ -1,28 +1,288 @@
-import os
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
 import psycopg2
+from psycopg2 import extensions
 from psycopg2.extras import RealDictCursor
-from dotenv import load_dotenv
+from config import settings
+from metrics import DB_QUERY_SECONDS, statement_label
 
-load_dotenv()
+logger = logging.getLogger(__name__)
 
-HOST = os.getenv('NEON_DB_HOST')
-PORT = os.getenv('NEON_DB_PORT', 5432)
-DATABASE = os.getenv('NEON_DB_DATABASE')
-USER = os.getenv('NEON_DB_USER')
-PASSWORD = os.getenv('NEON_DB_PASSWORD')
+HOST = settings.db_host
+PORT = settings.db_port
+DATABASE = settings.db_name
+USER = settings.db_user
+PASSWORD = settings.db_password
+
+POOL_MIN = settings.db_pool_min
+POOL_MAX = settings.db_pool_max
+POOL_TIMEOUT = settings.db_pool_timeout
+HEALTHCHECK_IDLE = settings.db_healthcheck_idle
+
+
+class DatabaseUnavailable(Exception):
+    pass
+
+
+class TimedCursor(RealDictCursor):
+    """Dict rows, with every statement timed into db_query_seconds."""
+
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            DB_QUERY_SECONDS.observe(time.perf_counter() - started, statement=_label(query))
+
+    def executemany(self, query, vars_list):
+        started = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            DB_QUERY_SECONDS.observe(time.perf_counter() - started, statement=_label(query))
+
+
+def _label(query):
+    if isinstance(query, bytes):
+        query = query.decode("utf-8", "replace")
+    elif not isinstance(query, str):
+        query = str(query)  # psycopg2.sql.Composed
+    # execute_values sends statements with their rows inlined; label on the part before them
+    head = query[:400]
+    values = head.upper().find("VALUES")
+    return statement_label(head[:values] if values > 0 else head)
+
+
+def _connect(connect_timeout=10):
+    return psycopg2.connect(
+        host=HOST,
+        port=PORT,
+        database=DATABASE,
+        user=USER,
+        password=PASSWORD,
+        cursor_factory=TimedCursor,  # return dict rows
+        connect_timeout=connect_timeout,
+        keepalives=1,
+        keepalives_idle=30,
+    )
 
 
 def get_connection():
     try:
-        connection = psycopg2.connect(
-            host=HOST,
-            port=PORT,
-            database=DATABASE,
-            user=USER,
-            password=PASSWORD,
-            cursor_factory=RealDictCursor  # return dict rows
-        )
-        return connection
+        return _connect()
     except Exception as e:
-        print(f"Database connection error: {e}")
+        logger.error("Database connection error: %s", e)
         return None
+
+
+class ConnectionPool:
+    """Bounded, thread-safe pool; callers block up to `timeout` when all connections are in use."""
+
+    def __init__(self, minconn=POOL_MIN, maxconn=POOL_MAX, timeout=POOL_TIMEOUT,
+                 healthcheck_idle=HEALTHCHECK_IDLE):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.healthcheck_idle = healthcheck_idle
+        self._idle = []  # (connection, returned_at), most recently used last
+        self._in_use = 0
+        self._waiting = 0
+        self._created = 0
+        self._discarded = 0
+        self._checkouts = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def warm(self):
+        # Hold them all at once; returning each straight away would hand the same one back every time
+        conns = []
+        try:
+            for _ in range(self.minconn):
+                conns.append(self.getconn())
+        finally:
+            for conn in conns:
+                self.putconn(conn)
+
+    def getconn(self, timeout=None, connect_timeout=10):
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise DatabaseUnavailable("Connection pool is closed")
+                if self._idle:
+                    conn, returned_at = self._idle.pop()
+                    self._in_use += 1
+                    break
+                if self._in_use < self.maxconn:
+                    conn, returned_at = None, None
+                    self._in_use += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise DatabaseUnavailable("Timed out waiting for a database connection")
+                # Only callers that actually block count as waiting
+                self._waiting += 1
+                try:
+                    self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+            self._checkouts += 1
+
+        # Connect and health-check outside the lock so other callers aren't blocked on the network
+        try:
+            if conn is not None and not self._is_healthy(conn, returned_at, deadline - time.monotonic()):
+                self._close_quietly(conn)
+                conn = None
+                with self._cond:
+                    self._discarded += 1
+            if conn is None:
+                conn = _connect(connect_timeout)
+                with self._cond:
+                    self._created += 1
+            return conn
+        except Exception as e:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise DatabaseUnavailable(f"Database connection error: {e}") from e
+
+    def putconn(self, conn, discard=False):
+        if not discard and not conn.closed:
+            try:
+                if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                discard = True
+
+        with self._cond:
+            self._in_use -= 1
+            if discard or conn.closed or self._closed:
+                self._discarded += 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+                conn = None
+            self._cond.notify()
+
+        if conn is not None:
+            self._close_quietly(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.getconn()
+        discard = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            discard = True
+            raise
+        except Exception:
+            if not conn.closed:
+                conn.rollback()
+            raise
+        finally:
+            self.putconn(conn, discard=discard)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "waiting": self._waiting,
+                "created": self._created,
+                "discarded": self._discarded,
+                "checkouts": self._checkouts,
+                "max_size": self.maxconn,
+            }
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._cond.notify_all()
+        for conn, _ in idle:
+            self._close_quietly(conn)
+
+    def _is_healthy(self, conn, returned_at, timeout):
+        if conn.closed:
+            return False
+        if time.monotonic() - returned_at < self.healthcheck_idle:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                # The ping gets what is left of the caller's timeout (at least 100ms)
+                cursor.execute("SELECT set_config('statement_timeout', %s, true)",
+                               (str(max(int(timeout * 1000), 100)),))
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def init_pool():
+    """Create the pool at startup, replacing one closed by an earlier close_pool()."""
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.closed:
+            _pool = ConnectionPool()
+    try:
+        _pool.warm()
+    except DatabaseUnavailable as e:
+        logger.warning("Database pool warm-up failed: %s", e)
+    return _pool
+
+
+def get_pool():
+    # After close_pool() this keeps returning the closed pool, which raises DatabaseUnavailable,
+    # so a late caller during shutdown can't open a fresh pool that nothing will close
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool()
+    return _pool
+
+
+def close_pool():
+    with _pool_lock:
+        pool = _pool
+    if pool is not None:
+        pool.close()
+
+
+def connection():
+    return get_pool().connection()
+
+
+def iter_batches(conn, query, params=None, batch_size=1000):
+    """Stream a query's rows through a server-side cursor, `batch_size` rows at a time."""
+    with conn.cursor(name=f"stream_{uuid.uuid4().hex}") as cursor:
+        cursor.itersize = batch_size
+        cursor.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield rows
+
+
+def pool_stats():
+    return get_pool().stats()
@@ -1,28 +1,212 @@
-import os
-import smtplib
-from email.mime.text import MIMEText
-from dotenv import load_dotenv
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from config import settings
+from ratelimit import RateLimiter
+from metrics import SMTP_SEND_SECONDS
 
-load_dotenv()  # Load environment variables from a .env file
+logger = logging.getLogger(__name__)
 
-EMAIL_HOST = os.getenv("EMAIL_HOST")
-EMAIL_PORT = int(os.getenv("EMAIL_PORT", "587"))
-EMAIL_USER = os.getenv("EMAIL_USER")
-EMAIL_PASS = os.getenv("EMAIL_PASS")
+EMAIL_HOST = settings.email_host
+EMAIL_PORT = settings.email_port
+EMAIL_USER = settings.email_user
+EMAIL_PASS = settings.email_pass
+EMAIL_STARTTLS = settings.email_starttls
 
+EMAIL_POOL_SIZE = settings.email_pool_size
+EMAIL_MAX_RATE = settings.email_max_rate
+EMAIL_MAX_PER_CONNECTION = settings.email_max_per_connection
+EMAIL_IDLE_TIMEOUT = settings.email_idle_timeout
 
-def send_email(to_email: str, subject: str, body: str):
-    try:
-        msg = MIMEText(body, "html")
-        msg["Subject"] = subject
-        msg["From"] = "JP Training"
-        msg["To"] = to_email
 
-        with smtplib.SMTP(EMAIL_HOST, EMAIL_PORT) as server:
+def _message_errors():
+    # Rejections of a single message; the session itself stays usable
+    import smtplib
+
+    return (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError)
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def _server_limiter(host, port, rate):
+    # Shared by every mailer talking to the same server
+    with _limiters_lock:
+        key = (host, port)
+        if key not in _limiters:
+            _limiters[key] = RateLimiter(rate)
+        return _limiters[key]
+
+
+def build_message(to_email: str, subject: str, body: str):
+    from email.mime.text import MIMEText
+
+    msg = MIMEText(body, "html")
+    msg["Subject"] = subject
+    msg["From"] = "JP Training"
+    msg["To"] = to_email
+    return msg.as_string()
+
+
+class SMTPMailer:
+    """Keeps authenticated SMTP sessions open and reuses them across messages."""
+
+    def __init__(self, host=EMAIL_HOST, port=EMAIL_PORT, user=EMAIL_USER, password=EMAIL_PASS,
+                 pool_size=EMAIL_POOL_SIZE, max_rate=EMAIL_MAX_RATE,
+                 max_per_connection=EMAIL_MAX_PER_CONNECTION, idle_timeout=EMAIL_IDLE_TIMEOUT,
+                 starttls=EMAIL_STARTTLS):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.pool_size = max(pool_size, 1)
+        self.max_per_connection = max_per_connection
+        self.idle_timeout = idle_timeout
+        self.starttls = starttls
+        self.limiter = _server_limiter(host, port, max_rate)
+        self._idle = []  # [server, messages_sent, last_used]
+        self._slots = threading.BoundedSemaphore(self.pool_size)
+        self._lock = threading.Lock()
+        self.connects = 0
+
+    def _open(self):
+        import smtplib  # the mail stack loads with the first session, not at startup
+
+        server = smtplib.SMTP(self.host, self.port, timeout=30)
+        if self.starttls:
             server.starttls()
-            server.login(EMAIL_USER, EMAIL_PASS)
-            server.sendmail(EMAIL_USER, [to_email], msg.as_string())
-        return True
-    except Exception as e:
-        print(f"Email sending failed: {e}")
-        return False
+        if self.user:
+            server.login(self.user, self.password)
+        with self._lock:
+            self.connects += 1
+        return [server, 0, time.monotonic()]
+
+    def _checkout(self):
+        with self._lock:
+            while self._idle:
+                entry = self._idle.pop()
+                if time.monotonic() - entry[2] < self.idle_timeout:
+                    return entry
+                self._quit(entry[0])
+        return self._open()
+
+    def _checkin(self, entry):
+        entry[2] = time.monotonic()
+        if entry[1] >= self.max_per_connection:
+            self._quit(entry[0])
+            return
+        with self._lock:
+            self._idle.append(entry)
+
+    @staticmethod
+    def _quit(server):
+        try:
+            server.quit()
+        except Exception:
+            try:
+                server.close()
+            except Exception:
+                pass
+
+    def deliver(self, to_email: str, subject: str, body: str):
+        """Send one message, raising on failure."""
+        message = build_message(to_email, subject, body)
+        with self._slots:
+            entry = None
+            for attempt in range(2):
+                try:
+                    if entry is None:
+                        entry = self._checkout()
+                    self.limiter.wait()
+                    started = time.perf_counter()
+                    try:
+                        entry[0].sendmail(self.user, [to_email], message)
+                    except Exception:
+                        SMTP_SEND_SECONDS.observe(time.perf_counter() - started, result="error")
+                        raise
+                    SMTP_SEND_SECONDS.observe(time.perf_counter() - started, result="sent")
+                    entry[1] += 1
+                    self._checkin(entry)
+                    return
+                except _message_errors():
+                    self._checkin(entry)
+                    raise
+                except OSError:
+                    # Session dropped by the server (SMTP errors are OSErrors too): reconnect once and retry
+                    if entry is not None:
+                        self._quit(entry[0])
+                        entry = None
+                    if attempt:
+                        raise
+
+    def send(self, to_email: str, subject: str, body: str):
+        try:
+            self.deliver(to_email, subject, body)
+            return True
+        except Exception as e:
+            logger.warning("Email sending failed: %s", e)
+            return False
+
+    def deliver_many(self, messages):
+        """Send (to_email, subject, body) tuples over the pool; returns one error (or None) per message."""
+        def attempt(message):
+            try:
+                self.deliver(*message)
+                return None
+            except Exception as e:
+                return str(e) or e.__class__.__name__
+
+        messages = list(messages)
+        if len(messages) <= 1 or self.pool_size == 1:
+            return [attempt(m) for m in messages]
+        with ThreadPoolExecutor(max_workers=self.pool_size) as pool:
+            return list(pool.map(attempt, messages))
+
+    def send_many(self, messages):
+        """Send (to_email, subject, body) tuples over the pool; returns [(to_email, success)]."""
+        messages = list(messages)
+        results = []
+        for message, error in zip(messages, self.deliver_many(messages)):
+            if error:
+                logger.warning("Email sending failed: %s", error)
+            results.append((message[0], error is None))
+        return results
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for entry in idle:
+            self._quit(entry[0])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+_mailer = None
+_mailer_lock = threading.Lock()
+
+
+def get_mailer():
+    global _mailer
+    if _mailer is None:
+        with _mailer_lock:
+            if _mailer is None:
+                _mailer = SMTPMailer()
+    return _mailer
+
+
+def close_mailer():
+    global _mailer
+    with _mailer_lock:
+        mailer, _mailer = _mailer, None
+    if mailer is not None:
+        mailer.close()
+
+
+def send_email(to_email: str, subject: str, body: str):
+    return get_mailer().send(to_email, subject, body)
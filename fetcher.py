@@ -0,0 +1,52 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from config import settings
+from ratelimit import RateLimiter
+
+SYNC_WORKERS = settings.sync_workers
+SYNC_MAX_RPS = settings.sync_max_rps
+
+
+def configure_session(session, workers=SYNC_WORKERS):
+    from requests.adapters import HTTPAdapter
+
+    # One keep-alive connection per worker so threads don't queue on the adapter
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(workers, 1))
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def fetch_days(fetch_day, start_date, max_days=70, max_empty_days=3,
+               workers=SYNC_WORKERS, rate=SYNC_MAX_RPS, is_empty=lambda result: not result):
+    """
+    Fetch days concurrently in ordered windows of `workers` days and yield
+    (date, result) in date order. `fetch_day(date)` returns the day's slots;
+    an empty result counts towards `max_empty_days`, and once that many
+    consecutive empty days are seen no further windows are requested.
+    """
+    workers = max(int(workers), 1)
+    limiter = RateLimiter(rate)
+
+    def task(date):
+        limiter.wait()
+        return fetch_day(date)
+
+    empty_days = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for window_start in range(0, max_days, workers):
+            dates = [start_date + timedelta(days=offset)
+                     for offset in range(window_start, min(window_start + workers, max_days))]
+            futures = [pool.submit(task, date) for date in dates]
+
+            for date, future in zip(dates, futures):
+                result = future.result()
+                if is_empty(result):
+                    empty_days += 1
+                else:
+                    empty_days = 0
+                yield date, result
+                if empty_days >= max_empty_days:
+                    for pending in futures:
+                        pending.cancel()
+                    return
@@ -0,0 +1,69 @@
+import hashlib
+from typing import NamedTuple, Optional
+from psycopg2.extras import execute_values
+
+
+class Fingerprint(NamedTuple):
+    content_hash: str
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    slot_count: int = 0
+
+
+def timetable_fragment(html):
+    # Only the timetable blocks matter; scripts and timestamps around them change on every request
+    start = html.find('class="time-line')
+    if start == -1:
+        return ""
+    start = html.rfind('<', 0, start)
+    end = html.rfind('</div>')
+    return html[start:end + len('</div>')] if end > start else html[start:]
+
+
+def content_hash(html):
+    return hashlib.sha256(timetable_fragment(html).encode("utf-8")).hexdigest()
+
+
+def conditional_headers(fingerprint):
+    headers = {}
+    if fingerprint is not None:
+        if fingerprint.etag:
+            headers["If-None-Match"] = fingerprint.etag
+        if fingerprint.last_modified:
+            headers["If-Modified-Since"] = fingerprint.last_modified
+    return headers
+
+
+def load_fingerprints(cursor, start_date, end_date):
+    cursor.execute(
+        """
+        SELECT date, content_hash, etag, last_modified, slot_count
+        FROM timetable_fingerprints
+        WHERE date BETWEEN %s AND %s
+        """,
+        (start_date, end_date)
+    )
+    return {
+        row["date"]: Fingerprint(row["content_hash"], row["etag"], row["last_modified"], row["slot_count"])
+        for row in cursor.fetchall()
+    }
+
+
+def save_fingerprints(cursor, fingerprints):
+    """`fingerprints` maps date -> Fingerprint for days whose content changed."""
+    if not fingerprints:
+        return
+    execute_values(
+        cursor,
+        """
+        INSERT INTO timetable_fingerprints (date, content_hash, etag, last_modified, slot_count)
+        VALUES %s
+        ON CONFLICT (date) DO UPDATE
+        SET content_hash = EXCLUDED.content_hash,
+            etag = EXCLUDED.etag,
+            last_modified = EXCLUDED.last_modified,
+            slot_count = EXCLUDED.slot_count,
+            changed_at = now()
+        """,
+        [(date, *fp) for date, fp in fingerprints.items()],
+    )
@@ -0,0 +1,107 @@
+import logging
+import math
+import threading
+import time
+import psycopg2
+from cache import TTLCache
+from db import get_pool, pool_stats
+import email_utils
+from config import settings
+from resv_session import BASE_URL
+
+logger = logging.getLogger(__name__)
+
+HEALTH_CACHE_TTL = settings.health_cache_ttl
+HEALTH_TIMEOUT = settings.health_timeout
+HEALTH_REQUIRED = settings.health_required
+
+
+def check_database():
+    # Bounded by HEALTH_TIMEOUT throughout, not the pool's and libpq's much longer defaults
+    pool = get_pool()
+    conn = pool.getconn(timeout=HEALTH_TIMEOUT, connect_timeout=max(1, math.ceil(HEALTH_TIMEOUT)))
+    discard = False
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SET LOCAL statement_timeout = %s", (int(HEALTH_TIMEOUT * 1000),))
+            cursor.execute("SELECT 1")
+        conn.commit()
+    except psycopg2.Error:
+        discard = True
+        raise
+    finally:
+        pool.putconn(conn, discard=discard)
+    return pool_stats()
+
+
+def check_smtp():
+    if not email_utils.EMAIL_HOST:
+        raise RuntimeError("EMAIL_HOST is not set")
+    import smtplib
+
+    # Connect and greet only; logging in would count against the provider's limits
+    server = smtplib.SMTP(email_utils.EMAIL_HOST, email_utils.EMAIL_PORT, timeout=HEALTH_TIMEOUT)
+    try:
+        code, _ = server.noop()
+        if code != 250:
+            raise RuntimeError(f"NOOP returned {code}")
+    finally:
+        server.close()
+    return {"host": email_utils.EMAIL_HOST}
+
+
+def check_reservation_site():
+    import requests
+
+    # Headers only; the body is never read
+    with requests.get(BASE_URL, timeout=HEALTH_TIMEOUT, allow_redirects=False, stream=True) as r:
+        if r.status_code >= 500:
+            raise RuntimeError(f"HTTP {r.status_code}")
+        return {"url": BASE_URL, "status_code": r.status_code}
+
+
+# Thread budget each check runs on: the network checks get their own, so a slow
+# SMTP server or site can't hold up database requests
+CHECK_KINDS = {
+    "database": "db",
+    "smtp": "health",
+    "reservation_site": "health",
+}
+
+CHECKS = {
+    "database": check_database,
+    "smtp": check_smtp,
+    "reservation_site": check_reservation_site,
+}
+
+
+class HealthChecks:
+    """Runs dependency checks at most once per HEALTH_CACHE_TTL; concurrent probes share one run."""
+
+    def __init__(self, checks=CHECKS, ttl=HEALTH_CACHE_TTL):
+        self.checks = checks
+        self._results = TTLCache(ttl, len(checks))
+        self._locks = {name: threading.Lock() for name in checks}
+
+    def run(self, name):
+        """Blocking: the cached result of one check, running it if it has expired."""
+        result = self._results.get(name)
+        if result is not None:
+            return result
+        with self._locks[name]:
+            result = self._results.get(name)
+            if result is not None:
+                return result
+            started = time.perf_counter()
+            try:
+                result = {"ok": True, "detail": self.checks[name]()}
+            except Exception as e:
+                logger.warning("Health check %s failed: %s", name, e)
+                result = {"ok": False, "error": str(e) or e.__class__.__name__}
+            result["latency_ms"] = round((time.perf_counter() - started) * 1000, 1)
+            result["checked_at"] = time.time()
+            self._results.set(name, result)
+            return result
+
+
+health_checks = HealthChecks()
@@ -1,16 +1,101 @@
-from fastapi import FastAPI
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
+from logging_setup import configure_logging
+
+configure_logging()
+
 from routes.subscribe import router as subscribe_router
 from routes.unsubscribe import router as unsubscribe_router
-from routes.timetable import router as timetable_router
+from routes.timetable import router as timetable_router, scheduler as sync_scheduler
 from routes.emails import router as emails_router 
-from routes.send_emails import send_subscription_email  
+from routes.send_emails import router as notifications_router
 from routes.book import router as book_router 
+from routes.slots import router as slots_router
+from routes.watches import router as watches_router
+from routes.health import router as health_router
+import db
+from cache import slots_cache
+from concurrency import run_blocking, limiter_stats
+import email_utils
+import outbox
+import resv_session
+import watcher
+from slot_events import slot_hub
+from sync_scheduler import SYNC_SCHEDULER
+import metrics
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Warmed in the background: a suspended Neon compute can take seconds to wake,
+    # and requests shouldn't wait on it before the server starts answering
+    warmup = asyncio.create_task(run_blocking("db", db.init_pool))
+    worker = outbox.OutboxWorker().start() if outbox.OUTBOX_WORKER else None
+    if watcher.BOOKING_WATCHER:
+        watcher.booking_watcher.start()
+    if SYNC_SCHEDULER:
+        sync_scheduler.start()
+    yield
+    warmup.cancel()
+    sync_scheduler.stop()
+    watcher.booking_watcher.stop()
+    slot_hub.close()
+    if worker is not None:
+        worker.stop()
+    db.close_pool()
+    email_utils.close_mailer()
+    resv_session.sessions.close()
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+class MetricsMiddleware:
+    """Times every request into http_request_seconds, labelled by route template rather than raw path."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_timed(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                route = scope.get("route")
+                metrics.HTTP_REQUEST_SECONDS.observe(
+                    time.perf_counter() - started, method=scope["method"],
+                    route=route.path if route is not None else "unmatched", status=status)
+            await send(message)
+
+        await self.app(scope, receive, send_timed)
+
 
-app = FastAPI()
+metrics.Gauge("db_pool_connections", "Database pool connections by state.",
+              lambda: {(state,): db.pool_stats()[state] for state in ("in_use", "idle", "waiting")}, ("state",))
+metrics.Gauge("worker_threads", "Blocking-work threads in use and callers waiting, per budget.",
+              lambda: {(kind, state): stats[state] for kind, stats in limiter_stats().items()
+                       for state in ("busy", "waiting")}, ("kind", "state"))
+metrics.Gauge("resv_sessions_cached", "Logged-in reservation site sessions.",
+              lambda: resv_session.sessions.stats()["cached"])
+metrics.Gauge("booking_watches", "Watches held by the booking watcher, by state.",
+              lambda: {("watching",): watcher.booking_watcher.stats()["watches"],
+                       ("booking",): watcher.booking_watcher.stats()["booking"]}, ("state",))
+metrics.Gauge("sse_clients", "Connected /slots/stream clients.", lambda: slot_hub.stats()["clients"])
+metrics.Gauge("slots_cache_entries", "Entries in the /slots response cache.", lambda: slots_cache.stats()["entries"])
+metrics.Gauge("outbox_depth", "Emails waiting in the outbox.", lambda: outbox.outbox_depth())
 
 origins = ["*"]
 
+app.add_middleware(MetricsMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
@@ -25,16 +110,48 @@ app.include_router(unsubscribe_router)
 app.include_router(timetable_router)
 app.include_router(emails_router) 
 app.include_router(book_router)  
+app.include_router(notifications_router)
+app.include_router(slots_router)
+app.include_router(watches_router)
+app.include_router(health_router)
+
+
+
+@app.get("/db/pool")
+async def db_pool_stats():
+    return db.pool_stats()
+
+
+@app.get("/cache/stats")
+async def cache_stats():
+    return slots_cache.stats()
+
+
+@app.get("/threads")
+async def thread_stats():
+    return limiter_stats()
+
+
+@app.get("/sessions/stats")
+async def session_stats():
+    return resv_session.sessions.stats()
+
+
+@app.get("/outbox/stats")
+async def outbox_stats():
+    try:
+        return await run_blocking("db", outbox.outbox_stats)
+    except db.DatabaseUnavailable:
+        raise HTTPException(status_code=500, detail="Failed to connect to the database")
+
 
+@app.get("/metrics")
+async def prometheus_metrics():
+    # Rendering runs collectors that query the database, so it stays off the event loop
+    body = await run_blocking("db", metrics.render)
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
 
 
-# This endpoint is for testing purposes
-@app.get("/health")
-def health_check():
-    send_subscription_email()
-    return {"status": "ok", "message": "API is running smoothly!"}
-    
-    
 @app.get("/")
-def root():
+async def root():
     return {"message": "Welcome to the JP Training API!"}
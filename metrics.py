@@ -0,0 +1,167 @@
+import bisect
+import re
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+
+# Latency buckets in seconds, from a cached page parse up to a slow reservation-site request
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_registry = []
+_registry_lock = threading.Lock()
+
+
+def _register(metric):
+    with _registry_lock:
+        _registry.append(metric)
+    return metric
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in (*zip(names, values), *extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _register(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{_labels(self.labelnames, key)} {_number(value)}" for key, value in values]
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+        _register(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self):
+        with self._lock:
+            series = sorted((key, list(values)) for key, values in self._series.items())
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for key, values in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, [('le', _number(bound))])} {cumulative}")
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, [('le', '+Inf')])} {values[-1]}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(values[-2])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {values[-1]}")
+        return lines
+
+
+class Gauge:
+    """Read at scrape time from `collect`, which returns a number or {label values tuple: number}."""
+
+    def __init__(self, name, documentation, collect, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.collect = collect
+        self.labelnames = tuple(labelnames)
+        _register(self)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        try:
+            values = self.collect()
+        except Exception:
+            return lines  # a broken collector shouldn't take /metrics down
+        if not isinstance(values, dict):
+            values = {(): values}
+        lines += [f"{self.name}{_labels(self.labelnames, key)} {_number(value)}"
+                  for key, value in sorted(values.items())]
+        return lines
+
+
+def render():
+    """All registered metrics in the Prometheus text exposition format."""
+    with _registry_lock:
+        metrics = list(_registry)
+    lines = []
+    for metric in metrics:
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+
+# The first table a statement reads or writes; skips EXTRACT(EPOCH FROM ...) and function calls
+_STATEMENT = re.compile(r"\b(SELECT|INSERT|UPDATE|DELETE)\b.*?(?<!EPOCH )\b(?:FROM|INTO|JOIN)\s+([a-z_][a-z0-9_]*)\b(?!\()",
+                        re.IGNORECASE | re.DOTALL)
+
+
+@lru_cache(maxsize=512)
+def statement_label(sql):
+    """A low-cardinality name for a statement, e.g. "INSERT email_outbox"."""
+    update = re.match(r"\s*UPDATE\s+([a-z_][a-z0-9_]*)", sql, re.IGNORECASE)
+    if update:
+        return f"UPDATE {update.group(1).lower()}"
+    match = _STATEMENT.search(sql)
+    if match is None:
+        return sql.strip().split(None, 1)[0].upper() if sql.strip() else "UNKNOWN"
+    return f"{match.group(1).upper()} {match.group(2).lower()}"
+
+
+RESV_REQUEST_SECONDS = Histogram(
+    "resv_request_seconds", "Reservation site request latency.", ("endpoint", "method"))
+RESV_REQUEST_ERRORS = Counter(
+    "resv_request_errors_total", "Reservation site requests that failed outright.", ("endpoint", "method"))
+PARSE_SECONDS = Histogram(
+    "parse_seconds", "Time to parse one reservation site page.", ("page",))
+DB_QUERY_SECONDS = Histogram(
+    "db_query_seconds", "Database statement execution time.", ("statement",))
+SMTP_SEND_SECONDS = Histogram(
+    "smtp_send_seconds", "Time to hand one message to the SMTP server.", ("result",))
+SYNC_STAGE_SECONDS = Histogram(
+    "sync_stage_seconds", "Time spent in each stage of a timetable sync.", ("stage",),
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300))
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_seconds", "API request latency until the response starts.", ("method", "route", "status"))
@@ -0,0 +1,53 @@
+import logging
+import os
+from db import get_connection
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+
+
+def pending_migrations(applied):
+    files = sorted(f for f in os.listdir(MIGRATIONS_DIR) if f.endswith(".sql"))
+    return [f for f in files if f not in applied]
+
+
+def run_migrations():
+    connection = get_connection()
+    if connection is None:
+        logger.error("Failed to connect to the database.")
+        return
+
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    name TEXT PRIMARY KEY,
+                    applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+                )
+            """)
+            cursor.execute("SELECT name FROM schema_migrations")
+            applied = {row["name"] for row in cursor.fetchall()}
+        connection.commit()
+
+        for name in pending_migrations(applied):
+            with open(os.path.join(MIGRATIONS_DIR, name)) as f:
+                sql = f.read()
+            # Each migration runs in its own transaction
+            with connection.cursor() as cursor:
+                cursor.execute(sql)
+                cursor.execute("INSERT INTO schema_migrations (name) VALUES (%s)", (name,))
+            connection.commit()
+            logger.info("Applied %s", name)
+
+    except Exception as e:
+        connection.rollback()
+        logger.error("Migration failed: %s", e)
+        raise
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    run_migrations()
@@ -0,0 +1,17 @@
+-- Tables the app started out with, created by hand before migrations existed.
+-- A no-op on existing databases; lets a fresh database be built from migrations alone.
+
+CREATE TABLE IF NOT EXISTS schedules (
+    id SERIAL PRIMARY KEY,
+    date DATE NOT NULL,
+    starttime TIME NOT NULL,
+    endtime TIME NOT NULL,
+    room TEXT NOT NULL,
+    remain INT NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS emails (
+    id SERIAL PRIMARY KEY,
+    email TEXT NOT NULL UNIQUE,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
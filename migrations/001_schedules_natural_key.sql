@@ -0,0 +1,13 @@
+-- Natural key for scraped slots, required by the ON CONFLICT upsert in schedules.py.
+
+-- Collapse duplicates left behind by the old select-then-insert sync, keeping the newest row.
+DELETE FROM schedules a
+USING schedules b
+WHERE a.date = b.date
+  AND a.starttime = b.starttime
+  AND a.endtime = b.endtime
+  AND a.room = b.room
+  AND a.id < b.id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS schedules_natural_key
+    ON schedules (date, starttime, endtime, room);
@@ -0,0 +1,24 @@
+-- Durable queue of outbound mail, drained by the worker in outbox.py.
+
+CREATE TABLE IF NOT EXISTS email_outbox (
+    id BIGSERIAL PRIMARY KEY,
+    to_email TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    body TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',  -- pending | sending | sent | failed
+    attempts INT NOT NULL DEFAULT 0,
+    last_error TEXT,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    next_attempt_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    locked_until TIMESTAMPTZ,
+    sent_at TIMESTAMPTZ
+);
+
+-- Claimable jobs: pending ones, plus ones whose worker died mid-batch
+CREATE INDEX IF NOT EXISTS email_outbox_claimable
+    ON email_outbox (next_attempt_at)
+    WHERE status IN ('pending', 'sending');
+
+CREATE INDEX IF NOT EXISTS email_outbox_sent_at
+    ON email_outbox (sent_at)
+    WHERE status = 'sent';
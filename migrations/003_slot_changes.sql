@@ -0,0 +1,19 @@
+-- Availability changes detected by each sync, and how far each subscriber has been notified.
+
+CREATE TABLE IF NOT EXISTS slot_changes (
+    id BIGSERIAL PRIMARY KEY,
+    date DATE NOT NULL,
+    starttime TIME NOT NULL,
+    endtime TIME NOT NULL,
+    room TEXT NOT NULL,
+    old_remain INT,
+    new_remain INT NOT NULL,
+    kind TEXT NOT NULL,  -- opened | filled | increased | decreased
+    changed_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS slot_changes_slot
+    ON slot_changes (date, starttime, endtime, room);
+
+ALTER TABLE emails ADD COLUMN IF NOT EXISTS last_notified_change_id BIGINT NOT NULL DEFAULT 0;
+ALTER TABLE emails ADD COLUMN IF NOT EXISTS last_notified_at TIMESTAMPTZ;
@@ -0,0 +1,10 @@
+-- Last seen version of each day's timetable, so unchanged days skip parsing and writes.
+
+CREATE TABLE IF NOT EXISTS timetable_fingerprints (
+    date DATE PRIMARY KEY,
+    content_hash TEXT NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    slot_count INT NOT NULL DEFAULT 0,
+    changed_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
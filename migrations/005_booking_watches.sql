@@ -0,0 +1,25 @@
+-- Targets the booking watcher (watcher.py) books as soon as a seat opens.
+
+CREATE TABLE IF NOT EXISTS booking_watches (
+    id BIGSERIAL PRIMARY KEY,
+    login_id TEXT NOT NULL,
+    date DATE NOT NULL,
+    start_time TEXT NOT NULL,
+    end_time TEXT NOT NULL,
+    room TEXT NOT NULL,
+    alternate_rooms TEXT[] NOT NULL DEFAULT '{}',
+    status TEXT NOT NULL DEFAULT 'active',  -- active | booking | booked | failed | expired | cancelled
+    attempts INT NOT NULL DEFAULT 0,
+    booked_room TEXT,
+    last_error TEXT,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+-- One open watch per account and target
+CREATE UNIQUE INDEX IF NOT EXISTS booking_watches_open_target
+    ON booking_watches (login_id, date, start_time, end_time, room)
+    WHERE status IN ('active', 'booking');
+
+CREATE INDEX IF NOT EXISTS booking_watches_login
+    ON booking_watches (login_id, created_at DESC);
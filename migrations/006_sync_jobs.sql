@@ -0,0 +1,30 @@
+-- Timetable sync runs (scheduled and on demand) and the lease that keeps them to one replica at a time.
+
+CREATE TABLE IF NOT EXISTS sync_jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,  -- near | far | full
+    force BOOLEAN NOT NULL DEFAULT false,
+    status TEXT NOT NULL DEFAULT 'queued',  -- queued | running | succeeded | failed | skipped
+    days_done INT NOT NULL DEFAULT 0,
+    result JSONB,
+    error TEXT,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    started_at TIMESTAMPTZ,
+    finished_at TIMESTAMPTZ,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+-- At most one open job per kind; triggers while one is open join it
+CREATE UNIQUE INDEX IF NOT EXISTS sync_jobs_open_kind
+    ON sync_jobs (kind)
+    WHERE status IN ('queued', 'running');
+
+CREATE INDEX IF NOT EXISTS sync_jobs_kind_finished
+    ON sync_jobs (kind, finished_at DESC)
+    WHERE status = 'succeeded';
+
+CREATE TABLE IF NOT EXISTS sync_lease (
+    name TEXT PRIMARY KEY,
+    holder TEXT NOT NULL,
+    expires_at TIMESTAMPTZ NOT NULL
+);
@@ -0,0 +1,16 @@
+-- Indexes for the hot schedules and emails lookups; benchmarks/explain_check.py verifies the plans.
+
+-- Open slots for the notification email (routes/send_emails.py). CURRENT_DATE can't appear in an
+-- index predicate, so the date bound uses the key; INCLUDE lets the query run as an index-only scan.
+CREATE INDEX IF NOT EXISTS schedules_open_slots
+    ON schedules (date, starttime) INCLUDE (endtime, room, remain)
+    WHERE remain > 0;
+
+-- Addresses are unique regardless of case. Case variants already stored keep the earliest subscription.
+DELETE FROM emails a
+USING emails b
+WHERE lower(a.email) = lower(b.email)
+  AND a.id > b.id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS emails_email_lower
+    ON emails (lower(email));
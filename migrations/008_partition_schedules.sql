@@ -0,0 +1,64 @@
+-- Monthly range partitions for schedules, so past months can be summarised and dropped (partitions.py).
+-- Every schedules query filters on date, so syncs and notification emails only touch current partitions.
+
+-- What is kept of a dropped month: one row per day and room
+CREATE TABLE IF NOT EXISTS schedule_day_summary (
+    date DATE NOT NULL,
+    room TEXT NOT NULL,
+    slots INT NOT NULL,
+    open_slots INT NOT NULL,
+    remain_total INT NOT NULL,
+    PRIMARY KEY (date, room)
+);
+
+ALTER TABLE schedules RENAME TO schedules_unpartitioned;
+ALTER INDEX schedules_natural_key RENAME TO schedules_unpartitioned_natural_key;
+ALTER INDEX schedules_open_slots RENAME TO schedules_unpartitioned_open_slots;
+ALTER SEQUENCE schedules_id_seq OWNED BY NONE;
+
+-- The natural key identifies a slot; id is kept for compatibility but is no longer a primary key,
+-- since every unique index on a partitioned table has to include the partition key
+CREATE TABLE schedules (
+    id INT NOT NULL DEFAULT nextval('schedules_id_seq'),
+    date DATE NOT NULL,
+    starttime TIME NOT NULL,
+    endtime TIME NOT NULL,
+    room TEXT NOT NULL,
+    remain INT NOT NULL DEFAULT 0
+) PARTITION BY RANGE (date);
+
+ALTER SEQUENCE schedules_id_seq OWNED BY schedules.id;
+
+CREATE UNIQUE INDEX schedules_natural_key
+    ON schedules (date, starttime, endtime, room);
+
+CREATE INDEX schedules_open_slots
+    ON schedules (date, starttime) INCLUDE (endtime, room, remain)
+    WHERE remain > 0;
+
+-- Creates the partition holding `day` unless it exists; returns its name
+CREATE OR REPLACE FUNCTION ensure_schedules_partition(day DATE) RETURNS TEXT AS $$
+DECLARE
+    first_day DATE := date_trunc('month', day)::date;
+    name TEXT := 'schedules_' || to_char(first_day, '"y"YYYY"m"MM');
+BEGIN
+    IF to_regclass(name) IS NULL THEN
+        EXECUTE format('CREATE TABLE %I PARTITION OF schedules FOR VALUES FROM (%L) TO (%L)',
+                       name, first_day, (first_day + INTERVAL '1 month')::date);
+    END IF;
+    RETURN name;
+END
+$$ LANGUAGE plpgsql;
+
+-- Every month with data, through the months the sync reaches ahead
+SELECT ensure_schedules_partition(month::date)
+FROM generate_series(
+    date_trunc('month', LEAST((SELECT min(date) FROM schedules_unpartitioned), CURRENT_DATE)),
+    date_trunc('month', GREATEST((SELECT max(date) FROM schedules_unpartitioned), CURRENT_DATE + 90)),
+    INTERVAL '1 month'
+) AS month;
+
+INSERT INTO schedules (id, date, starttime, endtime, room, remain)
+SELECT id, date, starttime, endtime, room, remain FROM schedules_unpartitioned;
+
+DROP TABLE schedules_unpartitioned;
@@ -0,0 +1,22 @@
+-- Append-only history of each slot's remain (occupancy.py). Only observations that differ from the
+-- slot's previous one are stored, and slots are referenced by a small integer id, so a year of syncs
+-- stays a few rows per slot. It outlives the schedules partitions and never touches schedules itself.
+
+CREATE TABLE IF NOT EXISTS occupancy_slots (
+    id SERIAL PRIMARY KEY,
+    date DATE NOT NULL,
+    starttime TIME NOT NULL,
+    endtime TIME NOT NULL,
+    room TEXT NOT NULL,
+    -- Rolled up from slot_occupancy as observations arrive: first seen open, and first seen full after that
+    opened_at TIMESTAMPTZ,
+    filled_at TIMESTAMPTZ,
+    UNIQUE (date, starttime, endtime, room)
+);
+
+CREATE TABLE IF NOT EXISTS slot_occupancy (
+    slot_id INT NOT NULL REFERENCES occupancy_slots (id),
+    observed_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    remain SMALLINT NOT NULL,
+    PRIMARY KEY (slot_id, observed_at)
+);
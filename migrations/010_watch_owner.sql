@@ -0,0 +1,12 @@
+-- Each open watch belongs to the watcher process holding its password. That process refreshes
+-- heartbeat_at while it runs; another replica only closes the watch once the heartbeat goes stale.
+
+ALTER TABLE booking_watches ADD COLUMN IF NOT EXISTS owner TEXT;
+ALTER TABLE booking_watches ADD COLUMN IF NOT EXISTS heartbeat_at TIMESTAMPTZ;
+UPDATE booking_watches SET heartbeat_at = updated_at WHERE heartbeat_at IS NULL;
+ALTER TABLE booking_watches ALTER COLUMN heartbeat_at SET DEFAULT now();
+ALTER TABLE booking_watches ALTER COLUMN heartbeat_at SET NOT NULL;
+
+CREATE INDEX IF NOT EXISTS booking_watches_open_owner
+    ON booking_watches (owner, heartbeat_at)
+    WHERE status IN ('active', 'booking');
@@ -0,0 +1,15 @@
+-- Bodies shared by many outbox rows (the slot notification) are stored once. The body is kept
+-- split around the unsubscribe link; each row holds only its recipient and link, and the worker
+-- joins the parts with the link when it sends.
+
+CREATE TABLE IF NOT EXISTS email_messages (
+    id BIGSERIAL PRIMARY KEY,
+    subject TEXT NOT NULL,
+    parts TEXT[] NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+ALTER TABLE email_outbox ADD COLUMN IF NOT EXISTS message_id BIGINT REFERENCES email_messages (id);
+ALTER TABLE email_outbox ADD COLUMN IF NOT EXISTS unsubscribe_url TEXT;
+ALTER TABLE email_outbox ALTER COLUMN subject DROP NOT NULL;
+ALTER TABLE email_outbox ALTER COLUMN body DROP NOT NULL;
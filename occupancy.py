@@ -0,0 +1,70 @@
+from psycopg2.extras import execute_values
+
+OCCUPANCY_BATCH_SIZE = 500
+
+SLOT_IDS_SQL = """
+    INSERT INTO occupancy_slots (date, starttime, endtime, room)
+    VALUES %s
+    ON CONFLICT (date, starttime, endtime, room) DO NOTHING
+"""
+
+# Delta encoding: an observation is only stored when it differs from the slot's latest one.
+# The slot's opened_at/filled_at are kept up to date in the same statement.
+OBSERVATIONS_SQL = """
+    WITH recorded AS (
+        INSERT INTO slot_occupancy (slot_id, remain)
+        SELECT s.id, v.remain
+        FROM (VALUES %s) AS v (date, starttime, endtime, room, remain)
+        JOIN occupancy_slots s USING (date, starttime, endtime, room)
+        WHERE v.remain IS DISTINCT FROM (
+            SELECT o.remain FROM slot_occupancy o
+            WHERE o.slot_id = s.id
+            ORDER BY o.observed_at DESC
+            LIMIT 1
+        )
+        RETURNING slot_id, observed_at, remain
+    ), rolled_up AS (
+        UPDATE occupancy_slots s
+        SET opened_at = COALESCE(s.opened_at, r.observed_at),
+            filled_at = CASE WHEN s.opened_at IS NOT NULL THEN r.observed_at END
+        FROM recorded r
+        WHERE s.id = r.slot_id
+          AND ((s.opened_at IS NULL AND r.remain > 0) OR (s.opened_at IS NOT NULL AND s.filled_at IS NULL AND r.remain <= 0))
+    )
+    SELECT count(*) AS recorded FROM recorded
+"""
+
+FILL_TIMES_QUERY = """
+    SELECT room, EXTRACT(ISODOW FROM date)::int AS weekday,
+           count(*) AS opened,
+           count(filled_at) AS filled,
+           percentile_cont(0.5) WITHIN GROUP (ORDER BY EXTRACT(EPOCH FROM filled_at - opened_at))
+               AS median_seconds_to_full
+    FROM occupancy_slots
+    WHERE date BETWEEN %s AND %s AND (%s::text IS NULL OR room = %s) AND opened_at IS NOT NULL
+    GROUP BY room, weekday
+    ORDER BY room, weekday
+"""
+
+
+def record_observations(cursor, rows, page_size=OCCUPANCY_BATCH_SIZE):
+    """Log scraped (date, starttime, endtime, room, remain) rows; returns how many were new observations."""
+    rows = list({row[:4]: row for row in rows}.values())
+    if not rows:
+        return 0
+    execute_values(cursor, SLOT_IDS_SQL, [row[:4] for row in rows], page_size=page_size)
+    written = execute_values(cursor, OBSERVATIONS_SQL, rows, page_size=page_size, fetch=True)
+    return sum(row["recorded"] if isinstance(row, dict) else row[0] for row in written)
+
+
+def fill_times(cursor, date_from, date_to, room=None):
+    """Median time from first seen open to first seen full, per room and ISO weekday of the slot."""
+    cursor.execute(FILL_TIMES_QUERY, (date_from, date_to, room, room))
+    return [{
+        "room": row["room"],
+        "weekday": row["weekday"],
+        "opened": row["opened"],
+        "filled": row["filled"],
+        "median_minutes_to_full": (round(row["median_seconds_to_full"] / 60, 1)
+                                   if row["median_seconds_to_full"] is not None else None),
+    } for row in cursor.fetchall()]
@@ -0,0 +1,245 @@
+import logging
+import threading
+from psycopg2.extras import execute_values
+from db import connection
+from email_utils import get_mailer
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_BATCH_SIZE = settings.outbox_batch_size
+OUTBOX_POLL_INTERVAL = settings.outbox_poll_interval
+OUTBOX_MAX_ATTEMPTS = settings.outbox_max_attempts
+OUTBOX_BACKOFF_BASE = settings.outbox_backoff_base
+OUTBOX_BACKOFF_MAX = settings.outbox_backoff_max
+OUTBOX_LEASE_SECONDS = settings.outbox_lease_seconds
+OUTBOX_WORKER = settings.outbox_worker
+
+_wakeup = threading.Event()
+
+
+def enqueue_emails(messages, cursor=None):
+    """
+    Queue (to_email, subject, body) tuples for the worker; returns the number queued.
+    With `cursor` the jobs join the caller's transaction, and the caller calls wake()
+    after committing.
+    """
+    messages = list(messages)
+    if not messages:
+        return 0
+    if cursor is not None:
+        _insert_jobs(cursor, messages)
+        return len(messages)
+
+    with connection() as conn:
+        with conn.cursor() as cursor:
+            _insert_jobs(cursor, messages)
+        conn.commit()
+    wake()
+    return len(messages)
+
+
+def _insert_jobs(cursor, messages):
+    execute_values(
+        cursor,
+        "INSERT INTO email_outbox (to_email, subject, body) VALUES %s",
+        messages,
+        page_size=500,
+    )
+
+
+def store_message(cursor, subject, parts):
+    """Store a body shared by many recipients, split around its unsubscribe link; returns its id."""
+    cursor.execute(
+        "INSERT INTO email_messages (subject, parts) VALUES (%s, %s) RETURNING id",
+        (subject, list(parts)),
+    )
+    return cursor.fetchone()["id"]
+
+
+def enqueue_message(cursor, message_id, recipients):
+    """
+    Queue a stored message for (to_email, unsubscribe_url) pairs in the caller's
+    transaction; the caller calls wake() after committing.
+    """
+    execute_values(
+        cursor,
+        "INSERT INTO email_outbox (to_email, message_id, unsubscribe_url) VALUES %s",
+        [(to_email, message_id, unsubscribe_url) for to_email, unsubscribe_url in recipients],
+        page_size=500,
+    )
+    return len(recipients)
+
+
+def wake():
+    _wakeup.set()
+
+
+def enqueue_email(to_email: str, subject: str, body: str):
+    enqueue_emails([(to_email, subject, body)])
+
+
+def claim_batch(limit=OUTBOX_BATCH_SIZE):
+    with connection() as conn:
+        with conn.cursor() as cursor:
+            # Rows of a stored message are rendered here, with their own unsubscribe link
+            cursor.execute(
+                """
+                WITH claimed AS (
+                    UPDATE email_outbox
+                    SET status = 'sending',
+                        attempts = attempts + 1,
+                        locked_until = now() + make_interval(secs => %s)
+                    WHERE id IN (
+                        SELECT id FROM email_outbox
+                        WHERE (status = 'pending' AND next_attempt_at <= now())
+                           OR (status = 'sending' AND locked_until < now())
+                        ORDER BY id
+                        LIMIT %s
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    RETURNING id, to_email, subject, body, message_id, unsubscribe_url, attempts
+                )
+                SELECT c.id, c.to_email, c.attempts,
+                       coalesce(c.subject, m.subject) AS subject,
+                       coalesce(c.body, array_to_string(m.parts, c.unsubscribe_url)) AS body
+                FROM claimed c
+                LEFT JOIN email_messages m ON m.id = c.message_id
+                ORDER BY c.id
+                """,
+                (OUTBOX_LEASE_SECONDS, limit),
+            )
+            jobs = cursor.fetchall()
+        conn.commit()
+    return jobs
+
+
+def backoff_seconds(attempts):
+    return min(OUTBOX_BACKOFF_BASE * 2 ** (attempts - 1), OUTBOX_BACKOFF_MAX)
+
+
+def record_results(jobs, errors):
+    outcomes = []
+    for job, error in zip(jobs, errors):
+        if error is None:
+            outcomes.append((job["id"], "sent", None, 0))
+        elif job["attempts"] >= OUTBOX_MAX_ATTEMPTS:
+            outcomes.append((job["id"], "failed", error, 0))
+        else:
+            outcomes.append((job["id"], "pending", error, backoff_seconds(job["attempts"])))
+
+    with connection() as conn:
+        with conn.cursor() as cursor:
+            execute_values(
+                cursor,
+                """
+                UPDATE email_outbox AS o
+                SET status = v.status,
+                    last_error = v.error,
+                    locked_until = NULL,
+                    sent_at = CASE WHEN v.status = 'sent' THEN now() ELSE o.sent_at END,
+                    next_attempt_at = now() + make_interval(secs => v.delay)
+                FROM (VALUES %s) AS v (id, status, error, delay)
+                WHERE o.id = v.id
+                """,
+                outcomes,
+                template="(%s::bigint, %s, %s, %s::float8)",
+            )
+        conn.commit()
+
+
+def process_batch(limit=OUTBOX_BATCH_SIZE):
+    """Claim and send one batch; returns how many jobs were processed."""
+    jobs = claim_batch(limit)
+    if not jobs:
+        return 0
+    errors = get_mailer().deliver_many((job["to_email"], job["subject"], job["body"]) for job in jobs)
+    record_results(jobs, errors)
+    sent = sum(1 for error in errors if error is None)
+    logger.info("Outbox batch: %d sent, %d failed", sent, len(jobs) - sent)
+    return len(jobs)
+
+
+def outbox_depth():
+    with connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT count(*) AS depth FROM email_outbox WHERE status IN ('pending', 'sending')")
+            depth = cursor.fetchone()["depth"]
+        conn.commit()
+    return depth
+
+
+def outbox_stats():
+    with connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT status, count(*) AS count FROM email_outbox GROUP BY status")
+            by_status = {row["status"]: row["count"] for row in cursor.fetchall()}
+            cursor.execute(
+                """
+                SELECT EXTRACT(EPOCH FROM now() - min(created_at)) AS oldest_pending_seconds
+                FROM email_outbox WHERE status = 'pending'
+                """
+            )
+            oldest = cursor.fetchone()["oldest_pending_seconds"]
+            cursor.execute(
+                """
+                SELECT count(*) AS sent,
+                       avg(EXTRACT(EPOCH FROM sent_at - created_at)) AS avg_seconds,
+                       percentile_cont(0.95) WITHIN GROUP (ORDER BY EXTRACT(EPOCH FROM sent_at - created_at)) AS p95_seconds
+                FROM email_outbox
+                WHERE status = 'sent' AND sent_at > now() - INTERVAL '1 hour'
+                """
+            )
+            latency = cursor.fetchone()
+        conn.commit()
+
+    return {
+        "depth": by_status.get("pending", 0) + by_status.get("sending", 0),
+        "by_status": by_status,
+        "oldest_pending_seconds": float(oldest) if oldest is not None else None,
+        "last_hour": {
+            "sent": latency["sent"],
+            "avg_latency_seconds": float(latency["avg_seconds"]) if latency["avg_seconds"] is not None else None,
+            "p95_latency_seconds": float(latency["p95_seconds"]) if latency["p95_seconds"] is not None else None,
+        },
+    }
+
+
+class OutboxWorker:
+    """Drains the outbox on a background thread until stopped."""
+
+    def __init__(self, poll_interval=OUTBOX_POLL_INTERVAL):
+        self.poll_interval = poll_interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def run(self):
+        while not self._stop.is_set():
+            _wakeup.clear()
+            try:
+                processed = process_batch()
+            except Exception as e:
+                logger.exception("Outbox worker error: %s", e)
+                processed = 0
+            if processed:
+                continue  # keep draining while there is work
+            _wakeup.wait(self.poll_interval)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name="outbox-worker", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=10):
+        self._stop.set()
+        _wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+
+if __name__ == "__main__":
+    worker = OutboxWorker()
+    try:
+        worker.run()
+    except KeyboardInterrupt:
+        worker.stop()
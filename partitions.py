@@ -0,0 +1,82 @@
+import logging
+import re
+from datetime import date, timedelta
+from config import settings
+from db import connection
+
+logger = logging.getLogger(__name__)
+
+SCHEDULES_RETENTION_DAYS = settings.schedules_retention_days
+# Months of partitions kept ready beyond today; the sync reaches 70 days ahead
+PARTITIONS_AHEAD = 3
+
+_BOUND = re.compile(r"FROM \('([\d-]+)'\) TO \('([\d-]+)'\)")
+
+
+def ensure_partitions(cursor, first, last):
+    """Create the monthly schedules partitions covering first..last (dates) that don't exist yet."""
+    cursor.execute(
+        """
+        SELECT ensure_schedules_partition(month::date) AS name
+        FROM generate_series(date_trunc('month', %s::date), date_trunc('month', %s::date), INTERVAL '1 month') AS month
+        """,
+        (first, last),
+    )
+    return [row["name"] for row in cursor.fetchall()]
+
+
+def list_partitions(cursor):
+    """[(name, first day, day after the last)] for every schedules partition, oldest first."""
+    cursor.execute(
+        """
+        SELECT c.relname AS name, pg_get_expr(c.relpartbound, c.oid) AS bound
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'schedules'::regclass
+        """
+    )
+    partitions = []
+    for row in cursor.fetchall():
+        match = _BOUND.search(row["bound"])
+        if match:
+            partitions.append((row["name"], date.fromisoformat(match.group(1)), date.fromisoformat(match.group(2))))
+    return sorted(partitions, key=lambda partition: partition[1])
+
+
+def archive_partition(cursor, name):
+    """Summarise a partition into schedule_day_summary, then drop it."""
+    cursor.execute(
+        f"""
+        INSERT INTO schedule_day_summary (date, room, slots, open_slots, remain_total)
+        SELECT date, room, count(*), count(*) FILTER (WHERE remain > 0), sum(GREATEST(remain, 0))
+        FROM "{name}"
+        GROUP BY date, room
+        ON CONFLICT (date, room) DO UPDATE
+            SET slots = EXCLUDED.slots, open_slots = EXCLUDED.open_slots, remain_total = EXCLUDED.remain_total
+        """
+    )
+    archived = cursor.rowcount
+    cursor.execute(f'DROP TABLE "{name}"')
+    return archived
+
+
+def run_maintenance(today=None, retention_days=SCHEDULES_RETENTION_DAYS):
+    """
+    Blocking: create the partitions for the coming months and archive every
+    partition that ended more than retention_days ago. Each archived month is
+    committed on its own, so a failure leaves the rest intact.
+    """
+    today = today or date.today()
+    cutoff = today - timedelta(days=retention_days)
+    with connection() as conn:
+        with conn.cursor() as cursor:
+            ensure_partitions(cursor, today, today + timedelta(days=31 * PARTITIONS_AHEAD))
+            expired = [name for name, _, end in list_partitions(cursor) if end <= cutoff]
+        conn.commit()
+
+        archived = {}
+        for name in expired:
+            with conn.cursor() as cursor:
+                archived[name] = archive_partition(cursor, name)
+            conn.commit()
+            logger.info("Archived schedules partition %s (%d day/room summaries)", name, archived[name])
+    return {"cutoff": cutoff.isoformat(), "archived": archived}
@@ -0,0 +1,21 @@
+import threading
+import time
+
+
+class RateLimiter:
+    """Spaces calls so that no more than `rate` start per second, across threads."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate and rate > 0 else 0.0
+        self._lock = threading.Lock()
+        self._next = time.monotonic()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            start = max(time.monotonic(), self._next)
+            self._next = start + self.interval
+        delay = start - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
@@ -0,0 +1,214 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse
+from config import settings
+from fetcher import configure_session, SYNC_WORKERS
+from metrics import RESV_REQUEST_SECONDS, RESV_REQUEST_ERRORS
+
+BASE_URL = settings.resv_base_url
+LOGIN_URL = f"{BASE_URL}/user/usr_login.php"
+MYPAGE_URL = f"{BASE_URL}/user/res_user.php?calendar=1"
+MENU_URL = f"{BASE_URL}/user/usr_menu.php"
+CALENDAR_URL = f"{BASE_URL}/reserve/calendar.php"
+TIMETABLE_URL = f"{BASE_URL}/reserve/get_timetable_pc.php"
+
+SESSION_TTL = settings.resv_session_ttl
+SESSION_CACHE_SIZE = settings.resv_session_cache_size
+
+
+class LoginError(Exception):
+    pass
+
+
+class SessionExpired(Exception):
+    pass
+
+
+def is_login_page(text):
+    return 'ログインID' in text or 'Login ID' in text
+
+
+def endpoint_name(url):
+    # "https://host/reserve/get_timetable_pc.php?..." -> "get_timetable_pc.php"
+    return urlparse(url).path.rsplit("/", 1)[-1] or "/"
+
+
+def _password_key(password):
+    return hashlib.sha256((password or "").encode()).hexdigest()
+
+
+class ReservationSession:
+    """A logged-in requests.Session that logs in again when the site bounces it to the login page."""
+
+    def __init__(self, manager, login_id, password):
+        self.manager = manager
+        self.login_id = login_id
+        self.password = password
+        import requests  # the HTTP stack loads with the first session, not at startup
+
+        self.http = configure_session(requests.Session(), SYNC_WORKERS)
+        self.logged_in_at = None
+        self.calendar_url = CALENDAR_URL
+
+    def login(self):
+        login_data = {
+            "loginid": self.login_id,
+            "loginpw": self.password,
+            "calendar": "1",
+            "login_direct_id": "0",
+            "login_direct_calendar_id": "0",
+            "submit": "Log in"
+        }
+        self.http.cookies.clear()
+        self._request("POST", LOGIN_URL, data=login_data)
+
+        # Check login success
+        mypage = self._request("GET", MYPAGE_URL)
+        if is_login_page(mypage.text):
+            raise LoginError("Login failed")
+
+        # The calendar has to be opened once before timetables are served
+        self._request("GET", MENU_URL)
+        self._request("GET", CALENDAR_URL, headers={"Referer": MENU_URL, "User-Agent": "Mozilla/5.0"})
+        self.logged_in_at = time.monotonic()
+
+    def _request(self, method, url, **kwargs):
+        from requests import RequestException
+
+        endpoint = endpoint_name(url)
+        started = time.perf_counter()
+        try:
+            return self.http.request(method, url, **kwargs)
+        except RequestException:
+            RESV_REQUEST_ERRORS.inc(endpoint=endpoint, method=method)
+            raise
+        finally:
+            RESV_REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint, method=method)
+
+    def expired(self):
+        return self.logged_in_at is None or time.monotonic() - self.logged_in_at > self.manager.ttl
+
+    def get(self, url, **kwargs):
+        r = self._request("GET", url, **kwargs)
+        if is_login_page(r.text):
+            self.manager.relogin(self)
+            r = self._request("GET", url, **kwargs)
+        return r
+
+    def post(self, url, **kwargs):
+        # Form posts depend on the page fetched before them, so they are never replayed
+        r = self._request("POST", url, **kwargs)
+        if is_login_page(r.text):
+            self.manager.invalidate(self.login_id)
+            raise SessionExpired("Reservation site session expired")
+        return r
+
+    def close(self):
+        self.http.close()
+
+
+class SessionManager:
+    """
+    Caches logged-in sessions per login id, least recently used evicted past
+    `maxsize`; concurrent callers for one account share a login.
+    """
+
+    def __init__(self, ttl=SESSION_TTL, maxsize=SESSION_CACHE_SIZE):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._sessions = OrderedDict()  # login_id -> (password_key, ReservationSession), oldest first
+        self._locks = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.relogins = 0
+        self.evictions = 0
+
+    def _account_lock(self, login_id):
+        with self._lock:
+            lock = self._locks.get(login_id)
+            if lock is None:
+                # Drop the locks of accounts no longer cached (failed logins, evictions) that nobody holds
+                if len(self._locks) >= 2 * self.maxsize:
+                    for stale in [i for i, l in self._locks.items() if i not in self._sessions and not l.locked()]:
+                        del self._locks[stale]
+                lock = self._locks[login_id] = threading.Lock()
+            return lock
+
+    def _cached(self, login_id):
+        with self._lock:
+            cached = self._sessions.get(login_id)
+            if cached is not None:
+                self._sessions.move_to_end(login_id)
+            return cached
+
+    def _store(self, login_id, key, session):
+        # Evicted sessions, like replaced ones, are left to in-flight callers rather than closed under them
+        with self._lock:
+            self._sessions[login_id] = (key, session)
+            self._sessions.move_to_end(login_id)
+            while len(self._sessions) > self.maxsize:
+                self._sessions.popitem(last=False)
+                self.evictions += 1
+
+    def _forget(self, login_id):
+        with self._lock:
+            self._sessions.pop(login_id, None)
+
+    def get(self, login_id, password):
+        key = _password_key(password)
+        with self._account_lock(login_id):
+            cached = self._cached(login_id)
+            if cached and cached[0] == key and not cached[1].expired():
+                with self._lock:
+                    self.hits += 1
+                return cached[1]
+
+            with self._lock:
+                self.misses += 1
+            # A different password logs in on its own: a wrong one fails without touching the
+            # owner's cached session, and a right one (the password changed) replaces it
+            session = ReservationSession(self, login_id, password)
+            session.login()
+            self._store(login_id, key, session)
+            return session
+
+    def relogin(self, session):
+        logged_in_at = session.logged_in_at
+        with self._account_lock(session.login_id):
+            # Another caller may already have logged this session back in
+            if session.logged_in_at == logged_in_at:
+                with self._lock:
+                    self.relogins += 1
+                try:
+                    session.login()
+                except LoginError:
+                    cached = self._cached(session.login_id)
+                    if cached is not None and cached[1] is session:
+                        self._forget(session.login_id)
+                    raise
+
+    def invalidate(self, login_id):
+        with self._account_lock(login_id):
+            self._forget(login_id)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "relogins": self.relogins,
+                "cached": len(self._sessions),
+                "evictions": self.evictions,
+            }
+
+    def close(self):
+        with self._lock:
+            sessions, self._sessions = self._sessions, OrderedDict()
+        for _, session in sessions.values():
+            session.close()
+
+
+sessions = SessionManager()
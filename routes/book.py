@@ -1,10 +1,21 @@
+import logging
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel, validator
-from datetime import datetime
+from typing import List, Optional
+from datetime import datetime, date as date_type, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import threading
 import time
-import requests
-from bs4 import BeautifulSoup
 from urllib.parse import urljoin
+from cache import TTLCache
+from config import settings
+from timetable_parser import iter_slots
+from concurrency import run_blocking
+from metrics import PARSE_SECONDS
+from resv_session import sessions, LoginError, SessionExpired, TIMETABLE_URL
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
@@ -19,6 +30,7 @@ class BookingRequest(BaseModel):
     room: str
     id: int
     day_of_week: str
+    alternate_rooms: List[str] = []
 
 
     @validator("month", "day", pre=True)
@@ -26,65 +38,332 @@ class BookingRequest(BaseModel):
         return int(v)
 
 
-# --- API Route ---
+def check_month_day(cls, v, values):
+    # `day` validator shared by the month/day models: an impossible date is a 422 here, not a 500 later
+    if "month" in values:
+        try:
+            booking_date(values["month"], v)
+        except ValueError:
+            raise ValueError(f"{values['month']}/{v} is not a valid month/day")
+    return v
 
-@router.post("/book")
-def book_slot(data: BookingRequest):
-    try:
-        session = requests.Session()
-
-        login_data = {
-            "loginid": data.login_id,
-            "loginpw": data.login_pw,
-            "calendar": "1",
-            "login_direct_id": "0",
-            "login_direct_calendar_id": "0",
-            "submit": "Log in"
+
+class BookingTarget(BaseModel):
+    month: int
+    day: int
+    start_time: str
+    end_time: str
+    room: str
+    alternate_rooms: List[str] = []
+    # Set when the full date is known (recurrences, watches) so the year isn't guessed from month/day
+    date: Optional[date_type] = None
+
+    @validator("month", "day", pre=True)
+    def convert_to_int(cls, v):
+        return int(v)
+
+    check_date = validator("day", allow_reuse=True)(check_month_day)
+
+
+WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+# "Tuesday", "tue", "TUE" all mean the same day
+WEEKDAY_NAMES = {**{day: day for day in WEEKDAYS}, **{day[:3]: day for day in WEEKDAYS}}
+# How far ahead the site takes bookings
+BOOKING_WINDOW_DAYS = 70
+
+
+class Recurrence(BaseModel):
+    weekday: str
+    start_time: str
+    end_time: str
+    room: str
+    alternate_rooms: List[str] = []
+    starting: Optional[date_type] = None
+    weeks: int = 1
+
+    @validator("weekday")
+    def check_weekday(cls, v):
+        day = WEEKDAY_NAMES.get(v.strip().lower())
+        if day is None:
+            raise ValueError("weekday must be a day name such as 'Tuesday'")
+        return day
+
+    @validator("weeks", always=True)
+    def check_weeks(cls, v, values):
+        if not 1 <= v <= BOOKING_BATCH_MAX:
+            raise ValueError(f"weeks must be between 1 and {BOOKING_BATCH_MAX}")
+        if "weekday" in values and "starting" in values:
+            last = recurrence_dates(values["weekday"], values["starting"], v)[-1]
+            if last > date_type.today() + timedelta(days=BOOKING_WINDOW_DAYS):
+                raise ValueError(f"{last} is beyond the {BOOKING_WINDOW_DAYS} days the site takes bookings for")
+        return v
+
+    def targets(self):
+        return [
+            BookingTarget(month=day.month, day=day.day, date=day, start_time=self.start_time,
+                          end_time=self.end_time, room=self.room, alternate_rooms=self.alternate_rooms)
+            for day in recurrence_dates(self.weekday, self.starting, self.weeks)
+        ]
+
+
+def recurrence_dates(weekday, starting, weeks):
+    start = max(starting or date_type.today(), date_type.today())
+    first = start + timedelta(days=(WEEKDAYS.index(weekday) - start.weekday()) % 7)
+    return [first + timedelta(weeks=week) for week in range(weeks)]
+
+
+class BatchBookingRequest(BaseModel):
+    login_id: str
+    login_pw: str
+    targets: List[BookingTarget] = []
+    recurrence: Optional[Recurrence] = None
+    max_parallel: int = 3
+
+
+class PrefetchRequest(BaseModel):
+    login_id: str
+    login_pw: str
+    month: int
+    day: int
+
+    @validator("month", "day", pre=True)
+    def convert_to_int(cls, v):
+        return int(v)
+
+    check_date = validator("day", allow_reuse=True)(check_month_day)
+
+
+BOOKING_TIMEOUT = settings.booking_timeout
+BOOKING_BATCH_MAX = settings.booking_batch_max
+BOOKING_BATCH_PARALLEL = settings.booking_batch_parallel
+timetable_cache = TTLCache(settings.booking_prefetch_ttl, 256)
+_prefetcher = ThreadPoolExecutor(max_workers=4, thread_name_prefix="book-prefetch")
+BOOKING_PREFETCH_MAX_PENDING = settings.booking_prefetch_max_pending
+_prefetching = set()  # (login_id, date) queued or running
+_prefetching_lock = threading.Lock()
+
+
+class StepTimer:
+    def __init__(self):
+        self.timings = {}
+        self.prefetched = False
+        self.started = time.perf_counter()
+
+    @contextmanager
+    def step(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = round((time.perf_counter() - started) * 1000, 1)
+
+    def report(self):
+        return {
+            "timings_ms": self.timings,
+            "total_ms": round((time.perf_counter() - self.started) * 1000, 1),
+            "prefetched_timetable": self.prefetched,
         }
 
-        login_url = "https://jptraining.resv.jp/user/usr_login.php"
-        session.post(login_url, data=login_data)
 
-        # Check login success
-        mypage = session.get("https://jptraining.resv.jp/user/res_user.php?calendar=1")
-        if 'ログインID' in mypage.text or 'Login ID' in mypage.text:
-            raise HTTPException(status_code=401, detail="Login failed")
+def target_date(target):
+    """The datetime a booking target is for: its full date if it has one, else the next month/day."""
+    if getattr(target, "date", None) is not None:
+        return datetime.combine(target.date, datetime.min.time())
+    return booking_date(target.month, target.day)
+
+
+def booking_date(month, day):
+    # Requests carry no year: take the next occurrence of month/day
+    today = datetime.today()
+    date = datetime(year=today.year, month=month, day=day)
+    if date.date() < today.date():
+        date = date.replace(year=today.year + 1)
+    return date
+
+
+def check_login(login_id, login_pw):
+    """Blocking: the account's credentials, checked against its cached session or by logging in."""
+    try:
+        sessions.get(login_id, login_pw)
+    except LoginError:
+        raise HTTPException(status_code=401, detail="Login failed")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+def queue_prefetch(login_id, login_pw, date):
+    """Hand a prefetch to the background pool; False when too many are already pending."""
+    key = (login_id, date)
+    with _prefetching_lock:
+        if key in _prefetching:
+            return True  # the one already queued will do
+        if len(_prefetching) >= BOOKING_PREFETCH_MAX_PENDING:
+            return False
+        _prefetching.add(key)
+    _prefetcher.submit(prefetch_timetable, login_id, login_pw, date)
+    return True
+
+
+def prefetch_timetable(login_id, login_pw, date):
+    try:
+        session = sessions.get(login_id, login_pw)
+        html = get_timetable(session, date.year, date.month, date.day, session.calendar_url)
+        timetable_cache.set((login_id, date), html)
+    except Exception as e:
+        logger.warning("Timetable prefetch failed: %s", e)
+    finally:
+        with _prefetching_lock:
+            _prefetching.discard((login_id, date))
+
+
+def pick_slot(html, target):
+    # The preferred room first, then the alternates in the order given
+    slots = extract_timetable(html, target.start_time, target.end_time)
+    for room in [target.room, *target.alternate_rooms]:
+        filtered_slots = [s for s in slots if s["room"] == room and s["remain"] > 0]
+        if filtered_slots:
+            return filtered_slots[0]
+    return None
 
-        calendar_url = "https://jptraining.resv.jp/reserve/calendar.php"
-        session.get(calendar_url, headers={"Referer": login_url, "User-Agent": "Mozilla/5.0"})
 
-        date = datetime(year=2025, month=data.month, day=data.day)
-        html = get_timetable(session, date.year, date.month, date.day, calendar_url)
-        slots = extract_timetable(html, data.start_time, data.end_time)
+# --- API Route ---
+
+@router.post("/book")
+async def book_slot_route(data: BookingRequest):
+    return await run_blocking("booking", book_slot, data)
+
+
+@router.post("/book/prefetch", status_code=202)
+async def prefetch_route(data: PrefetchRequest):
+    # The login is checked (and warmed) before anything is queued, so only real accounts cost site requests;
+    # the day's timetable is then fetched in the background for the /book call that follows
+    await run_blocking("booking", check_login, data.login_id, data.login_pw)
+    if not queue_prefetch(data.login_id, data.login_pw, booking_date(data.month, data.day)):
+        raise HTTPException(status_code=429, detail="Too many prefetches pending")
+    return {"status": "prefetching"}
 
-        filtered_slots = [s for s in slots if s["room"] == data.room and s["remain"] > 0]
-        if not filtered_slots:
-            raise HTTPException(status_code=404, detail="No available slots for selected time and room")
 
-        slot = filtered_slots[0]
-        detail_url = urljoin(calendar_url, slot["detail_url"])
-        resp = submit_next_form(session, detail_url)
+@router.post("/book/batch")
+async def book_batch_route(data: BatchBookingRequest):
+    return await run_blocking("booking", book_batch, data)
 
-        confirm_url = extract_confirm_url(resp.text, resp.url)
-        if not confirm_url:
-            raise HTTPException(status_code=500, detail="Failed to get confirmation form")
 
-        result = complete_reservation(session, confirm_url)
-        if result["status"] != "success":
-            raise HTTPException(status_code=500, detail=result["message"])
+def book_slot(data: BookingRequest):
+    timer = StepTimer()
+    try:
+        # Warm, shared login for this account (logs in only on a cache miss)
+        with timer.step("session"):
+            try:
+                session = sessions.get(data.login_id, data.login_pw)
+            except LoginError:
+                raise HTTPException(status_code=401, detail="Login failed")
 
-        return {"status": "success", "message": "Booking successful"}
+        slot = reserve(session, data, timer)
+        return {"status": "success", "message": "Booking successful", "room": slot["room"], **timer.report()}
 
     except HTTPException:
         raise
+    except SessionExpired as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def book_batch(data: BatchBookingRequest):
+    targets = list(data.targets)
+    if data.recurrence:
+        targets += data.recurrence.targets()
+    if not targets:
+        raise HTTPException(status_code=400, detail="No booking targets given")
+    if len(targets) > BOOKING_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {BOOKING_BATCH_MAX} bookings per batch")
+
+    try:
+        session = sessions.get(data.login_id, data.login_pw)
+    except LoginError:
+        raise HTTPException(status_code=401, detail="Login failed")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    workers = max(1, min(data.max_parallel, BOOKING_BATCH_PARALLEL, len(targets)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="book-batch") as pool:
+        # One timetable fetch per distinct date, shared by every target on it
+        dates = sorted({target_date(t) for t in targets})
+        timetables = dict(zip(dates, pool.map(lambda d: fetch_timetable_quietly(session, d), dates)))
+        results = list(pool.map(
+            lambda t: book_target(session, t, timetables.get(target_date(t))), targets))
+
+    booked = sum(1 for r in results if r["status"] == "success")
+    if booked == len(results):
+        status = "success"
+    elif booked:
+        status = "partial"
+    else:
+        status = "failed"
+    return {"status": status, "booked": booked, "failed": len(results) - booked, "results": results}
+
+
+def fetch_timetable_quietly(session, date):
+    try:
+        return get_timetable(session, date.year, date.month, date.day, session.calendar_url)
+    except Exception as e:
+        # reserve() fetches the page again for each target on this date
+        logger.warning("Batch timetable fetch failed for %s: %s", date.date(), e)
+        return None
+
+
+def book_target(session, target, timetable):
+    timer = StepTimer()
+    result = {
+        "date": target_date(target).date().isoformat(),
+        "start_time": target.start_time,
+        "end_time": target.end_time,
+    }
+    try:
+        slot = reserve(session, target, timer, timetable)
+        result.update(status="success", room=slot["room"], alternate=slot["room"] != target.room)
+    except HTTPException as e:
+        result.update(status="error", detail=e.detail)
+    except Exception as e:
+        result.update(status="error", detail=str(e))
+    result.update(timer.report())
+    return result
+
+
+def reserve(session, target, timer, timetable=None):
+    """Book `target` on an already logged-in session and return the slot that was booked."""
+    calendar_url = session.calendar_url
+    date = target_date(target)
+    with timer.step("timetable"):
+        slot = None
+        if timetable is None:
+            timetable = timetable_cache.get((session.login_id, date))
+        if timetable is not None:
+            slot = pick_slot(timetable, target)
+        timer.prefetched = slot is not None
+        if slot is None:
+            html = get_timetable(session, date.year, date.month, date.day, calendar_url)
+            slot = pick_slot(html, target)
+    if slot is None:
+        raise HTTPException(status_code=404, detail="No available slots for selected time and room")
+
+    detail_url = urljoin(calendar_url, slot["detail_url"])
+    resp = submit_next_form(session, detail_url, timer)
+
+    confirm_url = extract_confirm_url(resp.text, resp.url)
+    if not confirm_url:
+        raise HTTPException(status_code=500, detail="Failed to get confirmation form")
+
+    result = complete_reservation(session, confirm_url, timer)
+    if result["status"] != "success":
+        raise HTTPException(status_code=500, detail=result["message"])
+    return slot
+
+
 # --- Helpers ---
 
 def get_timetable(session, year, month, day, calendar_url):
-    base_url = "https://jptraining.resv.jp/reserve/get_timetable_pc.php"
+    base_url = TIMETABLE_URL
     params = {
         "view_mode": "day",
         "view_list": "0",
@@ -100,51 +379,39 @@ def get_timetable(session, year, month, day, calendar_url):
         "User-Agent": "Mozilla/5.0",
         "X-Requested-With": "XMLHttpRequest",
     }
-    r = session.get(base_url, params=params, headers=headers)
+    r = session.get(base_url, params=params, headers=headers, timeout=BOOKING_TIMEOUT)
     r.raise_for_status()
     return r.text
 
 
 def extract_timetable(html, desired_start, desired_end):
-    soup = BeautifulSoup(html, 'html.parser')
+    with PARSE_SECONDS.time(page="booking_timetable"):
+        slots = list(iter_slots(html, "lesson"))
     results = []
-
-    for lesson_div in soup.select('div.lesson'):
-        time_a = lesson_div.select_one('li.data-week-info a')
-        room_a = lesson_div.select_one('li.data-week-mp-name a')
-        remain_span = lesson_div.select_one('span.zannsu')
-
-        timestr = None
-        if time_a:
-            for part in time_a.contents:
-                if isinstance(part, str) and '-' in part:
-                    timestr = part.strip()
-            if not timestr:
-                lines = time_a.get_text("\n").splitlines()
-                lines = [l.strip() for l in lines if '-' in l]
-                timestr = lines[-1] if lines else '?'
-
-        if timestr and "-" in timestr:
-            start, end = timestr.split('-')
-            if start.strip() >= desired_start and end.strip() <= desired_end:
-                remain = int(''.join(filter(str.isdigit, remain_span.text))) if remain_span else 0
-                if remain > 0:
-                    detail_url = time_a.get('href')
-                    results.append({
-                        "time": timestr,
-                        "room": room_a.text.strip() if room_a else '',
-                        "remain": remain,
-                        "detail_url": detail_url
-                    })
+    for slot in slots:
+        if "-" not in slot.time:
+            continue
+        start, end = slot.time.split('-')
+        if start.strip() >= desired_start and end.strip() <= desired_end and slot.remain > 0:
+            results.append(slot._asdict())
     return results
 
 
-def submit_next_form(session, detail_url):
-    r = session.get(detail_url)
-    r.raise_for_status()
-    soup = BeautifulSoup(r.text, 'html.parser')
+def parse_form(html):
+    from bs4 import BeautifulSoup, SoupStrainer
+
+    # Only the <form> subtree is built; the rest of the page is skipped
+    with PARSE_SECONDS.time(page="form"):
+        soup = BeautifulSoup(html, 'html.parser', parse_only=SoupStrainer("form"))
+        return soup.find("form")
+
+
+def submit_next_form(session, detail_url, timer):
+    with timer.step("detail"):
+        r = session.get(detail_url, timeout=BOOKING_TIMEOUT)
+        r.raise_for_status()
+        form = parse_form(r.text)
 
-    form = soup.find("form")
     if not form:
         raise Exception("No form found on detail page")
 
@@ -163,26 +430,26 @@ def submit_next_form(session, detail_url):
 
     form_data["submit"] = "Proceed to the next"
 
-    response = session.post(form_url, data=form_data)
-    response.raise_for_status()
+    with timer.step("submit"):
+        response = session.post(form_url, data=form_data, timeout=BOOKING_TIMEOUT)
+        response.raise_for_status()
     return response
 
 
 def extract_confirm_url(html, base_url):
-    soup = BeautifulSoup(html, 'html.parser')
-    form = soup.find("form")
+    form = parse_form(html)
     if not form:
         return None
     action = form.get("action")
     return urljoin(base_url, action) if action else None
 
 
-def complete_reservation(session, confirm_url):
-    r = session.get(confirm_url)
-    r.raise_for_status()
+def complete_reservation(session, confirm_url, timer):
+    with timer.step("confirm"):
+        r = session.get(confirm_url, timeout=BOOKING_TIMEOUT)
+        r.raise_for_status()
+        form = parse_form(r.text)
 
-    soup = BeautifulSoup(r.text, 'html.parser')
-    form = soup.find("form")
     if not form:
         return {"status": "error", "message": "No form found on confirmation page"}
 
@@ -198,8 +465,9 @@ def complete_reservation(session, confirm_url):
 
     form_data["submit1"] = "complete"
 
-    response = session.post(form_url, data=form_data)
-    response.raise_for_status()
+    with timer.step("complete"):
+        response = session.post(form_url, data=form_data, timeout=BOOKING_TIMEOUT)
+        response.raise_for_status()
 
     if "予約完了" in response.text or "Reservation Complete" in response.text:
         return {"status": "success", "message": "Reservation completed successfully"}
@@ -1,10 +1,15 @@
 # routes/emails.py
 
-from fastapi import APIRouter, HTTPException
+import base64
+import json
+from datetime import datetime
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
 from pydantic import BaseModel, EmailStr
-from db import get_connection
+from auth import require_admin
+from concurrency import run_blocking
+from db import connection, DatabaseUnavailable
 import psycopg2
-from email_utils import send_email
 
 router = APIRouter()
 
@@ -12,49 +17,73 @@ class EmailCreate(BaseModel):
     email: EmailStr
 
 
-def insert_email(email: str):
-    conn = get_connection()
-    if not conn:
-        raise HTTPException(status_code=500, detail="Failed to connect to the database")
+def add_email(cursor, email: str):
+    cursor.execute(
+        "INSERT INTO emails (email) VALUES (%s) RETURNING id, email, created_at",
+        (email,)
+    )
+    return cursor.fetchone()
+
 
+def insert_email(email: str):
     try:
-        with conn.cursor() as cursor:
-            cursor.execute(
-                "INSERT INTO emails (email) VALUES (%s) RETURNING id, email, created_at",
-                (email,)
-            )
-            new_email = cursor.fetchone()
+        with connection() as conn:
+            with conn.cursor() as cursor:
+                new_email = add_email(cursor, email)
             conn.commit()
             return new_email
 
     except psycopg2.errors.UniqueViolation:
-        conn.rollback()
         raise HTTPException(status_code=400, detail="Email already exists")
 
+    except DatabaseUnavailable:
+        raise HTTPException(status_code=500, detail="Failed to connect to the database")
+
     except Exception as e:
-        conn.rollback()
         raise HTTPException(status_code=500, detail=f"Failed to insert email: {e}")
 
-    finally:
-        conn.close()
 
 
+def encode_cursor(row):
+    key = [row["created_at"].isoformat(), row["id"]]
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
 
-def get_all_emails():
-    conn = get_connection()
-    if not conn:
-        raise HTTPException(status_code=500, detail="Failed to connect to the database")
+
+def decode_cursor(cursor):
+    try:
+        created_at, email_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(created_at), int(email_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def get_all_emails(limit: int = 100, cursor: Optional[str] = None):
+    """One page of subscribers, newest first, using keyset pagination on (created_at, id)."""
+    query = "SELECT id, email, created_at FROM emails"
+    params = []
+    if cursor:
+        query += " WHERE (created_at, id) < (%s, %s)"
+        params.extend(decode_cursor(cursor))
+    query += " ORDER BY created_at DESC, id DESC LIMIT %s"
+    params.append(limit + 1)
 
     try:
-        with conn.cursor() as cursor:
-            cursor.execute("SELECT id, email, created_at FROM emails ORDER BY created_at DESC")
-            emails = cursor.fetchall()
-        return emails
+        with connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(query, params)
+                emails = cursor.fetchall()
+            conn.commit()
+
+    except DatabaseUnavailable:
+        raise HTTPException(status_code=500, detail="Failed to connect to the database")
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch emails: {e}")
 
-    finally:
-        conn.close()
+    next_cursor = encode_cursor(emails[limit - 1]) if len(emails) > limit else None
+    return {"emails": emails[:limit], "next_cursor": next_cursor}
 
 
+@router.get("/emails", dependencies=[Depends(require_admin)])
+async def list_emails(limit: int = Query(100, ge=1, le=1000), cursor: Optional[str] = None):
+    return await run_blocking("db", get_all_emails, limit, cursor)
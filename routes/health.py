@@ -0,0 +1,27 @@
+import asyncio
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+from concurrency import run_blocking
+from health import health_checks, CHECK_KINDS, HEALTH_REQUIRED
+
+router = APIRouter()
+
+
+@router.get("/health")
+@router.get("/health/live")
+async def liveness():
+    # No I/O: answering at all means the event loop is serving requests
+    return {"status": "ok", "message": "API is running smoothly!"}
+
+
+@router.get("/health/ready")
+async def readiness():
+    names = list(health_checks.checks)
+    results = await asyncio.gather(*(run_blocking(CHECK_KINDS.get(name, "health"), health_checks.run, name) for name in names))
+    checks = dict(zip(names, results))
+    failed = {name for name, result in checks.items() if not result["ok"]}
+    if failed & HEALTH_REQUIRED:
+        status, code = "unavailable", 503
+    else:
+        status, code = ("degraded" if failed else "ok"), 200
+    return JSONResponse({"status": status, "checks": checks}, status_code=code)
@@ -1,62 +1,206 @@
-from db import get_connection
-from email_utils import send_email
+import logging
+from concurrency import run_blocking
+from db import connection, DatabaseUnavailable
+from outbox import enqueue_message, store_message, wake
+from schedules import NOTIFY_KINDS
+from bisect import bisect_right
 from datetime import datetime
-import traceback
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException
+from pydantic import BaseModel, EmailStr
+from auth import require_admin
+from email_utils import get_mailer
+from config import settings
 
-def send_subscription_email():
-    conn = get_connection()
-    if not conn:
-        raise HTTPException(status_code=500, detail="Failed to connect to the database")
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+SUBSCRIBER_BATCH_SIZE = settings.subscriber_batch_size
+# Recipients listed in a dry run; the counts always cover everyone
+DRY_RUN_LIMIT = 1000
+
+
+SUBJECT = "JP Training - Available Slots Notification"
+
+
+# Served by the schedules_open_slots partial index
+OPEN_SLOTS_QUERY = """
+    SELECT date, starttime, endtime, room, remain 
+    FROM schedules 
+    WHERE remain > 0 AND date > CURRENT_DATE + INTERVAL '1 day'
+    ORDER BY date, starttime
+"""
+
+
+def load_available_slots(cursor):
+    cursor.execute(OPEN_SLOTS_QUERY)
+    return cursor.fetchall()
+
+
+def unsubscribe_link(email):
+    return f"https://jp-training.vercel.app/unsubscribe?email={email}"
 
+
+def send_subscription_email(dry_run=False):
+    """
+    Queue the available-slots email for subscribers who have not yet been told
+    about every slot that opened (or gained spots) since their last notification.
+    The body is stored once; each batch of subscribers commits with its own jobs.
+    """
     try:
-        with conn.cursor() as cursor:
-            cursor.execute("""
-                SELECT date, starttime, endtime, room, remain 
-                FROM schedules 
-                WHERE remain > 0 AND date > CURRENT_DATE + INTERVAL '1 day'
-                ORDER BY date, starttime
-            """)
-            slots = cursor.fetchall()
-            print(f"Found {len(slots)} available slots.")
-
-            if not slots:
-                print("No available slots with remaining spots.")
-                return
-            
-
-            subject = "JP Training - Available Slots Notification"
-
-            cursor.execute("SELECT email FROM emails")
-            emails = cursor.fetchall()
-            print(f"Found {len(emails)} subscribers.", emails)
-            email_list = [row["email"] for row in emails]
-
-
-            for email in email_list:
-                unsubscribe_url = f"https://jp-training.vercel.app/unsubscribe?email={email}"
-                body = make_email_body_html(slots, unsubscribe_url=unsubscribe_url)
-                success = send_email(
-                    to_email=email,
-                    subject=subject,
-                    body=body
-                )
-                if success:
-                    print(f"Notification sent to {email}")
-                else:
-                    print(f"Failed to send to {email}")
+        with connection() as conn:
+            with conn.cursor() as cursor:
+                slots = load_available_slots(cursor)
+                logger.info("Found %d available slots.", len(slots))
+
+                if not slots:
+                    logger.info("No available slots with remaining spots.")
+                    return {"slots": 0, "notified": 0, "skipped": 0}
+
+                # Latest opening per slot that is still bookable
+                cursor.execute("""
+                    SELECT max(c.id) AS change_id
+                    FROM slot_changes c
+                    JOIN schedules s USING (date, starttime, endtime, room)
+                    WHERE c.kind = ANY(%s)
+                      AND s.remain > 0 AND s.date > CURRENT_DATE + INTERVAL '1 day'
+                    GROUP BY c.date, c.starttime, c.endtime, c.room
+                    ORDER BY change_id
+                """, (list(NOTIFY_KINDS),))
+                change_ids = [row["change_id"] for row in cursor.fetchall()]
+
+                cursor.execute("SELECT count(*) AS total FROM emails")
+                total = cursor.fetchone()["total"]
+                latest = change_ids[-1] if change_ids else 0
+
+                # The slot table is identical for everyone; render it once
+                template = compile_email_body(slots)
+                message_id = None
+                notified = 0
+                preview = []
+                after_id = 0
+
+                # Only subscribers behind the newest opening can have something new. They are
+                # read a batch at a time by id, and each batch commits with its jobs and
+                # watermarks, so memory and transaction size stay flat however long the list is
+                while True:
+                    cursor.execute(
+                        """
+                        SELECT id, email, last_notified_change_id FROM emails
+                        WHERE last_notified_change_id < %s AND id > %s
+                        ORDER BY id LIMIT %s
+                        """,
+                        (latest, after_id, SUBSCRIBER_BATCH_SIZE),
+                    )
+                    batch = cursor.fetchall()
+                    if not batch:
+                        break
+                    after_id = batch[-1]["id"]
+
+                    if dry_run:
+                        notified += len(batch)
+                        for row in batch[:DRY_RUN_LIMIT - len(preview)]:
+                            # Slots whose latest opening the subscriber hasn't been told about
+                            new_slots = len(change_ids) - bisect_right(change_ids, row["last_notified_change_id"])
+                            preview.append({"email": row["email"],
+                                            "reason": f"{new_slots} slot(s) opened or gained spots since last notification"})
+                        continue
+
+                    if message_id is None:
+                        message_id = store_message(cursor, SUBJECT, template.parts)
+                    # Jobs and watermarks commit together so nobody is mailed twice for the same change;
+                    # a concurrent run that already moved a watermark takes that subscriber out
+                    cursor.execute(
+                        """
+                        UPDATE emails
+                        SET last_notified_change_id = %s, last_notified_at = now()
+                        WHERE id = ANY(%s) AND last_notified_change_id < %s
+                        RETURNING email
+                        """,
+                        (latest, [row["id"] for row in batch], latest),
+                    )
+                    recipients = [(row["email"], unsubscribe_link(row["email"])) for row in cursor.fetchall()]
+                    notified += enqueue_message(cursor, message_id, recipients)
+                    conn.commit()
+                    wake()
+
+                logger.info("%d of %d subscribers have new slots.", notified, total)
+
+                if dry_run:
+                    return {
+                        "slots": len(slots),
+                        "notified": notified,
+                        "skipped": total - notified,
+                        "recipients": preview,
+                        "truncated": notified > len(preview),
+                    }
+            conn.commit()
+
+    except DatabaseUnavailable:
+        raise HTTPException(status_code=500, detail="Failed to connect to the database")
 
     except Exception as e:
-        print(f"Error while sending subscription emails: {e}")
-        traceback.print_exc()
+        logger.exception("Error while sending subscription emails: %s", e)
 
         raise HTTPException(status_code=500, detail="Error while sending subscription emails")
 
-    finally:
-        conn.close()
+    logger.info("Queued %d notifications.", notified)
+    return {"slots": len(slots), "notified": notified, "skipped": total - notified}
+
+
+@router.get("/notifications/preview", dependencies=[Depends(require_admin)])
+async def preview_notifications():
+    return await run_blocking("db", send_subscription_email, dry_run=True)
+
+
+class TestEmailRequest(BaseModel):
+    email: EmailStr
+
+
+def send_test_email(email):
+    """Send the current notification to one address right away, bypassing the outbox."""
+    try:
+        with connection() as conn:
+            with conn.cursor() as cursor:
+                slots = load_available_slots(cursor)
+            conn.commit()
+    except DatabaseUnavailable:
+        raise HTTPException(status_code=500, detail="Failed to connect to the database")
+
+    body = compile_email_body(slots).render(unsubscribe_url=unsubscribe_link(email))
+    try:
+        get_mailer().deliver(email, f"[Test] {SUBJECT}", body)
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=f"Failed to send test email: {e}")
+    return {"message": f"Test email sent to {email}", "slots": len(slots)}
+
+
+@router.post("/notifications/test", dependencies=[Depends(require_admin)])
+async def test_notification(req: TestEmailRequest):
+    return await run_blocking("db", send_test_email, req.email)
+
+
+# Stand-in for per-recipient values while the shared document is rendered
+_UNSUBSCRIBE_TOKEN = "\x00unsubscribe_url\x00"
+
+
+class CompiledEmailBody:
+    """Pre-rendered notification document; only the per-recipient tokens are filled in."""
+
+    def __init__(self, html):
+        self.parts = html.split(_UNSUBSCRIBE_TOKEN)
+
+    def render(self, unsubscribe_url):
+        return unsubscribe_url.join(self.parts)
 
 
 def make_email_body_html(slots, unsubscribe_url):
+    return compile_email_body(slots).render(unsubscribe_url)
+
+
+def compile_email_body(slots):
+    unsubscribe_url = _UNSUBSCRIBE_TOKEN
+
     def style_badge(remain):
         if remain <= 0:
             return "linear-gradient(135deg, #ff6b6b, #ee5a52)"
@@ -65,7 +209,7 @@ def make_email_body_html(slots, unsubscribe_url):
         else:
             return "linear-gradient(135deg, #66bb6a, #4caf50)"
 
-    rows_html = ""
+    rows = []
     for row in slots:
         date = row["date"].strftime("%Y-%m-%d")
         start = row["starttime"].strftime("%H:%M")
@@ -74,7 +218,7 @@ def make_email_body_html(slots, unsubscribe_url):
         remain = row["remain"]
         badge_color = style_badge(remain)
 
-        rows_html += f"""
+        rows.append(f"""
             <tr style="border-bottom: 1px solid rgba(255,255,255,0.15); transition: background-color 0.3s ease;">
                 <td style="padding: 16px 12px; text-align: left; font-weight: 500;">{date}</td>
                 <td style="padding: 16px 12px; text-align: center; font-weight: 500;">{start} - {end}</td>
@@ -91,7 +235,9 @@ def make_email_body_html(slots, unsubscribe_url):
                     ">{remain} spots left</span>
                 </td>
             </tr>
-        """
+        """)
+
+    rows_html = "".join(rows)
 
     body = f"""
 <!DOCTYPE html>
@@ -209,4 +355,4 @@ def make_email_body_html(slots, unsubscribe_url):
 </body>
 </html>
 """
-    return body
+    return CompiledEmailBody(body)
@@ -0,0 +1,232 @@
+import asyncio
+import base64
+import hashlib
+import json
+from datetime import date, datetime, timedelta
+from typing import List, Optional
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+from cache import slots_cache
+from concurrency import run_blocking
+from db import connection, DatabaseUnavailable
+from occupancy import fill_times
+from slot_events import (slot_hub, SlotFilter, change_event, format_sse,
+                         SSE_HEARTBEAT, SSE_REPLAY_LIMIT)
+
+router = APIRouter()
+
+
+def encode_cursor(row):
+    key = [row["date"], row["starttime"], row["endtime"], row["room"]]
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        day, start, end, room = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return (date.fromisoformat(day), datetime.strptime(start, "%H:%M:%S").time(),
+                datetime.strptime(end, "%H:%M:%S").time(), room)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def fetch_slots(date_from, date_to, room, min_remain, limit, after):
+    conditions = ["date >= %s", "remain >= %s"]
+    params = [date_from, min_remain]
+    if date_to is not None:
+        conditions.append("date <= %s")
+        params.append(date_to)
+    if room is not None:
+        conditions.append("room = %s")
+        params.append(room)
+    if after is not None:
+        # Keyset pagination on the natural key
+        conditions.append("(date, starttime, endtime, room) > (%s, %s, %s, %s)")
+        params.extend(after)
+
+    try:
+        with connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    f"""
+                    SELECT date, starttime, endtime, room, remain
+                    FROM schedules
+                    WHERE {' AND '.join(conditions)}
+                    ORDER BY date, starttime, endtime, room
+                    LIMIT %s
+                    """,
+                    (*params, limit + 1)
+                )
+                rows = cursor.fetchall()
+            conn.commit()
+    except DatabaseUnavailable:
+        raise HTTPException(status_code=500, detail="Failed to connect to the database")
+
+    slots = [{
+        "date": row["date"].isoformat(),
+        "starttime": row["starttime"].isoformat(),
+        "endtime": row["endtime"].isoformat(),
+        "room": row["room"],
+        "remain": row["remain"],
+    } for row in rows[:limit]]
+    next_cursor = encode_cursor(slots[-1]) if len(rows) > limit else None
+    body = {"slots": slots, "next_cursor": next_cursor}
+    etag = '"' + hashlib.sha1(json.dumps(body, sort_keys=True).encode()).hexdigest() + '"'
+    return body, etag
+
+
+@router.get("/slots")
+async def list_slots(
+    request: Request,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    room: Optional[str] = None,
+    min_remain: int = Query(1, ge=0),
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+):
+    date_from = date_from or date.today()
+    key = (date_from, date_to, room, min_remain, limit, cursor)
+
+    cached = slots_cache.get(key)
+    if cached is None:
+        after = decode_cursor(cursor) if cursor else None
+        # A sync invalidating the cache while this reads must not leave the stale rows cached
+        generation = slots_cache.generation
+        cached = await run_blocking("db", fetch_slots, date_from, date_to, room, min_remain, limit, after)
+        slots_cache.set(key, cached, generation)
+    body, etag = cached
+
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(body, headers=headers)
+
+
+def replay_changes(after_id, slot_filter):
+    """Changes after `after_id` that match the filter, oldest first; None when too many were missed."""
+    conditions = ["id > %s"]
+    params = [after_id]
+    if slot_filter.date_from is not None:
+        conditions.append("date >= %s")
+        params.append(slot_filter.date_from)
+    if slot_filter.date_to is not None:
+        conditions.append("date <= %s")
+        params.append(slot_filter.date_to)
+    if slot_filter.room is not None:
+        conditions.append("room = %s")
+        params.append(slot_filter.room)
+    if slot_filter.kinds is not None:
+        conditions.append("kind = ANY(%s)")
+        params.append(list(slot_filter.kinds))
+
+    with connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                f"""
+                SELECT id, date, starttime, endtime, room, old_remain, new_remain, kind
+                FROM slot_changes
+                WHERE {' AND '.join(conditions)}
+                ORDER BY id
+                LIMIT %s
+                """,
+                (*params, SSE_REPLAY_LIMIT + 1)
+            )
+            rows = cursor.fetchall()
+        conn.commit()
+    if len(rows) > SSE_REPLAY_LIMIT:
+        return None
+    return [change_event(row["id"], (row["date"], row["starttime"], row["endtime"], row["room"],
+                                     row["old_remain"], row["new_remain"], row["kind"])) for row in rows]
+
+
+@router.get("/slots/stream")
+async def stream_slots(
+    request: Request,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    room: Optional[str] = None,
+    kind: Optional[List[str]] = Query(None),
+):
+    """
+    Server-Sent Events stream of slot changes found by each sync. Reconnecting
+    clients send Last-Event-ID and get the changes they missed; a `reset`
+    event means they should reload from /slots instead.
+    """
+    slot_filter = SlotFilter(date_from, date_to, room, kind)
+    last_event_id = request.headers.get("last-event-id", "")
+    last_id = int(last_event_id) if last_event_id.isdigit() else 0
+
+    async def events():
+        nonlocal last_id
+        # Subscribed once the body starts, so a client gone before then leaves nothing behind;
+        # subscribed before replaying so nothing published in between is lost
+        subscriber = slot_hub.subscribe(slot_filter)
+        try:
+            replayed = []
+            if last_id:
+                try:
+                    replayed = await run_blocking("db", replay_changes, last_id, slot_filter)
+                except DatabaseUnavailable:
+                    replayed = None
+            yield "retry: 5000\n\n"
+            if replayed is None:
+                yield "event: reset\ndata: {}\n\n"
+                return
+            for event in replayed:
+                last_id = event["id"]
+                yield format_sse(event)
+            while True:
+                if subscriber.overflowed:
+                    yield "event: reset\ndata: {}\n\n"
+                    return
+                try:
+                    batch = await asyncio.wait_for(subscriber.queue.get(), SSE_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                # Skip anything the replay already sent
+                chunk = "".join(format_sse(event) for event in batch if event["id"] > last_id)
+                if chunk:
+                    yield chunk
+        finally:
+            slot_hub.unsubscribe(subscriber)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+
+
+@router.get("/slots/stream/stats")
+async def stream_stats():
+    return slot_hub.stats()
+
+
+def load_fill_times(date_from, date_to, room):
+    try:
+        with connection() as conn:
+            with conn.cursor() as cursor:
+                stats = fill_times(cursor, date_from, date_to, room)
+            conn.commit()
+    except DatabaseUnavailable:
+        raise HTTPException(status_code=500, detail="Failed to connect to the database")
+    return stats
+
+
+@router.get("/slots/fill-times")
+async def slot_fill_times(
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    room: Optional[str] = None,
+):
+    """
+    How long slots stay bookable, from the occupancy history: median minutes
+    from first seen open to first seen full, per room and weekday (1 = Monday).
+    """
+    date_to = date_to or date.today()
+    date_from = date_from or date_to - timedelta(days=365)
+    if date_from > date_to:
+        raise HTTPException(status_code=400, detail="date_from is after date_to")
+    stats = await run_blocking("db", load_fill_times, date_from, date_to, room)
+    return {"date_from": date_from.isoformat(), "date_to": date_to.isoformat(), "stats": stats}
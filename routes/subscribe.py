@@ -1,7 +1,10 @@
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel, EmailStr
-from email_utils import send_email
-from routes.emails import insert_email
+from concurrency import run_blocking
+from db import connection, DatabaseUnavailable
+from outbox import enqueue_emails, wake
+from routes.emails import add_email
+import psycopg2
 
 router = APIRouter()
 
@@ -9,8 +12,11 @@ class SubscribeRequest(BaseModel):
     email: EmailStr
 
 @router.post("/subscribe")
+async def subscribe_route(req: SubscribeRequest):
+    return await run_blocking("db", subscribe, req)
+
+
 def subscribe(req: SubscribeRequest):
-    insert_email(req.email)
     subject = "Thanks for Subscribing to JP Training!"
     unsubscribe_url = f"https://jp-training.vercel.app/unsubscribe?email={req.email}"
     
@@ -76,13 +82,19 @@ def subscribe(req: SubscribeRequest):
     </html>
     """
 
-    success = send_email(
-        to_email=req.email,
-        subject=subject,
-        body=body
-    )
-
-    if not success:
-        raise HTTPException(status_code=500, detail="Failed to send subscription email.")
+    # The subscription and its welcome email commit together; delivery happens in the outbox worker
+    try:
+        with connection() as conn:
+            with conn.cursor() as cursor:
+                add_email(cursor, req.email)
+                enqueue_emails([(req.email, subject, body)], cursor=cursor)
+            conn.commit()
+    except psycopg2.errors.UniqueViolation:
+        raise HTTPException(status_code=400, detail="Email already exists")
+    except DatabaseUnavailable:
+        raise HTTPException(status_code=500, detail="Failed to connect to the database")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to subscribe: {e}")
+    wake()
 
     return {"message": "Subscribed successfully!"}
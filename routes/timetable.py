@@ -1,54 +1,52 @@
 
+import logging
 import traceback
 from fastapi import APIRouter, HTTPException
 from datetime import datetime, timedelta
-import requests
-import time, os
-from bs4 import BeautifulSoup
-from dotenv import load_dotenv
-from db import get_connection
+from typing import NamedTuple, Optional
+from contextlib import contextmanager
+import time
+from config import settings
+from cache import slots_cache
+from concurrency import run_blocking
+from sync_scheduler import LeaseLost, SyncScheduler, get_job, recent_jobs
+from db import connection, DatabaseUnavailable
+from fetcher import fetch_days
+from resv_session import sessions, LoginError, TIMETABLE_URL
+from timetable_parser import iter_slots
+from fingerprints import Fingerprint, conditional_headers, content_hash, load_fingerprints, save_fingerprints
+from occupancy import record_observations
+from partitions import ensure_partitions, run_maintenance
+from schedules import to_rows, upsert_slots, compute_changes, record_changes, change_counts
+from slot_events import slot_hub, change_event
+from metrics import PARSE_SECONDS, SYNC_STAGE_SECONDS
 from routes.send_emails import send_subscription_email
 
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
-# Load credentials
-load_dotenv()
-userId = os.getenv("JP_ID")
-password = os.getenv("JP_PASSWORD")
+userId = settings.jp_id
+password = settings.jp_password
 
 # HTML parsing helper
 def extract_timetable(html):
-    soup = BeautifulSoup(html, 'html.parser')
-    results = []
-
-    for timeline in soup.select('div.time-line'):
-        time_a = timeline.select_one('li.data-week-info a')
-        room_a = timeline.select_one('li.data-week-mp-name a')
-        remain_span = timeline.select_one('span.zannsu')
-
-        # Extract time range
-        timestr = None
-        if time_a:
-            for part in time_a.contents:
-                if isinstance(part, str) and '-' in part:
-                    timestr = part.strip()
-            if not timestr:
-                lines = time_a.get_text("\n").splitlines()
-                lines = [l.strip() for l in lines if '-' in l]
-                timestr = lines[-1] if lines else '?'
-
-        results.append({
-            "time": timestr or '?',
-            "room": room_a.text.strip() if room_a else '',
-            "remain": int(''.join(filter(str.isdigit, remain_span.text))) if remain_span else 0,
-        })
-
-    return results
+    with PARSE_SECONDS.time(page="timetable"):
+        return list(iter_slots(html, "time-line"))
+
+class DayResult(NamedTuple):
+    slots: Optional[list]  # None when the day is unchanged since the last sync
+    fingerprint: Fingerprint
+    changed: bool
+
 
 # Fetch timetable HTML
 def get_timetable(session, year, month, day, calendar_url):
-    base_url = "https://jptraining.resv.jp/reserve/get_timetable_pc.php"
+    return get_timetable_response(session, year, month, day, calendar_url).text
+
+
+def get_timetable_response(session, year, month, day, calendar_url, extra_headers=None):
+    base_url = TIMETABLE_URL
     params = {
         "view_mode": "day",
         "view_list": "0",
@@ -63,128 +61,165 @@ def get_timetable(session, year, month, day, calendar_url):
         "Referer": calendar_url,
         "User-Agent": "Mozilla/5.0",
         "X-Requested-With": "XMLHttpRequest",
+        **(extra_headers or {}),
     }
-    r = session.get(base_url, params=params, headers=headers)
-    return r.text
-
-# Main sync endpoint
-@router.get("/timetable/sync")
-def sync_timetable():
-    session = requests.Session()
-    login_data = {
-        "loginid": userId,
-        "loginpw": password,
-        "calendar": "1",
-        "login_direct_id": "0",
-        "login_direct_calendar_id": "0",
-        "submit": "Log in"
-    }
+    return session.get(base_url, params=params, headers=headers)
 
-    # Step 1: Login
-    login_url = "https://jptraining.resv.jp/user/usr_login.php"
-    session.post(login_url, data=login_data)
+@contextmanager
+def sync_stage(timings, name, heartbeat=None):
+    if heartbeat is not None:
+        heartbeat(name)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        SYNC_STAGE_SECONDS.observe(elapsed, stage=name)
+        timings[name] = round(elapsed * 1000, 1)
 
-    # Step 2: Verify login
-    mypage = session.get("https://jptraining.resv.jp/user/res_user.php?calendar=1")
-    if 'ログインID' in mypage.text or 'Login ID' in mypage.text:
-        raise HTTPException(status_code=401, detail="Login failed")
 
-    # Step 3: Navigate
-    menu_url = "https://jptraining.resv.jp/user/usr_menu.php"
-    session.get(menu_url)
-    calendar_url = "https://jptraining.resv.jp/reserve/calendar.php"
-    session.get(calendar_url, headers={"Referer": menu_url, "User-Agent": "Mozilla/5.0"})
+# Main sync; runs as a job from sync_scheduler, triggered by /timetable/sync or the schedule
+def sync_timetable(force: bool = False, start_offset: int = 0, max_days: int = 70, progress=None, heartbeat=None):
+    timings = {}
+    # Step 1: Reuse the cached login, logging in only when needed
+    try:
+        with sync_stage(timings, "login", heartbeat):
+            session = sessions.get(userId, password)
+    except LoginError:
+        raise HTTPException(status_code=401, detail="Login failed")
+    calendar_url = session.calendar_url
 
-    # Step 4: Loop through next 6 days
-    today = datetime.today()
+    first_day = datetime.today() + timedelta(days=start_offset)
     summary = []
-    conn = get_connection()
-    if not conn:
-        raise HTTPException(status_code=500, detail="Failed to connect to the database")
-
+    rows = []
+    changed_fingerprints = {}
+    skipped_days = 0
+    max_empty_days = 3
+
+    # Step 2: Load what the previous run saw, unless a full resync is forced
+    previous = {}
+    if not force:
+        try:
+            with sync_stage(timings, "fingerprints", heartbeat), connection() as conn:
+                with conn.cursor() as cursor:
+                    previous = load_fingerprints(cursor, first_day.date(), (first_day + timedelta(days=max_days)).date())
+                conn.commit()
+        except DatabaseUnavailable:
+            raise HTTPException(status_code=500, detail="Failed to connect to the database")
+
+    def fetch_day(date):
+        known = previous.get(date.date())
+        r = get_timetable_response(session, date.year, date.month, date.day, calendar_url,
+                                   conditional_headers(known))
+        if r.status_code == 304 and known:
+            return DayResult(None, known, False)
+
+        html = r.text
+        digest = content_hash(html)
+        if known and known.content_hash == digest:
+            return DayResult(None, known, False)  # unchanged: skip parsing and writes
+
+        slots = extract_timetable(html)
+        fingerprint = Fingerprint(digest, r.headers.get("ETag"), r.headers.get("Last-Modified"), len(slots))
+        return DayResult(slots, fingerprint, True)
+
+    # Step 3: Fetch the window's days concurrently, in date order
+    with sync_stage(timings, "fetch", heartbeat):
+        for done, (date, day) in enumerate(fetch_days(fetch_day, first_day, max_days, max_empty_days,
+                                                      is_empty=lambda day: day.fingerprint.slot_count == 0), 1):
+            if progress is not None:
+                progress(done)
+            if not day.changed:
+                skipped_days += 1
+                if day.fingerprint.slot_count:
+                    summary.append({
+                        "date": date.strftime("%Y-%m-%d"),
+                        "count": day.fingerprint.slot_count,
+                        "skipped": True
+                    })
+                continue
+
+            changed_fingerprints[date.date()] = day.fingerprint
+            if not day.slots:
+                logger.debug("No data found for %s", date.date())
+                continue  # skip DB operation for this date
+
+            rows.extend(to_rows(date.date(), day.slots))
+            summary.append({
+                "date": date.strftime("%Y-%m-%d"),
+                "count": len(day.slots)
+            })
+
+    # Step 4: Write every changed slot in batched upserts
     try:
-        with conn.cursor() as cursor:
-            no_data_days = 0
-            max_days = 70
-            max_empty_days = 3
-            for offset in range(max_days):
-                date = today + timedelta(days=offset)
-                html = get_timetable(session, date.year, date.month, date.day, calendar_url)
-                slots = extract_timetable(html)
-                if not slots:
-                    no_data_days += 1
-                    print(f"No data found for {date.date()} (empty count: {no_data_days})")
-                    if no_data_days >= max_empty_days:
-                        print("No data found for 3 consecutive days. Stopping early.")
-                        break
-                    continue  # skip DB operation for this date
-                else:
-                    no_data_days = 0
-
-                for slot in slots:
-                    # Parse start/end time
-                    if slot["time"] and '-' in slot["time"]:
-                        try:
-                            start_str, end_str = slot["time"].split('-')
-                            start_time = datetime.strptime(start_str.strip(), "%H:%M").time()
-                            end_time = datetime.strptime(end_str.strip(), "%H:%M").time()
-                        except Exception:
-                            continue
-                    else:
-                        continue  # skip malformed entries
-
-                    # Check if already exists
-                    cursor.execute(
-                        """
-                       SELECT id FROM schedules
-                       WHERE date = %s AND starttime = %s AND endtime = %s AND room = %s
-                        """,
-                        (date.date(), start_time, end_time, slot["room"])
-                    )
-                    existing = cursor.fetchone()
-
-                    if existing is not None:
-                        schedule_id = existing["id"] if isinstance(existing, dict) else existing[0]
-                        print(f"Existing entry: {existing}")
-
-                        print(f"Inserting: {date.date()} | {start_time}-{end_time} | {slot['room']} | {slot['remain']}")
-
-                        # Update
-                        cursor.execute(
-                            """
-                            UPDATE schedules
-                            SET room = %s, remain = %s
-                            WHERE id = %s
-                            """,
-                            (slot["room"], slot["remain"], schedule_id)
-                        )
-                    else:
-                        # Insert
-                        print(f"Inserting: {date.date()} | {start_time}-{end_time} | {slot['room']} | {slot['remain']}")
-
-                        cursor.execute(
-                            """
-                            INSERT INTO schedules (date, starttime, endtime, room, remain)
-                            VALUES (%s, %s, %s, %s, %s)
-                            """,
-                            (date.date(), start_time, end_time, slot["room"], slot["remain"])
-                        )
-
-                summary.append({
-                    "date": date.strftime("%Y-%m-%d"),
-                    "count": len(slots)
-                })
-
+        with sync_stage(timings, "write", heartbeat), connection() as conn:
+            with conn.cursor() as cursor:
+                if rows:
+                    ensure_partitions(cursor, min(row[0] for row in rows), max(row[0] for row in rows))
+                # Diff against the previous snapshot before it is overwritten
+                changes = compute_changes(cursor, rows)
+                change_ids = record_changes(cursor, changes)
+                counts = upsert_slots(cursor, rows)
+                observations = record_observations(cursor, rows)
+                save_fingerprints(cursor, changed_fingerprints)
             conn.commit()
+    except DatabaseUnavailable:
+        raise HTTPException(status_code=500, detail="Failed to connect to the database")
+    except LeaseLost:
+        raise
     except Exception as e:
-        conn.rollback()
         raise HTTPException(status_code=500, detail=f"Database error:\n{traceback.format_exc()}")
-    finally:
-        conn.close()
 
-    send_subscription_email()
+    if counts["inserted"] or counts["updated"]:
+        slots_cache.invalidate()
+    slot_hub.publish(change_event(change_id, change) for change_id, change in zip(change_ids, changes))
+
+    with sync_stage(timings, "notify", heartbeat):
+        notifications = send_subscription_email()
 
     return {
         "status": "success",
-        "updated_dates": summary
+        "updated_dates": summary,
+        "skipped_days": skipped_days,
+        **counts,
+        "changes": change_counts(changes),
+        "observations": observations,
+        "notifications": notifications,
+        "timings_ms": timings
     }
+
+
+scheduler = SyncScheduler(sync_timetable, maintenance=run_maintenance)
+
+
+def job_response(job):
+    return {**job, "status_url": f"/timetable/sync/{job['id']}"}
+
+
+# Starts a full sync in the background and returns at once; poll the status_url for progress
+@router.get("/timetable/sync", status_code=202)
+async def sync_timetable_route(force: bool = False):
+    try:
+        job, task = await scheduler.trigger("full", force)
+    except DatabaseUnavailable:
+        raise HTTPException(status_code=500, detail="Failed to connect to the database")
+    return {**job_response(job), "already_running": task is None}
+
+
+@router.get("/timetable/sync/jobs")
+async def sync_jobs_route(limit: int = 20):
+    try:
+        return await run_blocking("db", recent_jobs, min(max(limit, 1), 100))
+    except DatabaseUnavailable:
+        raise HTTPException(status_code=500, detail="Failed to connect to the database")
+
+
+@router.get("/timetable/sync/{job_id}")
+async def sync_job_route(job_id: str):
+    try:
+        job = await run_blocking("db", get_job, job_id)
+    except DatabaseUnavailable:
+        raise HTTPException(status_code=500, detail="Failed to connect to the database")
+    if job is None:
+        raise HTTPException(status_code=404, detail="Sync job not found")
+    return job_response(job)
@@ -2,34 +2,38 @@
 
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel, EmailStr
-from db import get_connection
+from concurrency import run_blocking
+from db import connection, DatabaseUnavailable
 
 
 router = APIRouter()
 
+# Served by the emails_email_lower index
+UNSUBSCRIBE_QUERY = "DELETE FROM emails WHERE lower(email) = lower(%s) RETURNING id"
+
 class SubscribeRequest(BaseModel):
     email: EmailStr
 
 @router.post("/unsubscribe")
-def unsubscribe(req: SubscribeRequest):
-    conn = get_connection()
-    if not conn:
-        raise HTTPException(status_code=500, detail="Failed to connect to the database")
+async def unsubscribe_route(req: SubscribeRequest):
+    return await run_blocking("db", unsubscribe, req)
+
 
+def unsubscribe(req: SubscribeRequest):
     try:
-        with conn.cursor() as cursor:
-            cursor.execute("DELETE FROM emails WHERE email = %s RETURNING id", (req.email,))
-            result = cursor.fetchone()
+        with connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(UNSUBSCRIBE_QUERY, (req.email,))
+                result = cursor.fetchone()
             conn.commit()
 
-        if not result:
-            raise HTTPException(status_code=404, detail="Email not found")
-
-        return {"message": "Unsubscribed successfully!"}
+    except DatabaseUnavailable:
+        raise HTTPException(status_code=500, detail="Failed to connect to the database")
 
     except Exception as e:
-        conn.rollback()
         raise HTTPException(status_code=500, detail=f"Failed to unsubscribe email: {e}")
 
-    finally:
-        conn.close()
+    if not result:
+        raise HTTPException(status_code=404, detail="Email not found")
+
+    return {"message": "Unsubscribed successfully!"}
@@ -0,0 +1,78 @@
+from fastapi import APIRouter, Header, HTTPException
+from pydantic import BaseModel, validator
+from typing import List
+from concurrency import run_blocking
+from db import DatabaseUnavailable
+from routes.book import booking_date, check_login, check_month_day
+from watcher import Watch, booking_watcher, create_watch, list_watches, cancel_watch
+
+router = APIRouter()
+
+
+class WatchRequest(BaseModel):
+    login_id: str
+    login_pw: str
+    month: int
+    day: int
+    start_time: str
+    end_time: str
+    room: str
+    alternate_rooms: List[str] = []
+
+    @validator("month", "day", pre=True)
+    def convert_to_int(cls, v):
+        return int(v)
+
+    check_date = validator("day", allow_reuse=True)(check_month_day)
+
+
+@router.post("/watches", status_code=201)
+async def create_watch_route(data: WatchRequest):
+    if not booking_watcher.running:
+        raise HTTPException(status_code=503, detail="Booking watcher is not running")
+    return await run_blocking("booking", add_watch, data)
+
+
+def add_watch(data: WatchRequest):
+    # Check the login now rather than when the slot opens
+    check_login(data.login_id, data.login_pw)
+
+    date = booking_date(data.month, data.day).date()
+    try:
+        row = create_watch(data.login_id, date, data.start_time, data.end_time, data.room, data.alternate_rooms)
+    except DatabaseUnavailable:
+        raise HTTPException(status_code=500, detail="Failed to connect to the database")
+    if row is None:
+        raise HTTPException(status_code=409, detail="This slot is already being watched")
+
+    booking_watcher.add(Watch(row["id"], row["login_id"], row["date"], row["start_time"], row["end_time"],
+                              row["room"], tuple(row["alternate_rooms"])), data.login_pw)
+    return row
+
+
+# Watches belong to an account: listing and cancelling take its password in X-Login-Password
+@router.get("/watches")
+async def list_watches_route(login_id: str, x_login_password: str = Header(...)):
+    await run_blocking("booking", check_login, login_id, x_login_password)
+    try:
+        return await run_blocking("db", list_watches, login_id)
+    except DatabaseUnavailable:
+        raise HTTPException(status_code=500, detail="Failed to connect to the database")
+
+
+@router.delete("/watches/{watch_id}")
+async def cancel_watch_route(watch_id: int, login_id: str, x_login_password: str = Header(...)):
+    await run_blocking("booking", check_login, login_id, x_login_password)
+    try:
+        cancelled = await run_blocking("db", cancel_watch, watch_id, login_id)
+    except DatabaseUnavailable:
+        raise HTTPException(status_code=500, detail="Failed to connect to the database")
+    if not cancelled:
+        raise HTTPException(status_code=404, detail="No active watch with that id")
+    booking_watcher.remove(watch_id)
+    return {"status": "cancelled", "id": watch_id}
+
+
+@router.get("/watches/stats")
+async def watch_stats():
+    return booking_watcher.stats()
@@ -0,0 +1,125 @@
+from datetime import datetime
+from psycopg2.extras import execute_values
+
+UPSERT_BATCH_SIZE = 500
+
+# schedules is partitioned, so the xmax trick for telling inserts from updates is unavailable;
+# the outer SELECT still sees the table as it was before the INSERT, which tells them apart
+UPSERT_SQL = """
+    WITH written AS (
+        INSERT INTO schedules (date, starttime, endtime, room, remain)
+        VALUES %s
+        ON CONFLICT (date, starttime, endtime, room)
+        DO UPDATE SET remain = EXCLUDED.remain
+        WHERE schedules.remain IS DISTINCT FROM EXCLUDED.remain
+        RETURNING date, starttime, endtime, room
+    )
+    SELECT NOT EXISTS (
+        SELECT 1 FROM schedules s
+        WHERE (s.date, s.starttime, s.endtime, s.room) = (w.date, w.starttime, w.endtime, w.room)
+    ) AS inserted
+    FROM written w
+"""
+
+
+def parse_time_range(timestr):
+    if not timestr or '-' not in timestr:
+        return None
+    try:
+        start_str, end_str = timestr.split('-')
+        start_time = datetime.strptime(start_str.strip(), "%H:%M").time()
+        end_time = datetime.strptime(end_str.strip(), "%H:%M").time()
+    except ValueError:
+        return None
+    return start_time, end_time
+
+
+def to_rows(date, slots):
+    rows = []
+    for slot in slots:
+        times = parse_time_range(slot.time)
+        if times is None:
+            continue  # skip malformed entries
+        rows.append((date, times[0], times[1], slot.room, slot.remain))
+    return rows
+
+
+# Changes that give subscribers something new to book
+NOTIFY_KINDS = ("opened", "increased")
+
+
+def change_kind(old_remain, new_remain):
+    if old_remain == new_remain or (old_remain is None and new_remain <= 0):
+        return None
+    if not old_remain or old_remain <= 0:
+        return "opened" if new_remain > 0 else None
+    if new_remain <= 0:
+        return "filled"
+    return "increased" if new_remain > old_remain else "decreased"
+
+
+PREVIOUS_SLOTS_QUERY = "SELECT date, starttime, endtime, room, remain FROM schedules WHERE date = ANY(%s)"
+
+
+def compute_changes(cursor, rows):
+    """Diff scraped rows against what schedules currently holds for the same dates."""
+    dates = sorted({row[0] for row in rows})
+    if not dates:
+        return []
+    cursor.execute(PREVIOUS_SLOTS_QUERY, (dates,))
+    previous = {(r["date"], r["starttime"], r["endtime"], r["room"]): r["remain"] for r in cursor.fetchall()}
+
+    changes = []
+    for key, row in {row[:4]: row for row in rows}.items():
+        old_remain = previous.get(key)
+        kind = change_kind(old_remain, row[4])
+        if kind:
+            changes.append((*key, old_remain, row[4], kind))
+    return changes
+
+
+def record_changes(cursor, changes):
+    """Store changes in slot_changes; returns their ids in the same order."""
+    if not changes:
+        return []
+    written = execute_values(
+        cursor,
+        """
+        INSERT INTO slot_changes (date, starttime, endtime, room, old_remain, new_remain, kind)
+        VALUES %s
+        RETURNING id
+        """,
+        changes,
+        page_size=UPSERT_BATCH_SIZE,
+        fetch=True,
+    )
+    return [row["id"] if isinstance(row, dict) else row[0] for row in written]
+
+
+def change_counts(changes):
+    counts = {"opened": 0, "filled": 0, "increased": 0, "decreased": 0}
+    for change in changes:
+        counts[change[6]] += 1
+    return counts
+
+
+def upsert_slots(cursor, rows, page_size=UPSERT_BATCH_SIZE):
+    """
+    Write scraped (date, starttime, endtime, room, remain) rows with one
+    INSERT ... ON CONFLICT statement per batch. Rows whose remain is unchanged
+    are left untouched, so they are not returned and count as unchanged.
+    """
+    # ON CONFLICT cannot touch the same row twice in one statement; keep the last sighting
+    deduped = {row[:4]: row for row in rows}
+    rows = list(deduped.values())
+
+    counts = {"inserted": 0, "updated": 0, "unchanged": 0}
+    if not rows:
+        return counts
+
+    written = execute_values(cursor, UPSERT_SQL, rows, page_size=page_size, fetch=True)
+    for row in written:
+        inserted = row["inserted"] if isinstance(row, dict) else row[0]
+        counts["inserted" if inserted else "updated"] += 1
+    counts["unchanged"] = len(rows) - len(written)
+    return counts
@@ -0,0 +1,113 @@
+import asyncio
+import json
+import threading
+from config import settings
+
+SSE_QUEUE_SIZE = settings.sse_queue_size
+SSE_HEARTBEAT = settings.sse_heartbeat
+SSE_REPLAY_LIMIT = settings.sse_replay_limit
+
+
+def change_event(change_id, change):
+    day, start, end, room, old_remain, new_remain, kind = change
+    return {
+        "id": change_id,
+        "date": day.isoformat(),
+        "starttime": start.isoformat(),
+        "endtime": end.isoformat(),
+        "room": room,
+        "old_remain": old_remain,
+        "remain": new_remain,
+        "kind": kind,
+    }
+
+
+def format_sse(event, name="change"):
+    return f"id: {event['id']}\nevent: {name}\ndata: {json.dumps(event)}\n\n"
+
+
+class SlotFilter:
+    def __init__(self, date_from=None, date_to=None, room=None, kinds=None):
+        # ISO dates compare correctly as strings
+        self.date_from = date_from.isoformat() if date_from else None
+        self.date_to = date_to.isoformat() if date_to else None
+        self.room = room
+        self.kinds = set(kinds) if kinds else None
+
+    def matches(self, event):
+        return ((self.date_from is None or event["date"] >= self.date_from)
+                and (self.date_to is None or event["date"] <= self.date_to)
+                and (self.room is None or event["room"] == self.room)
+                and (self.kinds is None or event["kind"] in self.kinds))
+
+
+class Subscriber:
+    def __init__(self, slot_filter):
+        self.filter = slot_filter
+        self.queue = asyncio.Queue(maxsize=SSE_QUEUE_SIZE)
+        self.overflowed = False
+
+
+class SlotEventHub:
+    """
+    Fans slot changes out to streaming clients on the event loop. Syncs run on
+    worker threads and hand their changes over with publish(); each client
+    only gets the events its filter matches, and an idle client is just a
+    queue waiting on the loop.
+    """
+
+    def __init__(self):
+        self._subscribers = set()
+        self._loop = None
+        self._lock = threading.Lock()
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+
+    def subscribe(self, slot_filter):
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+        subscriber = Subscriber(slot_filter)
+        self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        self._subscribers.discard(subscriber)
+
+    def publish(self, events):
+        """Thread-safe; a no-op until a client has connected."""
+        events = list(events)
+        with self._lock:
+            self.published += len(events)
+        loop = self._loop
+        if events and loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self._dispatch, events)
+
+    def _dispatch(self, events):
+        for subscriber in list(self._subscribers):
+            if subscriber.overflowed:
+                continue
+            matched = [event for event in events if subscriber.filter.matches(event)]
+            if not matched:
+                continue
+            try:
+                subscriber.queue.put_nowait(matched)
+                self.delivered += len(matched)
+            except asyncio.QueueFull:
+                # A client this far behind resyncs from /slots rather than holding memory
+                subscriber.overflowed = True
+                self.dropped += 1
+
+    def close(self):
+        self._loop = None
+
+    def stats(self):
+        return {
+            "clients": len(self._subscribers),
+            "published": self.published,
+            "delivered": self.delivered,
+            "dropped_clients": self.dropped,
+        }
+
+
+slot_hub = SlotEventHub()
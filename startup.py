@@ -0,0 +1,122 @@
+"""
+Cold-start report: where import time goes, and how long a fresh process
+takes to answer its first request.
+
+    python startup.py
+    python startup.py --runs 5 --budget-ms 2500 --json startup.json
+"""
+import argparse
+import json
+import os
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+# Time-to-first-response the service should stay under without a keep-alive ping
+STARTUP_BUDGET_MS = 3000
+
+_IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def first_party(name):
+    root = name.split(".")[0]
+    return os.path.exists(os.path.join(ROOT, root + ".py")) or os.path.isdir(os.path.join(ROOT, root))
+
+
+def import_times(module="main"):
+    """Run `python -X importtime -c "import <module>"`; returns [(name, self_us, cumulative_us, depth)]."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=ROOT, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise SystemExit(f"import {module} failed:\n{result.stderr[-2000:]}")
+    return [(m.group(4), int(m.group(1)), int(m.group(2)), len(m.group(3)) // 2)
+            for m in map(_IMPORT_LINE.match, result.stderr.splitlines()) if m]
+
+
+def import_report(module="main", top=15):
+    entries = import_times(module)
+    by_package = defaultdict(int)
+    for name, self_us, _, _ in entries:
+        if not first_party(name):
+            by_package[name.split(".")[0]] += self_us
+    total_us = next(cumulative for name, _, cumulative, _ in entries if name == module)
+    return {
+        "total_ms": round(total_us / 1000, 1),
+        "modules": len(entries),
+        # Third-party packages by their own (self) import time, all submodules included
+        "packages_ms": {name: round(us / 1000, 1) for name, us in
+                        sorted(by_package.items(), key=lambda item: -item[1])[:top]},
+        # The app's own modules, with everything they pull in
+        "app_modules_ms": {name: round(cumulative / 1000, 1) for name, _, cumulative, _ in
+                           sorted(entries, key=lambda entry: -entry[2]) if first_party(name)},
+    }
+
+
+def time_to_first_response(path="/health/live", timeout=60):
+    """Start `uvicorn main:app` and time until `path` first answers 200; returns milliseconds."""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    url = f"http://127.0.0.1:{port}{path}"
+    started = time.perf_counter()
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1",
+                               "--port", str(port), "--log-level", "warning"],
+                              cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    try:
+        while time.perf_counter() - started < timeout:
+            if server.poll() is not None:
+                raise SystemExit(f"server exited during startup:\n{server.stderr.read().decode()[-2000:]}")
+            try:
+                with urllib.request.urlopen(url, timeout=1) as r:
+                    if r.status == 200:
+                        return round((time.perf_counter() - started) * 1000, 1)
+            except OSError:
+                time.sleep(0.01)
+        raise SystemExit(f"no response from {url} within {timeout}s")
+    finally:
+        server.terminate()
+        try:
+            server.wait(10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=3, help="server starts to take the median of")
+    parser.add_argument("--top", type=int, default=15, help="packages listed in the import breakdown")
+    parser.add_argument("--budget-ms", type=float, default=STARTUP_BUDGET_MS)
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    imports = import_report(top=args.top)
+    print(f"import main: {imports['total_ms']:.1f} ms across {imports['modules']} modules")
+    print("\nslowest packages (self time):")
+    for name, ms in imports["packages_ms"].items():
+        print(f"  {name:30s} {ms:8.1f} ms")
+    print("\napp modules (cumulative):")
+    for name, ms in imports["app_modules_ms"].items():
+        print(f"  {name:30s} {ms:8.1f} ms")
+
+    runs = [time_to_first_response() for _ in range(args.runs)]
+    first_response_ms = statistics.median(runs)
+    within_budget = first_response_ms <= args.budget_ms
+    print(f"\ntime to first response: {first_response_ms:.1f} ms (median of {args.runs}: "
+          f"{', '.join(f'{ms:.0f}' for ms in runs)}); budget {args.budget_ms:.0f} ms "
+          f"{'OK' if within_budget else 'EXCEEDED'}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"imports": imports, "first_response_ms": first_response_ms, "runs_ms": runs,
+                       "budget_ms": args.budget_ms, "within_budget": within_budget}, f, indent=2)
+    sys.exit(0 if within_budget else 1)
+
+
+if __name__ == "__main__":
+    main()
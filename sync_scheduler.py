@@ -0,0 +1,302 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+import uuid
+from datetime import datetime, timezone
+from fastapi import HTTPException
+from concurrency import run_blocking
+from config import settings
+from db import connection
+
+logger = logging.getLogger(__name__)
+
+SYNC_SCHEDULER = settings.sync_scheduler
+SYNC_MAX_DAYS = 70
+SYNC_NEAR_DAYS = settings.sync_near_days
+SYNC_NEAR_INTERVAL = settings.sync_near_interval
+SYNC_FAR_INTERVAL = settings.sync_far_interval
+SYNC_TICK = settings.sync_tick
+SYNC_LEASE_SECONDS = settings.sync_lease_seconds
+SCHEDULES_MAINTENANCE_INTERVAL = settings.schedules_maintenance_interval
+
+INSTANCE_ID = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+# kind -> (first day offset, number of days)
+WINDOWS = {
+    "near": (0, SYNC_NEAR_DAYS),
+    "far": (SYNC_NEAR_DAYS, SYNC_MAX_DAYS - SYNC_NEAR_DAYS),
+    "full": (0, SYNC_MAX_DAYS),
+}
+SCHEDULE = (("near", SYNC_NEAR_INTERVAL), ("far", SYNC_FAR_INTERVAL))
+
+JOB_COLUMNS = "id, kind, force, status, days_done, result, error, created_at, started_at, finished_at"
+
+
+class LeaseLost(Exception):
+    pass
+
+
+def lease_holder(run_id):
+    """Holder token for one run: another job, even in this process, can't take over its lease."""
+    return f"{INSTANCE_ID}:{run_id}"
+
+
+def acquire_lease(holder, name="timetable_sync"):
+    with connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                """
+                INSERT INTO sync_lease (name, holder, expires_at)
+                VALUES (%s, %s, now() + make_interval(secs => %s))
+                ON CONFLICT (name) DO UPDATE
+                    SET holder = EXCLUDED.holder, expires_at = EXCLUDED.expires_at
+                    WHERE sync_lease.expires_at < now()
+                RETURNING holder
+                """,
+                (name, holder, SYNC_LEASE_SECONDS),
+            )
+            acquired = cursor.fetchone() is not None
+        conn.commit()
+    return acquired
+
+
+def _renew_lease(cursor, holder, name):
+    cursor.execute(
+        """
+        UPDATE sync_lease SET expires_at = now() + make_interval(secs => %s)
+        WHERE name = %s AND holder = %s
+        RETURNING holder
+        """,
+        (SYNC_LEASE_SECONDS, name, holder),
+    )
+    return cursor.fetchone() is not None
+
+
+def renew_lease(holder, name="timetable_sync"):
+    """Extend `holder`'s lease; returns False when it has expired and been taken over."""
+    with connection() as conn:
+        with conn.cursor() as cursor:
+            renewed = _renew_lease(cursor, holder, name)
+        conn.commit()
+    return renewed
+
+
+def release_lease(holder, name="timetable_sync"):
+    with connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("DELETE FROM sync_lease WHERE name = %s AND holder = %s", (name, holder))
+        conn.commit()
+
+
+def create_job(kind, force=False):
+    """Queue a job; returns (row, created). A kind with a job already open gets that job back."""
+    with connection() as conn:
+        with conn.cursor() as cursor:
+            # Jobs orphaned by a replica that died mid-run would otherwise block their kind
+            cursor.execute(
+                """
+                UPDATE sync_jobs SET status = 'failed', error = 'Abandoned', finished_at = now(), updated_at = now()
+                WHERE kind = %s AND status IN ('queued', 'running')
+                  AND updated_at < now() - make_interval(secs => %s)
+                """,
+                (kind, SYNC_LEASE_SECONDS),
+            )
+            cursor.execute(
+                f"""
+                INSERT INTO sync_jobs (id, kind, force) VALUES (%s, %s, %s)
+                ON CONFLICT (kind) WHERE status IN ('queued', 'running') DO NOTHING
+                RETURNING {JOB_COLUMNS}
+                """,
+                (uuid.uuid4().hex, kind, force),
+            )
+            row = cursor.fetchone()
+            created = row is not None
+            if not created:
+                cursor.execute(
+                    f"SELECT {JOB_COLUMNS} FROM sync_jobs WHERE kind = %s AND status IN ('queued', 'running')",
+                    (kind,),
+                )
+                row = cursor.fetchone()
+        conn.commit()
+    return row, created
+
+
+def update_job(job_id, holder=None, **fields):
+    """Set a job's fields; with `holder`, also extend that holder's lease in the same transaction."""
+    assignments = ", ".join(f"{name} = %s" for name in fields)
+    values = [json.dumps(v, default=str) if name == "result" else v for name, v in fields.items()]
+    with connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE sync_jobs SET {assignments}, updated_at = now() WHERE id = %s",
+                (*values, job_id),
+            )
+            renewed = holder is None or _renew_lease(cursor, holder, "timetable_sync")
+        conn.commit()
+    if not renewed:
+        raise LeaseLost("Lost the sync lease to another replica")
+
+
+def get_job(job_id):
+    with connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(f"SELECT {JOB_COLUMNS} FROM sync_jobs WHERE id = %s", (job_id,))
+            row = cursor.fetchone()
+        conn.commit()
+    return row
+
+
+def recent_jobs(limit=20):
+    with connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                f"SELECT {JOB_COLUMNS} FROM sync_jobs ORDER BY created_at DESC LIMIT %s",
+                (limit,),
+            )
+            rows = cursor.fetchall()
+        conn.commit()
+    return rows
+
+
+def seconds_since_success(kind):
+    with connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT EXTRACT(EPOCH FROM now() - max(finished_at)) AS age
+                FROM sync_jobs WHERE kind = %s AND status = 'succeeded'
+                """,
+                (kind,),
+            )
+            age = cursor.fetchone()["age"]
+        conn.commit()
+    return float(age) if age is not None else None
+
+
+class SyncScheduler:
+    """
+    Runs timetable syncs as jobs: near days every SYNC_NEAR_INTERVAL, the
+    rest every SYNC_FAR_INTERVAL, plus on-demand jobs from /timetable/sync.
+    Jobs run on the "sync" thread budget, and the Postgres lease keeps
+    replicas from syncing at the same time. `maintenance`, if given, runs
+    every SCHEDULES_MAINTENANCE_INTERVAL under a lease of its own.
+    """
+
+    def __init__(self, sync, maintenance=None):
+        self.sync = sync
+        self.maintenance = maintenance
+        self._maintained_at = None
+        self._failures = {}  # kind -> (failures in a row, monotonic time of the last one)
+        self._task = None
+        self._jobs = set()  # running job tasks, kept referenced until done
+
+    def run_job(self, job_id, kind, force):
+        """Blocking: run one queued job to completion; returns its final status."""
+        holder = lease_holder(job_id)
+        if not acquire_lease(holder):
+            update_job(job_id, status="skipped", error="Another sync is running",
+                       finished_at=datetime.now(timezone.utc))
+            return "skipped"
+
+        def heartbeat(stage):
+            if not renew_lease(holder):
+                raise LeaseLost(f"Lost the sync lease before the {stage} stage")
+
+        status = "failed"
+        try:
+            update_job(job_id, status="running", started_at=datetime.now(timezone.utc))
+            start_offset, max_days = WINDOWS[kind]
+            # Each finished day and each stage boundary extends the lease
+            result = self.sync(force, start_offset, max_days,
+                               progress=lambda done: update_job(job_id, holder, days_done=done),
+                               heartbeat=heartbeat)
+            update_job(job_id, status="succeeded", result=result, finished_at=datetime.now(timezone.utc))
+            status = "succeeded"
+        except HTTPException as e:
+            update_job(job_id, status="failed", error=str(e.detail), finished_at=datetime.now(timezone.utc))
+        except Exception as e:
+            logger.exception("Sync job %s failed", job_id)
+            update_job(job_id, status="failed", error=str(e), finished_at=datetime.now(timezone.utc))
+        finally:
+            release_lease(holder)
+        return status
+
+    def retry_delay(self, kind, interval):
+        """Seconds left before a kind whose last scheduled job failed may run again."""
+        if kind not in self._failures:
+            return 0
+        failures, failed_at = self._failures[kind]
+        # SYNC_TICK, doubling with each failure in a row, never longer than the kind's interval
+        backoff = min(interval, SYNC_TICK * 2 ** (failures - 1))
+        return max(0, failed_at + backoff - time.monotonic())
+
+    def run_maintenance(self):
+        """Blocking: run the maintenance job unless another replica is at it."""
+        holder = lease_holder(uuid.uuid4().hex)
+        if not acquire_lease(holder, "schedules_maintenance"):
+            return None
+        try:
+            return self.maintenance()
+        finally:
+            release_lease(holder, "schedules_maintenance")
+
+    async def trigger(self, kind="full", force=False):
+        """Queue a job and start it in the background; returns (job row, task or None if it was already open)."""
+        job, created = await run_blocking("db", create_job, kind, force)
+        if not created:
+            return job, None
+        task = asyncio.create_task(run_blocking("sync", self.run_job, job["id"], kind, force))
+        self._jobs.add(task)
+        task.add_done_callback(self._jobs.discard)
+        return job, task
+
+    async def run(self):
+        while True:
+            for kind, interval in SCHEDULE:
+                try:
+                    # A bad password or a site outage would otherwise mean a login every tick
+                    if self.retry_delay(kind, interval) > 0:
+                        continue
+                    age = await run_blocking("db", seconds_since_success, kind)
+                    if age is None or age >= interval:
+                        _, task = await self.trigger(kind)
+                        if task is not None:
+                            status = await task
+                            if status == "failed":
+                                failures = self._failures.get(kind, (0, None))[0] + 1
+                                self._failures[kind] = (failures, time.monotonic())
+                                logger.warning("Scheduled %s sync failed %d time(s) in a row; retrying in %.0fs",
+                                               kind, failures, self.retry_delay(kind, interval))
+                            elif status == "succeeded":
+                                self._failures.pop(kind, None)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error("Sync scheduler error (%s): %s", kind, e)
+            if self.maintenance is not None and (
+                    self._maintained_at is None
+                    or time.monotonic() - self._maintained_at >= SCHEDULES_MAINTENANCE_INTERVAL):
+                try:
+                    result = await run_blocking("sync", self.run_maintenance)
+                    self._maintained_at = time.monotonic()
+                    if result is not None:
+                        logger.info("Schedules maintenance: %s", result)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error("Schedules maintenance error: %s", e)
+            await asyncio.sleep(SYNC_TICK)
+
+    def start(self):
+        self._task = asyncio.create_task(self.run())
+        return self
+
+    def stop(self):
+        # Running syncs finish on their thread; only the waiting is cancelled
+        for task in [self._task, *self._jobs]:
+            if task is not None:
+                task.cancel()
+        self._task = None
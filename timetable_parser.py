@@ -0,0 +1,156 @@
+from io import BytesIO
+from typing import NamedTuple, Optional
+from config import settings
+
+TIMETABLE_PARSER = settings.timetable_parser
+
+
+class Slot(NamedTuple):
+    time: str
+    room: str
+    remain: int
+    detail_url: Optional[str] = None
+
+
+def _time_range(direct_texts, full_text):
+    # Prefer a time range that sits directly inside the <a>, else any line of its text
+    timestr = None
+    for part in direct_texts:
+        if part and '-' in part:
+            timestr = part.strip()
+    if not timestr:
+        lines = [l.strip() for l in full_text.splitlines() if '-' in l]
+        timestr = lines[-1] if lines else '?'
+    return timestr
+
+
+def _remain(text):
+    digits = ''.join(filter(str.isdigit, text))
+    return int(digits) if digits else 0
+
+
+def _iter_bs4(html, container):
+    from bs4 import BeautifulSoup, SoupStrainer
+
+    # Only the container subtrees are built into the tree. Lessons sit inside
+    # time-lines and the strainer doesn't look inside unmatched divs, so keep both.
+    strainer = SoupStrainer('div', class_=['time-line', container])
+    soup = BeautifulSoup(html, 'html.parser', parse_only=strainer)
+
+    for block in soup.select(f'div.{container}'):
+        time_a = block.select_one('li.data-week-info a')
+        room_a = block.select_one('li.data-week-mp-name a')
+        remain_span = block.select_one('span.zannsu')
+
+        timestr = None
+        if time_a:
+            direct = [part for part in time_a.contents if isinstance(part, str)]
+            timestr = _time_range(direct, time_a.get_text("\n"))
+
+        yield Slot(
+            time=timestr or '?',
+            room=room_a.text.strip() if room_a else '',
+            remain=_remain(remain_span.text) if remain_span else 0,
+            detail_url=time_a.get('href') if time_a else None,
+        )
+
+
+def _iter_lxml(html, container):
+    from lxml import etree
+
+    def has_class(name):
+        return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+    find_time = etree.XPath(f".//li[{has_class('data-week-info')}]//a")
+    find_room = etree.XPath(f".//li[{has_class('data-week-mp-name')}]//a")
+    find_remain = etree.XPath(f".//span[{has_class('zannsu')}]")
+
+    data = html.encode('utf-8') if isinstance(html, str) else html
+    if not data.strip():
+        return
+    # Stream the document and handle each container as soon as it is closed
+    for _, block in etree.iterparse(BytesIO(data), events=('end',), tag='div', html=True,
+                                    encoding='utf-8', recover=True):
+        if container not in (block.get('class') or '').split():
+            continue
+
+        time_a = next(iter(find_time(block)), None)
+        room_a = next(iter(find_room(block)), None)
+        remain_span = next(iter(find_remain(block)), None)
+
+        timestr = None
+        if time_a is not None:
+            direct = [time_a.text] + [child.tail for child in time_a]
+            timestr = _time_range(direct, "\n".join(t for t in time_a.itertext()))
+
+        yield Slot(
+            time=timestr or '?',
+            room="".join(room_a.itertext()).strip() if room_a is not None else '',
+            remain=_remain("".join(remain_span.itertext())) if remain_span is not None else 0,
+            detail_url=time_a.get('href') if time_a is not None else None,
+        )
+        block.clear(keep_tail=True)
+
+
+def _iter_selectolax(html, container):
+    from selectolax.lexbor import LexborHTMLParser
+
+    tree = LexborHTMLParser(html)
+    for block in tree.css(f'div.{container}'):
+        time_a = block.css_first('li.data-week-info a')
+        room_a = block.css_first('li.data-week-mp-name a')
+        remain_span = block.css_first('span.zannsu')
+
+        timestr = None
+        if time_a is not None:
+            direct = [node.text_content for node in time_a.iter(include_text=True) if node.tag == '-text']
+            timestr = _time_range(direct, time_a.text(separator="\n"))
+
+        yield Slot(
+            time=timestr or '?',
+            room=room_a.text().strip() if room_a is not None else '',
+            remain=_remain(remain_span.text()) if remain_span is not None else 0,
+            detail_url=time_a.attributes.get('href') if time_a is not None else None,
+        )
+
+
+BACKENDS = {
+    "selectolax": ("selectolax", _iter_selectolax),
+    "lxml": ("lxml", _iter_lxml),
+    "bs4": ("bs4", _iter_bs4),
+}
+
+
+def available_backends():
+    names = []
+    for name, (module, _) in BACKENDS.items():
+        try:
+            __import__(module)
+            names.append(name)
+        except ImportError:
+            continue
+    return names
+
+
+def _pick_backend(name):
+    if name != "auto":
+        return BACKENDS[name][1]
+    return BACKENDS[available_backends()[0]][1]
+
+
+_default_backend = None
+
+
+def iter_slots(html, container="time-line", backend=None):
+    """
+    Yield a Slot for every `div.<container>` in a timetable page. The sync uses
+    "time-line" blocks, the booking flow "lesson" blocks.
+    """
+    global _default_backend
+    if backend is None:
+        if _default_backend is None:
+            _default_backend = _pick_backend(TIMETABLE_PARSER)
+        parse = _default_backend
+    else:
+        parse = _pick_backend(backend)
+    return parse(html, container)
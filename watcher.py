@@ -0,0 +1,443 @@
+import logging
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date as date_type
+from typing import NamedTuple, Tuple
+from fastapi import HTTPException
+from config import settings
+from db import connection
+from fingerprints import content_hash
+from ratelimit import RateLimiter
+from resv_session import sessions, LoginError
+from routes.book import BookingTarget, StepTimer, get_timetable, extract_timetable, reserve
+from sync_scheduler import INSTANCE_ID
+
+logger = logging.getLogger(__name__)
+
+WATCH_INTERVAL_MIN = settings.watch_interval_min
+WATCH_INTERVAL_MAX = settings.watch_interval_max
+WATCH_BACKOFF = settings.watch_backoff
+WATCH_MAX_ATTEMPTS = settings.watch_max_attempts
+WATCH_FETCH_WORKERS = settings.watch_fetch_workers
+WATCH_BOOKING_WORKERS = settings.watch_booking_workers
+WATCH_MAX_RPS = settings.watch_max_rps
+WATCH_STALE_SECONDS = settings.watch_stale_seconds
+BOOKING_WATCHER = settings.booking_watcher
+
+# Day pages are polled with the sync account when there is one, else with a watcher's own login
+POLL_ID = settings.jp_id
+POLL_PASSWORD = settings.jp_password
+
+
+class Watch(NamedTuple):
+    id: int
+    login_id: str
+    date: date_type
+    start_time: str
+    end_time: str
+    room: str
+    alternate_rooms: Tuple[str, ...] = ()
+
+    def target(self):
+        return BookingTarget(month=self.date.month, day=self.date.day, date=self.date,
+                             start_time=self.start_time, end_time=self.end_time, room=self.room,
+                             alternate_rooms=list(self.alternate_rooms))
+
+
+WATCH_COLUMNS = """id, login_id, date, start_time, end_time, room, alternate_rooms, status,
+                   attempts, booked_room, last_error, created_at, updated_at"""
+
+
+def create_watch(login_id, date, start_time, end_time, room, alternate_rooms=()):
+    """Store a new watch; returns its row, or None when the account already watches that target."""
+    with connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO booking_watches (login_id, date, start_time, end_time, room, alternate_rooms, owner)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
+                ON CONFLICT (login_id, date, start_time, end_time, room)
+                    WHERE status IN ('active', 'booking') DO NOTHING
+                RETURNING {WATCH_COLUMNS}
+                """,
+                (login_id, date, start_time, end_time, room, list(alternate_rooms), INSTANCE_ID),
+            )
+            row = cursor.fetchone()
+        conn.commit()
+    return row
+
+
+def list_watches(login_id):
+    with connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                f"SELECT {WATCH_COLUMNS} FROM booking_watches WHERE login_id = %s ORDER BY created_at DESC, id DESC",
+                (login_id,),
+            )
+            rows = cursor.fetchall()
+        conn.commit()
+    return rows
+
+
+def cancel_watch(watch_id, login_id):
+    with connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                """
+                UPDATE booking_watches SET status = 'cancelled', updated_at = now()
+                WHERE id = %s AND login_id = %s AND status = 'active'
+                RETURNING id
+                """,
+                (watch_id, login_id),
+            )
+            row = cursor.fetchone()
+        conn.commit()
+    return row is not None
+
+
+def claim_watch(watch_id):
+    # Only one poller can move a watch from active to booking, so an opening is booked once
+    with connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                """
+                UPDATE booking_watches SET status = 'booking', attempts = attempts + 1, updated_at = now()
+                WHERE id = %s AND status = 'active'
+                RETURNING attempts
+                """,
+                (watch_id,),
+            )
+            row = cursor.fetchone()
+        conn.commit()
+    return row["attempts"] if row else None
+
+
+def finish_watch(watch_id, status, booked_room=None, error=None):
+    with connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                """
+                UPDATE booking_watches
+                SET status = %s, booked_room = %s, last_error = %s, updated_at = now()
+                WHERE id = %s
+                """,
+                (status, booked_room, error, watch_id),
+            )
+        conn.commit()
+
+
+def close_watches(status, error, ids):
+    with connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                """
+                UPDATE booking_watches SET status = %s, last_error = %s, updated_at = now()
+                WHERE id = ANY(%s) AND status IN ('active', 'booking')
+                """,
+                (status, error, list(ids)),
+            )
+        conn.commit()
+
+
+def heartbeat_watches(ids):
+    """Refresh the heartbeat of the watches this process holds, and cancel the ones nobody holds.
+
+    Each replica keeps the passwords for its own watches only, so a watch is cancelled once
+    its heartbeat is WATCH_STALE_SECONDS old: its owner has exited or dropped it.
+    """
+    with connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                """
+                UPDATE booking_watches SET heartbeat_at = now()
+                WHERE id = ANY(%s) AND owner = %s AND status IN ('active', 'booking')
+                """,
+                (list(ids), INSTANCE_ID),
+            )
+            cursor.execute(
+                """
+                UPDATE booking_watches
+                SET status = 'cancelled', last_error = 'Server restarted; register the watch again',
+                    updated_at = now()
+                WHERE status IN ('active', 'booking') AND heartbeat_at < now() - make_interval(secs => %s)
+                """,
+                (WATCH_STALE_SECONDS,),
+            )
+            closed = cursor.rowcount
+        conn.commit()
+    return closed
+
+
+def _in_window(slot, watch):
+    start, end = slot["time"].split("-")
+    return start.strip() >= watch.start_time and end.strip() <= watch.end_time
+
+
+def match_slot(open_slots, watch, capacity):
+    """The first open slot for `watch` that this poll hasn't already handed to another watch."""
+    for room in (watch.room, *watch.alternate_rooms):
+        for slot in open_slots:
+            key = (slot["time"], slot["room"])
+            if slot["room"] == room and capacity.get(key, 0) > 0 and _in_window(slot, watch):
+                return slot
+    return None
+
+
+class DayState:
+    def __init__(self):
+        self.interval = WATCH_INTERVAL_MIN
+        self.next_poll = 0.0
+        self.content_hash = None
+
+    def polled(self, digest, now):
+        if self.content_hash is not None and digest != self.content_hash:
+            self.interval = WATCH_INTERVAL_MIN
+        else:
+            self.interval = min(self.interval * WATCH_BACKOFF, WATCH_INTERVAL_MAX)
+        self.content_hash = digest
+        self.next_poll = now + self.interval
+
+    def hurry(self, now):
+        self.interval = WATCH_INTERVAL_MIN
+        self.next_poll = min(self.next_poll, now + self.interval)
+
+
+class BookingWatcher:
+    """
+    Polls the days that have watches and books a watch the moment its slot has
+    a seat. Watches are grouped per day, so each day page is fetched once per
+    poll however many watches it has. Passwords are kept in memory only, so
+    open watches are closed once the process holding them stops heartbeating.
+    """
+
+    def __init__(self):
+        self._watches = {}  # id -> (Watch, password)
+        self._days = {}  # date -> DayState
+        self._in_flight = set()
+        # Seats taken by bookings in flight, and by ones that finished after a page was fetched
+        self._holds = Counter()  # (date, time, room) -> bookings in flight
+        self._released = []  # (key, released_at)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._next_heartbeat = 0.0
+        self._fetcher = None
+        self._booker = None
+        self._limiter = RateLimiter(WATCH_MAX_RPS)
+        self.polls = 0
+        self.poll_errors = 0
+        self.booked = 0
+        self.failed = 0
+
+    def add(self, watch, password):
+        with self._lock:
+            self._watches[watch.id] = (watch, password)
+            self._days.setdefault(watch.date, DayState()).next_poll = 0.0
+        self._wakeup.set()
+
+    def remove(self, watch_id):
+        with self._lock:
+            self._watches.pop(watch_id, None)
+
+    def tick(self):
+        """Poll every due day once and start bookings for the watches whose slot opened."""
+        now = time.monotonic()
+        today = date_type.today()
+        with self._lock:
+            expired = [watch_id for watch_id, (watch, _) in self._watches.items()
+                       if watch.date < today and watch_id not in self._in_flight]
+            for watch_id in expired:
+                del self._watches[watch_id]
+            groups = {}
+            for watch, password in self._watches.values():
+                if watch.id not in self._in_flight:
+                    groups.setdefault(watch.date, []).append((watch, password))
+            for day in list(self._days):
+                if day not in groups:
+                    del self._days[day]
+            due = [day for day in groups if self._days[day].next_poll <= now]
+        if expired:
+            close_watches("expired", "Date passed", ids=expired)
+
+        pages = self._fetcher.map(lambda day: (day, time.monotonic(), self.poll(day, groups[day])), due)
+        for day, fetched_at, html in pages:
+            if html is not None:
+                self.match(day, html, groups[day], fetched_at)
+
+    def poll(self, day, watches):
+        if POLL_ID:
+            login_id, password = POLL_ID, POLL_PASSWORD
+        else:
+            login_id, password = watches[0][0].login_id, watches[0][1]
+        now = time.monotonic()
+        try:
+            self._limiter.wait()
+            session = sessions.get(login_id, password)
+            html = get_timetable(session, day.year, day.month, day.day, session.calendar_url)
+        except Exception as e:
+            logger.warning("Watcher poll failed for %s: %s", day, e)
+            with self._lock:
+                self.poll_errors += 1
+                state = self._days.get(day)
+                if state is not None:
+                    state.interval = min(state.interval * WATCH_BACKOFF, WATCH_INTERVAL_MAX)
+                    state.next_poll = now + state.interval
+            return None
+        with self._lock:
+            self.polls += 1
+            state = self._days.get(day)
+            if state is not None:
+                state.polled(content_hash(html), now)
+        return html
+
+    def match(self, day, html, watches, fetched_at):
+        open_slots = [slot for slot in extract_timetable(html, "", "~") if "-" in slot["time"]]
+        if not open_slots:
+            return
+        capacity = {(slot["time"], slot["room"]): slot["remain"] for slot in open_slots}
+        # The page may not show seats our own bookings are taking yet
+        with self._lock:
+            self._released = [(key, at) for key, at in self._released if at > time.monotonic() - WATCH_INTERVAL_MAX]
+            held = Counter({key[1:]: count for key, count in self._holds.items() if key[0] == day})
+            held.update(key[1:] for key, at in self._released if key[0] == day and at > fetched_at)
+        for key, count in held.items():
+            if key in capacity:
+                capacity[key] -= count
+        taken = set()  # (login_id, time, room) already claimed this poll
+        # Oldest watches get the seats first
+        for watch, password in sorted(watches, key=lambda item: item[0].id):
+            slot = match_slot(open_slots, watch, capacity)
+            if slot is None or (watch.login_id, slot["time"], slot["room"]) in taken:
+                continue
+            attempts = claim_watch(watch.id)
+            if attempts is None:
+                self.remove(watch.id)  # cancelled, or taken by another process
+                continue
+            capacity[(slot["time"], slot["room"])] -= 1
+            taken.add((watch.login_id, slot["time"], slot["room"]))
+            hold = (day, slot["time"], slot["room"])
+            with self._lock:
+                self._in_flight.add(watch.id)
+                self._holds[hold] += 1
+                self._days[day].hurry(time.monotonic())
+            self._booker.submit(self.book, watch, password, html, attempts, hold)
+
+    def book(self, watch, password, html, attempts, hold):
+        status, room, error = "active", None, None
+        try:
+            session = sessions.get(watch.login_id, password)
+            slot = reserve(session, watch.target(), StepTimer(), html)
+            status, room = "booked", slot["room"]
+        except LoginError:
+            status, error = "failed", "Login failed"
+        except HTTPException as e:
+            error = str(e.detail)
+        except Exception as e:
+            error = str(e)
+
+        if status == "active" and attempts >= WATCH_MAX_ATTEMPTS:
+            status = "failed"
+        try:
+            finish_watch(watch.id, status, room, error)
+        except Exception as e:
+            logger.error("Watcher could not record watch %s: %s", watch.id, e)
+        logger.info("Watch %s (%s %s-%s): %s", watch.id, watch.date, watch.start_time, watch.end_time, status,
+                    extra={"watch_id": watch.id, "status": status, "error": error})
+
+        with self._lock:
+            self._in_flight.discard(watch.id)
+            self._holds[hold] -= 1
+            if self._holds[hold] <= 0:
+                del self._holds[hold]
+            self._released.append((hold, time.monotonic()))
+            if status == "booked":
+                self.booked += 1
+            elif status == "failed":
+                self.failed += 1
+            if status != "active":
+                self._watches.pop(watch.id, None)
+        self._wakeup.set()
+
+    def heartbeat(self):
+        # Watches whose process died can't be booked without their passwords.
+        # Done in the loop rather than in start() so startup doesn't wait on the database.
+        if time.monotonic() < self._next_heartbeat:
+            return
+        with self._lock:
+            ids = list(self._watches)
+        try:
+            closed = heartbeat_watches(ids)
+        except Exception as e:
+            logger.warning("Booking watcher heartbeat failed: %s", e)
+            return
+        if closed:
+            logger.info("Booking watcher cancelled %d abandoned watches", closed)
+        self._next_heartbeat = time.monotonic() + min(WATCH_INTERVAL_MAX, WATCH_STALE_SECONDS / 3)
+
+    def run(self):
+        while not self._stop.is_set():
+            self._wakeup.clear()
+            self.heartbeat()
+            try:
+                self.tick()
+            except Exception as e:
+                logger.exception("Booking watcher error: %s", e)
+            with self._lock:
+                polls = [state.next_poll for state in self._days.values()]
+            delay = min(polls) - time.monotonic() if polls else WATCH_INTERVAL_MAX
+            self._wakeup.wait(min(max(delay, 0.1), WATCH_INTERVAL_MAX))
+
+    def start(self):
+        self._next_heartbeat = 0.0
+        self._stop.clear()
+        self._fetcher = ThreadPoolExecutor(max_workers=WATCH_FETCH_WORKERS, thread_name_prefix="watch-poll")
+        self._booker = ThreadPoolExecutor(max_workers=WATCH_BOOKING_WORKERS, thread_name_prefix="watch-book")
+        self._thread = threading.Thread(target=self.run, name="booking-watcher", daemon=True)
+        self._thread.start()
+        return self
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def stop(self, timeout=10):
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        for pool in (self._fetcher, self._booker):
+            if pool is not None:
+                pool.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        with self._lock:
+            now = time.monotonic()
+            days = {}
+            for watch, _ in self._watches.values():
+                days.setdefault(watch.date, 0)
+                days[watch.date] += 1
+            return {
+                "running": self.running,
+                "watches": len(self._watches),
+                "booking": len(self._in_flight),
+                "polls": self.polls,
+                "poll_errors": self.poll_errors,
+                "booked": self.booked,
+                "failed": self.failed,
+                "days": [
+                    {
+                        "date": day.isoformat(),
+                        "watches": count,
+                        "interval_seconds": round(self._days[day].interval, 1) if day in self._days else None,
+                        "next_poll_in": round(max(self._days[day].next_poll - now, 0), 1) if day in self._days else None,
+                    }
+                    for day, count in sorted(days.items())
+                ],
+            }
+
+
+booking_watcher = BookingWatcher()